@@ -0,0 +1,302 @@
+import contextvars
+import io
+import os
+import tarfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+ARCHIVE_INPUT_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+# 当前会话中保持打开的归档：归档绝对路径 -> _ArchiveReader，不在会话中时为 None。
+# 每个会话有自己的字典，并发运行的会话互不影响；用 contextvars.copy_context().run 启动的
+# 工作线程继承所在会话的字典，字典的修改由 _archives_lock 保护
+_session_archives: contextvars.ContextVar[Optional[Dict[str, '_ArchiveReader']]] = \
+    contextvars.ContextVar('auto_save_code_archive_session', default=None)
+_archives_lock = threading.Lock()
+
+
+class _ArchiveReader:
+    """
+    打开的 zip/tar 归档，目录只读取一次，之后按成员名直接读取内容
+
+    zip 通过中央目录（NameToInfo）定位成员；tar 保留列目录时得到的 TarInfo，
+    按归档中的顺序读取成员时只需要顺序向前读取压缩流。
+    """
+
+    def __init__(self, archive_path: str):
+        """
+        打开归档并读取目录
+
+        :param archive_path: str, 归档文件路径
+        """
+        self.archive_path = archive_path
+        self._lock = threading.Lock()
+        self._zip = None
+        self._tar = None
+        self._tar_members: Dict[str, tarfile.TarInfo] = {}
+        if archive_path.lower().endswith('.zip'):
+            self._zip = zipfile.ZipFile(archive_path)
+            self.names = [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            # tar 没有集中目录，只能顺序读取成员头；成员内容在这里不会被读取
+            self._tar = tarfile.open(archive_path, 'r:*')
+            self.names = []
+            for member in self._tar.getmembers():
+                if member.isfile():
+                    self.names.append(member.name)
+                    self._tar_members[member.name] = member
+
+    def read(self, name: str) -> bytes:
+        """
+        读取一个成员的全部内容
+
+        :param name: str, 以 / 分隔的成员名
+        :return: bytes, 成员内容
+        """
+        with self._lock:
+            if self._zip is not None:
+                if name not in self._zip.NameToInfo:
+                    raise KeyError(name)
+                return self._zip.read(name)
+            member = self._tar_members.get(name)
+            if member is None:
+                raise KeyError(name)
+            member_file = self._tar.extractfile(member)
+            if member_file is None:
+                raise OSError(f"归档成员不是普通文件: {name}")
+            return member_file.read()
+
+    def close(self) -> None:
+        """
+        关闭归档文件
+
+        :return: None
+        """
+        with self._lock:
+            if self._zip is not None:
+                self._zip.close()
+            if self._tar is not None:
+                self._tar.close()
+
+
+@contextmanager
+def input_archive_session() -> Iterator[None]:
+    """
+    在一次运行期间保持输入归档打开，发现结构和提取代码块时共用同一个打开的归档
+
+    会话可以嵌套，嵌套的会话共用外层会话的归档，最外层会话结束时只关闭本会话打开的归档；
+    其他线程中的会话各自打开和关闭自己的归档。会话之外读取归档成员时每次单独打开归档。
+
+    :return: Iterator[None]
+    """
+    if _session_archives.get() is not None:
+        yield
+        return
+    archives: Dict[str, _ArchiveReader] = {}
+    token = _session_archives.set(archives)
+    try:
+        yield
+    finally:
+        _session_archives.reset(token)
+        with _archives_lock:
+            readers = list(archives.values())
+            archives.clear()
+        for reader in readers:
+            reader.close()
+
+
+@contextmanager
+def _archive_reader(archive_path: str) -> Iterator[_ArchiveReader]:
+    """
+    获取归档的读取器：会话中复用已打开的归档，会话之外使用后立即关闭
+
+    :param archive_path: str, 归档文件路径
+    :return: Iterator[_ArchiveReader]
+    """
+    archives = _session_archives.get()
+    reader = None
+    if archives is not None:
+        key = os.path.abspath(archive_path)
+        with _archives_lock:
+            reader = archives.get(key)
+            if reader is None:
+                reader = _ArchiveReader(archive_path)
+                archives[key] = reader
+                log_debug(f"打开输入归档: {archive_path}")
+    if reader is not None:
+        yield reader
+        return
+    reader = _ArchiveReader(archive_path)
+    try:
+        yield reader
+    finally:
+        reader.close()
+
+
+def is_archive_file(path: str) -> bool:
+    """
+    检查路径是否是可以直接读取的归档文件
+
+    :param path: str, 文件路径
+    :return: bool, 是否是 zip 或 tar 归档
+    """
+    return path.lower().endswith(ARCHIVE_INPUT_SUFFIXES) and os.path.isfile(path)
+
+
+def split_member_path(path: str) -> Optional[Tuple[str, str]]:
+    """
+    把归档成员路径拆分为归档文件路径和成员名
+
+    归档成员用 "归档路径/成员名" 表示，例如 exports/chat.zip/2024/chat.md。
+    会话中已打开的归档直接按路径匹配；只有未打开的候选归档路径才需要检查文件是否存在。
+
+    :param path: str, 文件路径
+    :return: Optional[Tuple[str, str]], (归档文件路径, 以 / 分隔的成员名)，普通文件返回 None
+    """
+    lower = path.lower()
+    candidates = []
+    for suffix in ARCHIVE_INPUT_SUFFIXES:
+        marker = suffix + os.sep
+        index = lower.find(marker)
+        while index != -1:
+            candidates.append((index + len(suffix), index + len(marker)))
+            index = lower.find(marker, index + 1)
+    if not candidates:
+        return None
+
+    candidates.sort()
+    archives = _session_archives.get() or {}
+    for archive_end, member_start in candidates:
+        if os.path.abspath(path[:archive_end]) in archives:
+            return path[:archive_end], path[member_start:].replace(os.sep, '/')
+    for archive_end, member_start in candidates:
+        if os.path.isfile(path[:archive_end]):
+            return path[:archive_end], path[member_start:].replace(os.sep, '/')
+    return None
+
+
+def is_input_file(path: str) -> bool:
+    """
+    检查路径是否是普通文件或归档成员
+
+    :param path: str, 文件路径
+    :return: bool, 是否可以作为输入文件读取
+    """
+    return os.path.isfile(path) or split_member_path(path) is not None
+
+
+def _is_safe_member_name(name: str) -> bool:
+    """
+    检查成员名是否是归档内的相对路径
+
+    :param name: str, 成员名
+    :return: bool, 是否安全
+    """
+    return bool(name) and not name.startswith('/') and '..' not in name.split('/')
+
+
+def list_archive_members(archive_path: str, matches: Callable[[str], bool]) -> List[str]:
+    """
+    列出归档中匹配的文件成员，只读取目录信息，不解压任何成员内容
+
+    zip 成员按成员名排序；tar 成员保持归档中的顺序，之后按这个顺序读取时只需顺序读取一遍压缩流。
+
+    :param archive_path: str, 归档文件路径
+    :param matches: Callable[[str], bool], 按成员文件名判断是否需要处理
+    :return: List[str], 成员路径（归档路径/成员名）
+    """
+    try:
+        with _archive_reader(archive_path) as reader:
+            names = reader.names
+    except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+        log_error(f"读取归档 {archive_path} 时出错: {str(e)}")
+        return []
+
+    member_paths = []
+    for name in (sorted(names) if archive_path.lower().endswith('.zip') else names):
+        if not _is_safe_member_name(name):
+            log_warning(f"跳过归档 {archive_path} 中不安全的成员: {name}")
+        elif matches(name.rsplit('/', 1)[-1]):
+            member_paths.append(os.path.join(archive_path, *name.split('/')))
+    log_info(f"归档 {archive_path} 中共 {len(names)} 个文件，匹配 {len(member_paths)} 个")
+    return member_paths
+
+
+def list_input_files(input_path: str, matches: Callable[[str], bool]) -> List[str]:
+    """
+    列出输入目录（不包括子目录）或输入归档中需要处理的文件
+
+    目录中的归档文件会展开为其中匹配的成员，成员文件名在解压前就完成匹配。
+
+    :param input_path: str, 输入目录或归档文件路径
+    :param matches: Callable[[str], bool], 按文件名判断是否需要处理
+    :return: List[str], 文件路径和归档成员路径列表
+    """
+    if is_archive_file(input_path):
+        return list_archive_members(input_path, matches)
+
+    file_paths = []
+    for entry in sorted(os.scandir(input_path), key=lambda entry: entry.name):
+        if not entry.is_file():
+            continue
+        if matches(entry.name):
+            file_paths.append(entry.path)
+        elif is_archive_file(entry.path):
+            file_paths.extend(list_archive_members(entry.path, matches))
+    return file_paths
+
+
+def input_mtime(path: str) -> float:
+    """
+    获取输入文件的修改时间；归档成员使用所在归档文件的修改时间
+
+    :param path: str, 文件路径或归档成员路径
+    :return: float, 修改时间戳，文件不存在时为 0
+    """
+    member = split_member_path(path)
+    try:
+        return os.path.getmtime(member[0] if member else path)
+    except OSError:
+        return 0.0
+
+
+def read_input_bytes(path: str) -> bytes:
+    """
+    读取普通文件或归档成员的全部内容；归档成员直接从归档中读取，不解压到磁盘
+
+    在 input_archive_session 中读取时复用已打开的归档，不会重新打开和扫描归档目录。
+
+    :param path: str, 文件路径或归档成员路径
+    :return: bytes, 文件内容
+    """
+    member = split_member_path(path)
+    if member is None:
+        with open(path, 'rb') as file:
+            return file.read()
+
+    archive_path, name = member
+    try:
+        with _archive_reader(archive_path) as reader:
+            return reader.read(name)
+    except KeyError:
+        raise FileNotFoundError(f"归档 {archive_path} 中不存在成员: {name}")
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise OSError(f"读取归档 {archive_path} 时出错: {str(e)}")
+
+
+def open_input_text(path: str, encoding: str = 'utf-8') -> TextIO:
+    """
+    以文本方式打开普通文件或归档成员，\r\n 和 \r 统一为 \n
+
+    普通文件按行流式读取，不会一次读入内存；归档成员需要先整体读取再按行返回。
+
+    :param path: str, 文件路径或归档成员路径
+    :param encoding: str, 编码
+    :return: TextIO, 可逐行迭代的文本文件对象
+    """
+    if split_member_path(path) is None:
+        return open(path, 'r', encoding=encoding, newline=None)
+    return io.StringIO(read_input_bytes(path).decode(encoding), newline=None)
@@ -0,0 +1,254 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import Executor
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from code_block_processor import CodeBlockProcessor
+from output_index import OutputIndex
+from archive_input import is_archive_file, input_archive_session
+from logging_utils import run_context, log_info, log_warning, log_error, log_debug
+
+
+class _OrderedCommit:
+    """
+    按输入顺序提交并发处理的文件
+
+    文件可以同时读取和解析，但写入按输入顺序生效：解析完成后先登记本文件的输出路径，
+    只有写入相同路径的更早文件写完后才开始写入，互不相关的文件仍然并行写入；
+    元数据索引、输出索引和预览列表则严格按输入顺序追加。这样多个文件写入同一路径时
+    总是顺序靠后的文件生效，每次运行得到相同的输出目录。
+    """
+
+    def __init__(self, count: int):
+        """
+        :param count: int, 本次运行的文件数
+        """
+        self._targets: List[Optional[FrozenSet[str]]] = [None] * count
+        self._dependencies: List[Set[int]] = [set() for _ in range(count)]
+        self._ready = [asyncio.Event() for _ in range(count)]
+        self._written = [asyncio.Event() for _ in range(count)]
+        self._committed = [asyncio.Event() for _ in range(count)]
+        # 输出路径 -> 按输入顺序最后一个写入该路径的文件序号
+        self._last_writer: Dict[str, int] = {}
+        self._next = 0
+
+    def parsed(self, index: int, targets: Iterable[str]) -> None:
+        """
+        登记文件解析完成后的输出路径，并按输入顺序计算每个文件需要等待的更早文件
+
+        :param index: int, 文件序号
+        :param targets: Iterable[str], 文件中代码块的输出路径
+        :return: None
+        """
+        if self._targets[index] is not None:
+            return
+        self._targets[index] = frozenset(targets)
+        # 只有之前的文件都登记后才能确定依赖，因此按顺序推进
+        while self._next < len(self._targets) and self._targets[self._next] is not None:
+            current = self._next
+            for target in self._targets[current]:
+                earlier = self._last_writer.get(target)
+                if earlier is not None:
+                    self._dependencies[current].add(earlier)
+                self._last_writer[target] = current
+            self._ready[current].set()
+            self._next += 1
+
+    async def wait_writable(self, index: int) -> None:
+        """
+        等待写入相同路径的更早文件写完
+
+        :param index: int, 文件序号
+        :return: None
+        """
+        await self._ready[index].wait()
+        for earlier in self._dependencies[index]:
+            await self._written[earlier].wait()
+
+    def written(self, index: int) -> None:
+        """
+        标记文件的代码块已写入
+        """
+        self._written[index].set()
+
+    async def wait_committable(self, index: int) -> None:
+        """
+        等待前一个文件提交完成
+
+        :param index: int, 文件序号
+        :return: None
+        """
+        if index > 0:
+            await self._committed[index - 1].wait()
+
+    def finish(self, index: int) -> None:
+        """
+        结束一个文件（包括跳过、出错和超时的文件），使后面的文件不再等待它
+
+        :param index: int, 文件序号
+        :return: None
+        """
+        self.parsed(index, ())
+        self._written[index].set()
+        self._committed[index].set()
+
+
+class AsyncCodeBlockProcessor:
+    """
+    基于 asyncio 的代码块处理编排层
+
+    包装 CodeBlockProcessor，为每个文件调度一个任务并限制并发数。文件读取和代码块写入
+    通过 run_in_executor 交给线程池执行；解析共享同一个检测器，因此在线程锁保护下逐个进行，
+    但同样在线程池中执行，不会阻塞事件循环。写入按输入文件的顺序提交（见 _OrderedCommit），
+    输出与顺序处理时相同。已经运行事件循环的工具可以直接 await 本类的方法。
+    """
+
+    def __init__(self, processor: CodeBlockProcessor, max_concurrency: Optional[int] = None,
+                 file_timeout: Optional[float] = None, executor: Optional[Executor] = None):
+        """
+        初始化异步处理器
+
+        :param processor: CodeBlockProcessor, 被包装的同步处理器
+        :param max_concurrency: Optional[int], 同时处理的最大文件数，默认读取 [Extraction] max_concurrency
+        :param file_timeout: Optional[float], 单个文件的超时时间（秒），默认读取 [Extraction] file_timeout，0 表示不限
+        :param executor: Optional[Executor], 执行阻塞 I/O 的执行器，默认使用事件循环的默认线程池
+        """
+        self.processor = processor
+        self.detector = processor.code_block_detector
+        if max_concurrency is None:
+            max_concurrency = processor.settings.max_concurrency
+        if file_timeout is None:
+            file_timeout = processor.settings.file_timeout
+        self.max_concurrency = max(1, max_concurrency)
+        self.file_timeout = file_timeout or None
+        self.executor = executor
+        # 使用线程锁而不是 asyncio.Lock：任务超时被取消后，线程池中的解析仍可能在运行
+        self._parse_lock = threading.Lock()
+        self._metadata_lock = threading.Lock()
+
+    async def _run_blocking(self, func, *args):
+        """
+        在执行器中运行阻塞函数
+
+        :param func: Callable, 要执行的函数
+        :return: Any, 函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        # run_in_executor 不会传递 contextvars，这里显式带上当前任务的日志上下文
+        return await loop.run_in_executor(self.executor, functools.partial(contextvars.copy_context().run, func, *args))
+
+    def _parse(self, file_path: str) -> Tuple[List[Tuple[str, str, str]], List[Tuple[int, int]]]:
+        """
+        在解析锁保护下用共享检测器逐行流式读取并解析文件
+        """
+        with self._parse_lock:
+            # 配置只在两次解析之间切换，不会影响正在解析的文件
+            self.processor.refresh_settings()
+            return self.detector.parse_file(file_path)
+
+    def _save_metadata(self, *args) -> None:
+        """
+        在元数据锁保护下追加写入元数据索引和输出索引
+        """
+        with self._metadata_lock:
+            self.processor.save_block_metadata(*args)
+
+    async def _read_and_parse(self, file_path: str) -> Tuple[List[Tuple[str, str, str]], List[Tuple[int, int]]]:
+        """
+        读取并解析文件，文件无法读取时返回空结果
+        """
+        return await self._run_blocking(self._parse, file_path)
+
+    async def process_file(self, file_path: str, structure_folder: str,
+                           commit: Optional[_OrderedCommit] = None, index: int = 0,
+                           timeout: Optional[float] = None,
+                           output_index: Optional[OutputIndex] = None) -> List[Tuple[str, str, str]]:
+        """
+        处理单个文件：读取、解析、保存代码块并写入元数据
+
+        超时只作用于读取和解析。开始写入后不再取消：等待更早文件、写入代码块和提交元数据
+        都会完成，已写入的代码块总是有对应的元数据和输出索引记录。
+
+        :param file_path: str, 文件路径
+        :param structure_folder: str, 结构文件夹路径
+        :param commit: Optional[_OrderedCommit], 按输入顺序提交写入的协调器，单独处理一个文件时为 None
+        :param index: int, 文件在输入顺序中的序号
+        :param timeout: Optional[float], 读取和解析的超时时间（秒），None 表示不限
+        :param output_index: Optional[OutputIndex], 本次运行的输出索引，为 None 时单独打开并提交
+        :return: List[Tuple[str, str, str]], 检测到的代码块列表
+        :raises asyncio.TimeoutError: 读取和解析超时，此时没有写入任何内容
+        """
+        code_blocks, block_locations = await asyncio.wait_for(self._read_and_parse(file_path), timeout)
+        log_info(f"代码块检测完成: {file_path}，共检测到 {len(code_blocks)} 个代码块", important=True)
+        if not code_blocks:
+            return code_blocks
+
+        target_paths = self.detector.resolve_block_targets(code_blocks, block_locations, file_path)
+        if commit is not None:
+            commit.parsed(index, (target for target in target_paths if target))
+            await commit.wait_writable(index)
+        saved_paths = await self._run_blocking(
+            self.detector.save_code_blocks, os.path.dirname(file_path), code_blocks, block_locations, file_path,
+            target_paths
+        )
+        if commit is not None:
+            commit.written(index)
+            await commit.wait_committable(index)
+        self.detector.display_code_blocks(file_path, code_blocks, block_locations, saved_paths)
+        await self._run_blocking(
+            self._save_metadata, file_path, code_blocks, structure_folder, block_locations, saved_paths, output_index
+        )
+        return code_blocks
+
+    async def process_files(self, input_dir: str, file_types: List[str], structure_folder: str, root_folder: str,
+                            project_trees: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[int, int, int]:
+        """
+        并发处理指定目录下的所有文件
+
+        :param input_dir: str, 输入目录，也可以是 zip/tar 归档文件
+        :param file_types: List[str], 要处理的文件类型列表
+        :param structure_folder: str, 结构文件夹路径
+        :param root_folder: str, 根文件夹名称
+        :param project_trees: Optional[Dict[str, Dict[str, Any]]], 多项目时的 根文件夹 -> 结构信息
+        :return: Tuple[int, int, int], 元组 (总文件数, 处理的文件数, 代码块数)
+        """
+        with run_context(), input_archive_session(), contextlib.ExitStack() as stack:
+            self.processor.set_structure_info(structure_folder, root_folder, project_trees)
+
+            if not os.path.isdir(input_dir) and not is_archive_file(input_dir):
+                log_error(f"输入目录不存在或不是一个有效的目录: {input_dir}")
+                return 0, 0, 0
+
+            file_paths = await self._run_blocking(self.processor.collect_input_files, input_dir, file_types)
+            # 元数据在 _metadata_lock 保护下写入，同一时间只有一个线程使用该索引
+            output_index = stack.enter_context(self.processor.output_index_session(structure_folder))
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            commit = _OrderedCommit(len(file_paths))
+
+            async def run_one(index: int, file_path: str) -> List[Tuple[str, str, str]]:
+                # 信号量按任务创建顺序唤醒，先获得名额的总是更早的文件，等待提交顺序不会死锁
+                async with semaphore:
+                    try:
+                        # 超时只计算本文件的读取和解析，不包括等待更早文件提交的时间
+                        return await self.process_file(file_path, structure_folder, commit, index, self.file_timeout,
+                                                       output_index)
+                    except asyncio.TimeoutError:
+                        # 已提交到线程池的解析无法中断，这里只是放弃其结果；此时本文件还没有写入任何内容
+                        log_warning(f"读取和解析文件超时 ({self.file_timeout} 秒)，已跳过: {file_path}", important=True)
+                    except Exception as e:
+                        log_error(f"处理文件时出错 {file_path}: {str(e)}")
+                    finally:
+                        commit.finish(index)
+                    return []
+
+            log_info(f"开始异步处理 {len(file_paths)} 个文件，最大并发数: {self.max_concurrency}")
+            results = await asyncio.gather(*(run_one(index, file_path) for index, file_path in enumerate(file_paths)))
+
+            total_files = len(file_paths)
+            processed_files = sum(1 for code_blocks in results if code_blocks)
+            code_block_count = sum(len(code_blocks) for code_blocks in results)
+            log_info(f"文件处理完成 - 总文件数: {total_files}, 处理的文件数: {processed_files}, 提取的代码块数: {code_block_count}")
+            return total_files, processed_files, code_block_count
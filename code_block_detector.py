@@ -1,62 +1,76 @@
 import logging
-import configparser
 import re
 import os
 import inspect
+import io
+import itertools
 import time
 import sys
-from typing import List, Dict, Any, Optional
+from typing import Iterable, List, Dict, Any, Optional, Tuple, Union
 from file_structure_extractor import FileStructureExtractor
-from logging_utils import log_info, log_warning, log_error, log_debug
+from archive_input import is_input_file, open_input_text, read_input_bytes
+from output_sinks import OutputSink, FileSystemSink
+from path_resolver import TargetPathResolver
+from structure_index import StructureSuffixIndex
+from utils import add_file_header
+from settings import Settings
+from code_buffer import CodeBuffer, SpilledCode
+from code_block_preview import build_block_references
+from logging_utils import ProgressLogger, log_stage, log_info, log_warning, log_error, log_debug
+
+# 信息字符串中的路径属性，例如 ```python title="src/main.py"
+INFO_PATH_ATTRIBUTE_PATTERN = re.compile(r'''\b(?:file|filename|path|title)=["']?([^"'\s]+)''')
+INFO_PATH_PATTERN = re.compile(r'^[^\s]*\.[A-Za-z0-9]+$')
+# 不含路径分隔符的文件名必须有以字母开头的扩展名，避免把 ```python 3.11 中的版本号当作文件名
+INFO_FILE_NAME_PATTERN = re.compile(r'^[^\s]*\.[A-Za-z][A-Za-z0-9]*$')
+# CommonMark 围栏：最多缩进三个空格，至少三个反引号或波浪线
+OPENING_FENCE_PATTERN = re.compile(r'^( {0,3})(`{3,}|~{3,})(.*)$')
+CLOSING_FENCE_PATTERN = re.compile(r'^ {0,3}(`{3,}|~{3,})[ \t]*$')
+# 解析时每隔这么多行才检查一次是否需要输出进度汇总，逐行循环中不计时
+PROGRESS_CHECK_LINES = 4096
 
 class CodeBlockDetector:
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Any):
         """
         初始化代码块检测器
 
-        :param config: Dict[str, Any], 配置信息字典
+        :param config: Union[Settings, configparser.ConfigParser], 配置快照或配置对象
         """
-        self.config = config
         log_info("CodeBlockDetector 初始化开始")
-        
-        self.start_marker = config.get('code_block_detection', 'start_marker', fallback='```')
-        self.end_marker = config.get('code_block_detection', 'end_marker', fallback='```')
-        self.min_occurrences = config.getint('code_block_detection', 'min_occurrences', fallback=2)
-        self.indentation_level = config.getint('code_block_detection', 'indentation_level', fallback=4)
-        self.file_types = self._get_file_types_from_config()
+        self.apply_settings(Settings.coerce(config))
         
         log_info("CodeBlockDetector 初始化完成")
-        log_info(f"将处理以下文件类型: {', '.join(self.file_types)}")
-        log_info(f"文件类型列表长度: {len(self.file_types)}")
+        log_info(f"将处理以下文件类型: {', '.join(sorted(self.file_types))}")
         self.gui = None
         self.structure_folder = None
         self.root_folder = None
+        self.project_trees = {}
+        self.structure_index = StructureSuffixIndex()
+        self.output_sink = None
+        self.path_resolver = None
+        self.current_file = None
+        self.code_blocks = []
+        self.block_locations = []
+        self.saved_block_paths = []
 
-    def _get_file_types_from_config(self) -> List[str]:
-        """
-        从配置中获取文件类型列表
-
-        :return: List[str], 文件类型列表
-        """
-        try:
-            file_types_str = self.config.get('FileTypes', 'types')
-        except (configparser.NoSectionError, configparser.NoOptionError):
-            file_types_str = ''
-        
-        log_info(f"从配置文件读取到的原始文件类型字符串: '{file_types_str}'")
-        file_types = [ft.strip().lower().lstrip('.') for ft in file_types_str.split(',') if ft.strip()]
-        log_info(f"处理后的文件类型列表: {file_types}")
-        return file_types
-
-    def update_file_types(self, new_file_types_str: str) -> None:
+    def apply_settings(self, settings: Settings) -> None:
         """
-        更新文件类型列表
+        切换到新的配置快照；只替换引用，不重新创建检测器
 
-        :param new_file_types_str: str, 新的文件类型字符串，以逗号分隔
+        :param settings: Settings, 配置快照
+        :return: None
         """
-        self.config.set('FileTypes', 'types', new_file_types_str)
-        self.file_types = self._get_file_types_from_config()
-        log_info(f"文件类型已更新: {', '.join(self.file_types)}")
+        self.settings = settings
+        self.start_marker = settings.start_marker
+        self.end_marker = settings.end_marker
+        self.min_occurrences = settings.min_occurrences
+        self.indentation_level = settings.indentation_level
+        self.min_fence_length = settings.min_fence_length
+        self.heading_patterns = settings.heading_patterns
+        self.heading_window = settings.heading_window
+        self.file_types = settings.file_types
+        self.spill_threshold = settings.spill_threshold
+        self.spill_dir = settings.spill_dir
 
     def set_gui(self, gui: Any) -> None:
         """
@@ -102,8 +116,11 @@ class CodeBlockDetector:
         
         log_info(f"开始检测代码块，工作路径: {os.path.abspath(file_path)}", important=True)
         self.code_blocks = []
+        self.block_locations = []
+        self.saved_block_paths = []
+        self.current_file = file_path
 
-        if not os.path.isfile(file_path):
+        if not is_input_file(file_path):
             log_error(f"错误: {file_path} 不是一个有效的文件", important=True)
             return self.code_blocks
 
@@ -118,15 +135,26 @@ class CodeBlockDetector:
         
         if self.code_blocks:
             self.save_code_blocks(os.path.dirname(file_path))
-            
-            for block_file_path, lang, code in self.code_blocks:
-                if self.gui:
-                    self.gui.display_code_block(block_file_path, lang, code)
+            self.display_code_blocks(file_path, self.code_blocks, self.block_locations, self.saved_block_paths)
         else:
             log_info("未检测到任何代码块，跳过保存操作", important=True)
         
         return self.code_blocks
 
+    def display_code_blocks(self, source_file: str, code_blocks: List[Tuple[str, str, str]],
+                            block_locations: List[Tuple[int, int]], saved_paths: List[Optional[str]]) -> None:
+        """
+        把代码块引用加入 GUI 的预览列表；只传递位置信息，代码内容在选中时才读取
+
+        :param source_file: str, 源文件路径
+        :param code_blocks: List[Tuple[str, str, str]], 代码块列表
+        :param block_locations: List[Tuple[int, int]], 代码块在源文件中的位置
+        :param saved_paths: List[Optional[str]], 代码块实际保存的路径
+        """
+        if not self.gui:
+            return
+        self.gui.add_code_blocks(build_block_references(source_file, code_blocks, block_locations, saved_paths))
+
     def process_file(self, file_path: str) -> None:
         """
         处理单个文件，查找其中的代码块
@@ -134,19 +162,174 @@ class CodeBlockDetector:
         :param file_path: str, 文件路径
         """
         log_info(f"开始处理文件: {file_path}")
+        self.code_blocks, self.block_locations = self.parse_file(file_path)
+
+    def parse_file(self, file_path: str) -> Tuple[List[Tuple[str, str, str]], List[Tuple[int, int]]]:
+        """
+        逐行流式读取并解析文件，不把整个文件读入内存；代码块超过内存上限的部分由 CodeBuffer 写入临时文件
+
+        :param file_path: str, 文件路径或归档成员路径（归档路径/成员名）
+        :return: Tuple[List[Tuple[str, str, str]], List[Tuple[int, int]]], (代码块列表, 代码块位置列表)，读取失败时为空列表
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                self.lines = file.readlines()
-            log_info(f"成功读取文件 {file_path}，共 {len(self.lines)} 行")
+            with open_input_text(file_path) as lines:
+                result = self.parse_lines(file_path, lines)
         except Exception as e:
             log_error(f"读取文件 {file_path} 时出错: {str(e)}")
-            return
+            return [], []
+        log_info(f"成功读取文件 {file_path}，共 {self.current_line} 行")
+        return result
+
+    def read_lines(self, file_path: str) -> Optional[List[str]]:
+        """
+        读取文件的所有行
+
+        :param file_path: str, 文件路径或归档成员路径（归档路径/成员名）
+        :return: Optional[List[str]], 文件内容的行列表，读取失败时返回 None
+        """
+        with log_stage('read', file_path):
+            try:
+                # 与文本模式读取文件一样，newline=None 把 \r\n 和 \r 统一为 \n
+                text = read_input_bytes(file_path).decode('utf-8')
+                lines = io.StringIO(text, newline=None).readlines()
+                log_info(f"成功读取文件 {file_path}，共 {len(lines)} 行")
+                return lines
+            except Exception as e:
+                log_error(f"读取文件 {file_path} 时出错: {str(e)}")
+                return None
+
+    def parse_lines(self, file_path: str, lines: Iterable[str]) -> Tuple[List[Tuple[str, str, str]], List[Tuple[int, int]]]:
+        """
+        解析已读取的文件内容，查找其中的代码块
+
+        按 CommonMark 的围栏规则单遍扫描：开始围栏由至少三个反引号或波浪线组成（最多缩进三个空格），
+        只有字符相同且长度不小于开始围栏的行才会结束代码块，因此四个反引号的代码块中可以包含
+        三个反引号的内容。没有文件路径的代码块同样完整跳过，其内容不会被当作围栏重新解析。
+
+        每次调用都会创建新的结果列表，返回的列表在下一次解析时不会被修改。
+
+        [Extraction] spill_threshold 是一个文件中保存在内存里的代码块的总字符数上限：
+        合计超过上限后，当前代码块和之后的代码块在解析过程中直接写入临时文件，
+        代码块列表中对应的内容为 SpilledCode。
+
+        :param file_path: str, 文件路径
+        :param lines: Iterable[str], 文件内容的行列表或逐行读取的文件对象
+        :return: Tuple[List[Tuple[str, str, str]], List[Tuple[int, int]]], (代码块列表, 代码块在源文件中的位置列表)
+        """
+        with log_stage('parse', file_path):
+            self.code_blocks = []
+            self.block_locations = []
+            self.current_file = file_path
+
+            fence = None
+            code_buffer = None
+            index = -1
+            # 已保存在内存中的代码块字符数，与 spill_threshold 比较
+            buffered = 0
+            # 同一遍扫描中记录最近一个标注了文件路径的行，遇到开始围栏时直接查用，不再向上回看
+            heading_path, heading_index = None, -1
+            progress = ProgressLogger(f"正在解析 {file_path}", {'lines': '行', 'blocks': '个代码块'})
+            try:
+                for index, line in enumerate(lines):
+                    if not index % PROGRESS_CHECK_LINES:
+                        progress.report(lines=index, blocks=len(self.code_blocks))
+                    if fence is None:
+                        fence = self.match_opening_fence(line)
+                        if fence is None:
+                            path = self.match_heading_path(line)
+                            if path:
+                                heading_path, heading_index = path, index
+                            continue
+                        self.current_line = index
+                        fence['start_line'] = index
+                        recent_heading = heading_path if index - heading_index <= self.heading_window else None
+                        fence['lang'], fence['path'] = self.find_file_path(fence['info'], recent_heading)
+                        # 没有文件路径的代码块不会被保存，只需跳过其内容
+                        code_buffer = CodeBuffer(self.spill_threshold, self.spill_dir, buffered) if fence['path'] else None
+                        continue
+
+                    if self.is_closing_fence(line, fence):
+                        code = self._finish_code_block(fence, code_buffer, index)
+                        if isinstance(code, str):
+                            buffered += len(code)
+                        fence, code_buffer = None, None
+                    elif code_buffer is not None:
+                        code_buffer.append(self._strip_fence_indent(line, fence['indent']))
+            except Exception:
+                # 读取中途出错时删除未完成代码块的临时文件
+                if code_buffer is not None:
+                    code_buffer.discard()
+                raise
+
+            if fence is not None and fence['path']:
+                code_buffer.discard()
+                log_warning(f"警告: 未找到代码块结束标记: {file_path}，代码块从第 {fence['start_line'] + 1} 行开始")
+            self.current_line = index + 1
+            return self.code_blocks, self.block_locations
+
+    def match_opening_fence(self, line: str) -> Optional[Dict[str, Any]]:
+        """
+        判断一行是否是代码块的开始围栏
+
+        :param line: str, 行内容
+        :return: Optional[Dict[str, Any]], 围栏信息 {'char', 'length', 'indent', 'info'}，不是开始围栏时返回 None
+        """
+        match = OPENING_FENCE_PATTERN.match(line)
+        if not match:
+            return None
+        indent, marker, info = match.groups()
+        if len(marker) < self.min_fence_length:
+            return None
+        info = info.strip()
+        # 反引号围栏的信息字符串中不能包含反引号，否则这是一段行内代码
+        if marker[0] == '`' and '`' in info:
+            return None
+        return {'char': marker[0], 'length': len(marker), 'indent': len(indent), 'info': info}
+
+    @staticmethod
+    def is_closing_fence(line: str, fence: Dict[str, Any]) -> bool:
+        """
+        判断一行是否结束当前代码块：字符相同、长度不小于开始围栏且后面只有空白
+
+        :param line: str, 行内容
+        :param fence: Dict[str, Any], 开始围栏信息
+        :return: bool, 是否是结束围栏
+        """
+        match = CLOSING_FENCE_PATTERN.match(line)
+        return bool(match) and match.group(1)[0] == fence['char'] and len(match.group(1)) >= fence['length']
+
+    @staticmethod
+    def _strip_fence_indent(line: str, indent: int) -> str:
+        """
+        去掉代码行开头不超过开始围栏缩进量的空格
+
+        :param line: str, 代码行
+        :param indent: int, 开始围栏的缩进量
+        :return: str, 处理后的代码行
+        """
+        if not indent:
+            return line
+        stripped = line.lstrip(' ')
+        return line[min(indent, len(line) - len(stripped)):]
+
+    def _finish_code_block(self, fence: Dict[str, Any], code_buffer: Optional[CodeBuffer],
+                           end_index: int) -> Optional[Union[str, SpilledCode]]:
+        """
+        记录一个已经结束的代码块
 
-        self.current_line = 0
-        while self.current_line < len(self.lines):
-            log_info(f"正在处理第 {self.current_line + 1} 行")
-            self.find_code_block_start(file_path)
-            self.current_line += 1
+        :param fence: Dict[str, Any], 开始围栏信息（包括起始行和文件路径）
+        :param code_buffer: Optional[CodeBuffer], 代码内容缓冲区，没有文件路径的代码块为 None
+        :param end_index: int, 结束围栏所在行的索引
+        :return: Optional[Union[str, SpilledCode]], 代码块内容，跳过的代码块返回 None
+        """
+        if not fence['path']:
+            log_debug(f"第 {fence['start_line'] + 1} 行的代码块未找到相关文件路径，跳过此代码块")
+            return None
+        code = code_buffer.finish()
+        self.code_blocks.append((fence['path'], fence['lang'], code))
+        self.block_locations.append((fence['start_line'] + 1, end_index + 1))
+        log_debug(f"提取代码块成功: {fence['path']}，第 {fence['start_line'] + 2} 行到第 {end_index} 行，共 {code_buffer.line_count} 行")
+        return code
 
     def is_valid_file_type(self, filename: str) -> bool:
         """
@@ -155,165 +338,265 @@ class CodeBlockDetector:
         :param filename: str, 文件名
         :return: bool, 是否为有效文件类型
         """
-        file_extension = os.path.splitext(filename)[1].lower().lstrip('.')
-        log_info(f"检查文件类型: {filename}, 扩展名: {file_extension}")
-        log_info(f"当前有效的文件类型列表: {self.file_types}")
-        is_valid = file_extension in self.file_types
-        log_info(f"文件 {filename} 是否为有效类型: {is_valid}")
+        is_valid = self.settings.matches_file_type(filename)
         if not is_valid:
-            log_info(f"文件类型 '{file_extension}' 不在有效列表中")
+            log_debug(f"文件 {filename} 的类型不在有效列表中: {', '.join(sorted(self.file_types))}")
         return is_valid
 
-    def find_code_block_start(self, file_path: str) -> None:
+    def match_heading_path(self, line: str) -> Optional[str]:
         """
-        查找代码块的起始标记
+        判断一行是否是标注文件路径的标题行
 
-        :param file_path: str, 文件路径
+        :param line: str, 行内容
+        :return: Optional[str], 标注的文件路径，不是标题行时返回 None
         """
-        log_info(f"开始查找代码块起始标记，当前行: {self.current_line + 1}")
-        while self.current_line < len(self.lines):
-            if self.lines[self.current_line].startswith(self.start_marker):
-                code_start = self.lines[self.current_line]
-                lang = code_start.strip('`').strip()
-                log_info(f"在第 {self.current_line + 1} 行找到代码块开始标记，语言: {lang}")
-                
-                potential_file_path = self.find_file_path()
-                
-                if potential_file_path:
-                    log_info(f"找到相关文件路径: {potential_file_path}")
-                    self.current_line += 1
-                    self.extract_code_content(file_path, potential_file_path, lang)
-                    return
-                else:
-                    log_info(f"未找到相关文件路径，跳过此代码块")
-                    self.current_line += 1
-            else:
-                self.current_line += 1
-
-    def find_file_path(self) -> Optional[str]:
-        """
-        查找相关文件路径
-
-        :return: Optional[str], 找到的文件路径，如果未找到则返回 None
-        """
-        log_info("开始查找相关文件路径")
-        for i in range(1, 3):  # 只向上搜索1到2行
-            if self.current_line - i >= 0:
-                line = self.lines[self.current_line - i]
-                file_path_pattern = r'^##\s+(.*?/.*?\.[a-zA-Z]{1,3})$'
-                match = re.match(file_path_pattern, line)
-                if match:
-                    log_info(f"在第 {self.current_line - i + 1} 行找到文件路径")
-                    return match.group(1).strip()
-        log_info("未找到相关文件路径")
+        if not line.strip():
+            return None
+        for pattern in self.heading_patterns:
+            match = pattern.match(line)
+            if match:
+                return match.group(1).strip()
         return None
 
-    def extract_code_content(self, current_file_path: str, potential_file_path: str, lang: str) -> None:
+    @staticmethod
+    def parse_info_string(info: str) -> Tuple[str, Optional[str]]:
         """
-        提取代码内容
+        从围栏的信息字符串中解析语言和文件路径
+
+        支持 python:src/main.py、python src/main.py、python title="src/main.py" 以及只写路径的 src/main.py。
 
-        :param current_file_path: str, 当前文件路径
-        :param potential_file_path: str, 潜在的件路径
-        :param lang: str, 代码语言
+        :param info: str, 信息字符串
+        :return: Tuple[str, Optional[str]], (语言, 文件路径)，没有路径时路径为 None
         """
-        log_info(f"开始提取代码内容，当前行: {self.current_line + 1}")
-        code_lines = []
-        start_line = self.current_line
-        while self.current_line < len(self.lines) and not self.lines[self.current_line].startswith(self.end_marker):
-            code_lines.append(self.lines[self.current_line])
-            self.current_line += 1
+        words = info.split()
+        if not words:
+            return '', None
+        first = words[0]
+        attribute = INFO_PATH_ATTRIBUTE_PATTERN.search(info)
+        if ':' in first:
+            lang, _, path = first.partition(':')
+            return lang, path or (attribute.group(1) if attribute else None)
+        if attribute:
+            return first, attribute.group(1)
+        if '/' in first and INFO_PATH_PATTERN.match(first):
+            return '', first
+        if len(words) > 1 and (('/' in words[1] and INFO_PATH_PATTERN.match(words[1]))
+                               or INFO_FILE_NAME_PATTERN.match(words[1])):
+            return first, words[1]
+        return first, None
+
+    def find_file_path(self, info: str, recent_heading: Optional[str] = None) -> Tuple[str, Optional[str]]:
+        """
+        确定代码块的语言和文件路径：优先使用信息字符串中的路径，其次使用紧邻的标题行
 
-        if self.current_line < len(self.lines) and self.lines[self.current_line].startswith(self.end_marker):
-            code = ''.join(code_lines)
-            self.code_blocks.append((potential_file_path, lang, code))
-            log_info(f"提取代码块成功: {potential_file_path}")
-            log_info(f"代码块范围: 第 {start_line + 1} 行到第 {self.current_line} 行")
-            log_info(f"代码块长度: {len(code_lines)} 行")
-        else:
-            log_warning(f"警告: 未找到代码块结束标记: {current_file_path}")
-
-    def update_config(self, new_config: Dict[str, Any]) -> None:
-        """
-        更新配置
-
-        :param new_config: Dict[str, Any], 新的配置信息
-        """
-        log_info("更新 CodeBlockDetector 配置")
-        for section, options in new_config.items():
-            if section.upper() != 'DEFAULT':
-                if not self.config.has_section(section):
-                    self.config.add_section(section)
-                for option, value in options.items():
-                    self.config.set(section, option, str(value))
-            else:
-                for option, value in options.items():
-                    self.config.set(section, option, str(value))
-
-        self.start_marker = self.config.get('code_block_detection', 'start_marker', fallback=self.start_marker)
-        self.end_marker = self.config.get('code_block_detection', 'end_marker', fallback=self.end_marker)
-        self.min_occurrences = self.config.getint('code_block_detection', 'min_occurrences', fallback=self.min_occurrences)
-        self.indentation_level = self.config.getint('code_block_detection', 'indentation_level', fallback=self.indentation_level)
-        self.file_types = self._get_file_types_from_config()
-        log_info("CodeBlockDetector 配置已更新")
-        log_info(f"更新后将处理以下文件类型: {', '.join(self.file_types)}")
-        log_info(f"更新后文件类型列表长度: {len(self.file_types)}")
-            
-    def save_code_blocks(self, base_path: str) -> None:
+        :param info: str, 开始围栏的信息字符串
+        :param recent_heading: Optional[str], 开始围栏前 heading_window 行内最近的标题行路径
+        :return: Tuple[str, Optional[str]], (语言, 文件路径)，未找到路径时路径为 None
         """
-        保存检测到的代码块
+        lang, path = self.parse_info_string(info)
+        return lang, path or recent_heading
 
-        :param base_path: str, 基础路径
+    def resolve_block_targets(self, code_blocks: List[Tuple[str, str, str]], block_locations: List[Tuple[int, int]],
+                              source_file: Optional[str]) -> List[Optional[str]]:
         """
-        log_info(f"准备保存代码块，基础路径: {base_path}")
-        log_info(f"使用 structure_folder: {self.structure_folder}")
-        log_info(f"使用 root_folder: {self.root_folder}")
+        在保存之前解析每个代码块的输出路径，不写入任何文件
 
-        if not self.structure_folder or not self.root_folder:
-            log_error("错误: 文件结构信息未设置", important=True)
-            return
+        :param code_blocks: List[Tuple[str, str, str]], 代码块列表
+        :param block_locations: List[Tuple[int, int]], 代码块在源文件中的位置
+        :param source_file: Optional[str], 代码块所在的源文件
+        :return: List[Optional[str]], 每个代码块的输出路径，无法解析的为 None（保存时再报告错误）
+        """
+        path_resolver = self.get_path_resolver()
+        targets = []
+        for index, (relative_path, _, _) in enumerate(code_blocks):
+            source_line = block_locations[index][0] if index < len(block_locations) else 0
+            try:
+                root_folder, project_path = self.resolve_project_root(relative_path, source_file, source_line)
+                targets.append(path_resolver.resolve(root_folder, project_path))
+            except ValueError:
+                targets.append(None)
+        return targets
+
+    def save_code_blocks(self, base_path: str, code_blocks: Optional[List[Tuple[str, str, str]]] = None,
+                         block_locations: Optional[List[Tuple[int, int]]] = None,
+                         source_file: Optional[str] = None,
+                         target_paths: Optional[List[Optional[str]]] = None) -> List[Optional[str]]:
+        """
+        保存检测到的代码块
 
-        log_info("开始保存代码块到文件", important=True)
-        log_info(f"基础路径: {os.path.abspath(base_path)}")
-        
-        full_path = os.path.join(base_path, self.structure_folder, self.root_folder)
-        log_info(f"调整后的基础路径: {os.path.abspath(full_path)}")
+        :param base_path: str, 源文件所在目录（只用于日志，保存路径总是相对于结构文件夹）
+        :param code_blocks: Optional[List[Tuple[str, str, str]]], 要保存的代码块，默认为最近一次检测的结果
+        :param block_locations: Optional[List[Tuple[int, int]]], 代码块在源文件中的位置
+        :param source_file: Optional[str], 代码块所在的源文件
+        :param target_paths: Optional[List[Optional[str]]], resolve_block_targets 预先解析的输出路径，避免重复解析
+        :return: List[Optional[str]], 每个代码块实际保存的路径，保存失败的为 None
+        """
+        use_current = code_blocks is None
+        if use_current:
+            code_blocks = self.code_blocks
+            block_locations = self.block_locations
+            source_file = self.current_file
+        block_locations = block_locations or []
+        with log_stage('save', source_file):
+            saved_block_paths = []
+            log_info(f"准备保存代码块，基础路径: {base_path}")
+            log_info(f"使用 structure_folder: {self.structure_folder}")
+            log_info(f"使用 root_folder: {self.root_folder}")
+
+            if not self.structure_folder or not self.root_folder:
+                log_error("错误: 文件结构信息未设置", important=True)
+                return saved_block_paths
+
+            log_info("开始保存代码块到文件", important=True)
+            path_resolver = self.get_path_resolver()
+            progress = ProgressLogger(f"正在保存 {source_file or base_path} 中的代码块", {'blocks': '个代码块', 'bytes': '字节'})
         
-        for relative_path, lang, code in self.code_blocks:
-            try:
-                full_path = os.path.abspath(os.path.join(full_path, relative_path.lstrip('/')))
-                
-                log_info(f"处理代码块:")
-                log_info(f"  相对路径: {relative_path}")
-                log_info(f"  完整路径: {full_path}")
-                log_info(f"  语言: {lang}")
-                
-                dir_path = os.path.dirname(full_path)
-                os.makedirs(dir_path, exist_ok=True)
+            for index, (relative_path, lang, code) in enumerate(code_blocks):
+                saved_block_paths.append(None)
+                full_path = relative_path
+                try:
+                    if target_paths and index < len(target_paths) and target_paths[index]:
+                        full_path = target_paths[index]
+                    else:
+                        source_line = block_locations[index][0] if index < len(block_locations) else 0
+                        root_folder, project_path = self.resolve_project_root(relative_path, source_file, source_line)
+                        # 路径总是相对于输出根目录解析，不会叠加到上一个代码块或源文件所在的目录上
+                        full_path = path_resolver.resolve(root_folder, project_path)
+                    log_debug(f"处理代码块: 相对路径 {relative_path}，完整路径 {full_path}，语言 {lang}")
                 
-                file_exists = os.path.exists(full_path)
+                    file_exists = path_resolver.exists(full_path)
                 
-                with open(full_path, 'w', encoding='utf-8') as f:
+                    header_lines = [f"File: {relative_path}", f"Language: {lang}"]
                     if not file_exists:
-                        f.write(f"# 此文件不是文件结构中指定的文件，当前保存路径是：{full_path}\n")
-                    f.write(f"# File: {relative_path}\n")
-                    f.write(f"# Language: {lang}\n")
-                    f.write(code)
+                        header_lines.insert(0, f"此文件不是文件结构中指定的文件，当前保存路径是：{full_path}")
+                    if isinstance(code, SpilledCode):
+                        # 大代码块从临时文件分块写入，文件头只取决于第一行
+                        header = add_file_header(full_path, code.first_line, header_lines)
+                        chunks = itertools.chain([header], code.iter_chunks(skip_first_line=True))
+                        file_size = path_resolver.write_chunks(full_path, chunks)
+                    else:
+                        content = add_file_header(full_path, code, header_lines)
+                        file_size = path_resolver.write_text(full_path, content)
                 
-                log_info(f"成功保存代码块到文件: {full_path}", important=True)
-                if not file_exists:
-                    log_info(f"新创建的文件: {full_path}", important=True)
-                log_info(f"文件大小: {os.path.getsize(full_path)} 字节")
-            except Exception as e:
-                log_error(f"保存代码块到文件时出错:", important=True)
-                log_error(f"  目标路径: {full_path}")
-                log_error(f"  错误信息: {str(e)}")
+                    saved_block_paths[-1] = full_path
+                    log_debug(f"成功保存代码块到文件: {full_path}，{'新创建的文件，' if not file_exists else ''}文件大小: {file_size} 字节")
+                    progress.add(blocks=1, bytes=file_size)
+                except Exception as e:
+                    log_error(f"保存代码块到文件时出错:", important=True)
+                    log_error(f"  目标路径: {full_path}")
+                    log_error(f"  错误信息: {str(e)}")
+
+            log_info(f"代码块保存完成: 成功 {progress.counts['blocks']} 个，失败 {len(code_blocks) - progress.counts['blocks']} 个，"
+                     f"共 {progress.counts['bytes']} 字节", important=True)
+            if use_current:
+                self.saved_block_paths = saved_block_paths
+            return saved_block_paths
+
+    def resolve_project_root(self, relative_path: str, source_file: Optional[str], source_line: int) -> Tuple[str, str]:
+        """
+        确定代码块属于哪个项目结构
+
+        路径（可以是部分路径，例如 app/__init__.py）在文件结构中只对应一个声明文件时直接使用该文件；
+        对应多个声明文件时优先选择路由到的项目中的文件，仍无法确定时记录警告并按原路径保存；
+        没有对应的声明文件时按 _route_project_root 的规则路由。
+
+        :param relative_path: str, 代码块标注的文件路径
+        :param source_file: Optional[str], 代码块所在的源文件
+        :param source_line: int, 代码块在源文件中的行号
+        :return: Tuple[str, str], (根文件夹名称, 相对于根文件夹的路径)
+        """
+        parts = [part for part in relative_path.replace('\\', '/').split('/') if part]
+        relative = '/'.join(parts)
+        if not self.project_trees or not parts:
+            return self.root_folder, relative
+
+        matches = self.structure_index.find(relative)
+        if len(matches) == 1:
+            return matches[0]
+
+        routed = self._route_project_root(parts, source_file, source_line)
+        if len(matches) > 1 and routed not in matches:
+            in_root = [match for match in matches if match[0] == routed[0]]
+            if len(in_root) == 1:
+                return in_root[0]
+            log_warning(f"代码块路径 {relative_path} 对应文件结构中的多个文件: "
+                        f"{', '.join('/'.join(match) for match in matches)}，按原路径保存")
+        return routed
+
+    def _route_project_root(self, parts: List[str], source_file: Optional[str], source_line: int) -> Tuple[str, str]:
+        """
+        为文件结构中没有声明的路径选择项目
+
+        依次按以下规则路由：路径以某个项目根目录名开头；路径的第一级目录只出现在一个项目的顶层；
+        同一源文件中位于代码块之前最近的项目结构；默认根文件夹。
+
+        :param parts: List[str], 代码块路径的片段
+        :param source_file: Optional[str], 代码块所在的源文件
+        :param source_line: int, 代码块在源文件中的行号
+        :return: Tuple[str, str], (根文件夹名称, 相对于根文件夹的路径)
+        """
+        relative = '/'.join(parts)
+        if len(parts) > 1 and parts[0] in self.project_trees:
+            return parts[0], '/'.join(parts[1:])
+
+        owners = [root for root, tree in self.project_trees.items() if parts[0] in tree.get('top_level', ())]
+        if len(owners) == 1:
+            return owners[0], relative
+
+        if source_file:
+            source_file = os.path.abspath(source_file)
+            candidates = sorted(
+                (tree.get('line', 0), root) for root, tree in self.project_trees.items()
+                if tree.get('source_file') and os.path.abspath(tree['source_file']) == source_file
+                and (not owners or root in owners)
+            )
+            preceding = [candidate for candidate in candidates if candidate[0] <= source_line]
+            if preceding:
+                return preceding[-1][1], relative
+            if candidates:
+                return candidates[0][1], relative
+
+        if owners:
+            return owners[0], relative
+        return self.root_folder, relative
+
+    def set_output_sink(self, output_sink: Optional[OutputSink],
+                        path_resolver: Optional[TargetPathResolver] = None) -> None:
+        """
+        设置代码块的输出写入器；为 None 时直接写入输出目录
 
-    def set_structure_info(self, structure_folder: str, root_folder: str) -> None:
+        :param output_sink: Optional[OutputSink], 输出写入器
+        :param path_resolver: Optional[TargetPathResolver], 与结构文件共用的路径解析器，默认为输出写入器新建一个
+        """
+        self.output_sink = output_sink
+        if path_resolver is None and output_sink is not None:
+            path_resolver = TargetPathResolver(output_sink)
+        self.path_resolver = path_resolver
+
+    def get_path_resolver(self) -> TargetPathResolver:
+        """
+        获取本次运行的路径解析器；没有设置输出写入器时为结构文件夹创建一个直接写入目录的解析器
+
+        :return: TargetPathResolver, 路径解析器
+        """
+        resolver = self.path_resolver
+        if resolver is None or resolver.root_dir != os.path.abspath(self.structure_folder):
+            resolver = TargetPathResolver(FileSystemSink(self.structure_folder))
+            self.path_resolver = resolver
+        return resolver
+
+    def set_structure_info(self, structure_folder: str, root_folder: str,
+                           project_trees: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
         """
         设置结构文件夹和根文件夹信息
 
         :param structure_folder: str, 结构文件夹路径
-        :param root_folder: str, 根文件夹名称
+        :param root_folder: str, 默认根文件夹名称
+        :param project_trees: Optional[Dict[str, Dict[str, Any]]], 多项目时的 根文件夹 -> 结构信息
         """
         self.structure_folder = structure_folder
-        self.root_folder = root_folder
\ No newline at end of file
+        self.root_folder = root_folder
+        self.project_trees = project_trees or {}
+        self.structure_index = StructureSuffixIndex()
+        for root, tree in self.project_trees.items():
+            self.structure_index.add_tree(root, tree.get('files', ()))
\ No newline at end of file
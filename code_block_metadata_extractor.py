@@ -1,20 +1,116 @@
 from logging_utils import log_info, log_warning, log_error, log_debug
 import os
-from typing import Dict, Any
+import json
+import hashlib
+from functools import cached_property
+from typing import Dict, Any, List, Optional, Tuple
+from settings import Settings
+from code_buffer import SpilledCode
+
+BLOCK_INDEX_FILE = 'block_index.jsonl'
+
+
+class BlockMetadata:
+    """
+    单个代码块的元数据
+
+    名称、语言、目标路径和源位置在创建时即确定；内容哈希、行数等字段在首次访问时计算并缓存，
+    写入元数据索引和输出索引时共用同一次计算结果。两个索引都需要这些字段，因此写入磁盘时
+    每个代码块都会计算一次；输出不写入磁盘时不会创建元数据对象，也就不会计算。
+    """
+
+    def __init__(self, source_file: str, target_path: str, language: str, code: str,
+                 start_line: int, end_line: int, output_path: Optional[str] = None):
+        """
+        初始化代码块元数据
+
+        :param source_file: str, 代码块所在的源文件路径
+        :param target_path: str, 代码块标注的目标文件路径
+        :param language: str, 代码语言
+        :param code: Union[str, SpilledCode], 代码内容，大代码块为临时文件中的内容
+        :param start_line: int, 代码块开始标记所在行（从1开始）
+        :param end_line: int, 代码块结束标记所在行（从1开始）
+        :param output_path: Optional[str], 代码块实际保存的路径
+        """
+        self.source_file = source_file
+        self.target_path = target_path
+        self.language = language
+        self.code = code
+        self.start_line = start_line
+        self.end_line = end_line
+        self.output_path = output_path
+
+    @cached_property
+    def size(self) -> int:
+        """
+        代码内容的 UTF-8 字节数
+        """
+        if isinstance(self.code, SpilledCode):
+            return self.code.size
+        return len(self.code.encode('utf-8'))
+
+    @cached_property
+    def line_count(self) -> int:
+        """
+        代码内容的总行数
+        """
+        if isinstance(self.code, SpilledCode):
+            return self.code.line_count
+        if not self.code:
+            return 0
+        return self.code.count('\n') + (0 if self.code.endswith('\n') else 1)
+
+    @cached_property
+    def blank_line_count(self) -> int:
+        """
+        代码内容中的空行数
+        """
+        if isinstance(self.code, SpilledCode):
+            return self.code.blank_line_count
+        return sum(1 for line in self.code.splitlines() if not line.strip())
+
+    @cached_property
+    def content_hash(self) -> str:
+        """
+        代码内容的 SHA-256 哈希
+        """
+        if isinstance(self.code, SpilledCode):
+            return self.code.sha256
+        return hashlib.sha256(self.code.encode('utf-8')).hexdigest()
+
+    def to_record(self) -> Dict[str, Any]:
+        """
+        转换为可写入索引的字典（会计算并缓存内容哈希和行数等字段）
+
+        :return: Dict[str, Any], 元数据记录
+        """
+        return {
+            'target_path': self.target_path,
+            'output_path': self.output_path,
+            'language': self.language,
+            'source_file': self.source_file,
+            'start_line': self.start_line,
+            'end_line': self.end_line,
+            'size': self.size,
+            'lines': self.line_count,
+            'blank_lines': self.blank_line_count,
+            'sha256': self.content_hash,
+        }
+
 
 class CodeBlockMetadataExtractor:
     """
     代码块元数据提取器类
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Any):
         """
         初始化代码块元数据提取器
 
-        :param config: Dict[str, Any], 配置信息字典
+        :param config: Union[Settings, configparser.ConfigParser], 配置快照或配置对象
         """
-        self.config = config
         self.gui = None
+        self.apply_settings(Settings.coerce(config))
         log_info("CodeBlockMetadataExtractor 初始化完成")
 
     def set_gui(self, gui: Any) -> None:
@@ -33,25 +129,119 @@ class CodeBlockMetadataExtractor:
         :param file_path: str, 文件路径
         :return: Dict[str, Any], 元数据字典
         """
-        log_info(f"开始提取元数据: {file_path}")
+        stat = os.stat(file_path)
         metadata = {
             'file_name': os.path.basename(file_path),
-            'file_size': os.path.getsize(file_path),
-            'last_modified': os.path.getmtime(file_path)
+            'file_size': stat.st_size,
+            'last_modified': stat.st_mtime
         }
-        # 可以添加更多元数据提取逻辑
-        log_info(f"元数据提取完成: {file_path}")
+        log_debug(f"元数据提取完成: {file_path}")
         return metadata
 
-    def update_config(self, new_config: Dict[str, Any]) -> None:
+    def build_block_metadata(self, source_file: str, code_blocks: List[Tuple[str, str, str]],
+                             locations: List[Tuple[int, int]],
+                             output_paths: Optional[List[Optional[str]]] = None) -> List[BlockMetadata]:
+        """
+        为一个源文件中检测到的代码块创建元数据对象
+
+        :param source_file: str, 源文件路径
+        :param code_blocks: List[Tuple[str, str, str]], 代码块列表 (目标路径, 语言, 代码)
+        :param locations: List[Tuple[int, int]], 每个代码块在源文件中的 (开始行, 结束行)
+        :param output_paths: Optional[List[Optional[str]]], 每个代码块实际保存的路径
+        :return: List[BlockMetadata], 元数据对象列表
+        """
+        records = []
+        for i, (target_path, lang, code) in enumerate(code_blocks):
+            start_line, end_line = locations[i] if i < len(locations) else (0, 0)
+            output_path = output_paths[i] if output_paths and i < len(output_paths) else None
+            records.append(BlockMetadata(source_file, target_path, lang, code, start_line, end_line, output_path))
+        return records
+
+    def get_index_path(self, output_root: str) -> str:
+        """
+        获取输出根目录下的元数据索引文件路径
+
+        :param output_root: str, 输出根目录
+        :return: str, 索引文件路径
+        """
+        return os.path.join(output_root, self.index_file)
+
+    def save_block_index(self, output_root: str, records: List[BlockMetadata]) -> Optional[str]:
+        """
+        将代码块元数据追加写入输出根目录下的 JSON-lines 索引
+
+        :param output_root: str, 输出根目录
+        :param records: List[BlockMetadata], 元数据对象列表
+        :return: Optional[str], 索引文件路径，写入失败时返回 None
+        """
+        if not records:
+            return None
+        index_path = self.get_index_path(output_root)
+        try:
+            with open(index_path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record.to_record(), ensure_ascii=False, separators=(',', ':')))
+                    f.write('\n')
+        except OSError as e:
+            log_error(f"写入代码块元数据索引时出错 {index_path}: {str(e)}")
+            return None
+        log_info(f"已写入 {len(records)} 条代码块元数据到: {index_path}")
+        return index_path
+
+    @staticmethod
+    def load_block_index(index_path: str) -> Dict[str, Dict[str, Any]]:
+        """
+        读取 JSON-lines 索引，按实际输出路径返回最后一条记录
+
+        标注的目标路径可能被多个转录文件或项目重复使用，因此以输出路径（相对于索引所在的输出根目录）
+        为键，不同运行的索引可以直接比较；没有保存成功的代码块没有输出路径，不会出现在结果中。
+
+        :param index_path: str, 索引文件路径
+        :return: Dict[str, Dict[str, Any]], 以 / 分隔的相对输出路径 -> 元数据记录
+        """
+        index = {}
+        if not os.path.isfile(index_path):
+            return index
+        output_root = os.path.dirname(os.path.abspath(index_path))
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    log_warning(f"忽略无法解析的索引行: {index_path}")
+                    continue
+                output_path = record.get('output_path')
+                if output_path:
+                    index[os.path.relpath(output_path, output_root).replace(os.sep, '/')] = record
+        return index
+
+    @staticmethod
+    def changed_blocks(old_index: Dict[str, Dict[str, Any]], new_index: Dict[str, Dict[str, Any]]) -> Dict[str, List[str]]:
+        """
+        比较两次运行的索引，找出新增、修改和删除的代码块
+
+        :param old_index: Dict[str, Dict[str, Any]], 旧索引
+        :param new_index: Dict[str, Dict[str, Any]], 新索引
+        :return: Dict[str, List[str]], 包含 'added'、'modified'、'removed' 三个相对输出路径列表
+        """
+        added = sorted(path for path in new_index if path not in old_index)
+        removed = sorted(path for path in old_index if path not in new_index)
+        modified = sorted(path for path, record in new_index.items()
+                          if path in old_index and old_index[path].get('sha256') != record.get('sha256'))
+        return {'added': added, 'modified': modified, 'removed': removed}
+
+    def apply_settings(self, settings: Settings) -> None:
         """
-        更新配置
+        切换到新的配置快照
 
-        :param new_config: Dict[str, Any], 新的配置信息
+        :param settings: Settings, 配置快照
         :return: None
         """
-        self.config = new_config
-        log_info("CodeBlockMetadataExtractor 配置已更新")
+        self.settings = settings
+        self.index_file = settings.block_index_file or BLOCK_INDEX_FILE
 
     def set_structure_info(self, structure_folder: str, root_folder: str) -> None:
         """
@@ -64,4 +254,4 @@ class CodeBlockMetadataExtractor:
         self.structure_folder = structure_folder
         self.root_folder = root_folder
         log_info(f"设置结构文件夹: {structure_folder}")
-        log_info(f"设置根文件夹: {root_folder}")
\ No newline at end of file
+        log_info(f"设置根文件夹: {root_folder}")
@@ -0,0 +1,158 @@
+import contextvars
+import itertools
+import os
+import queue
+import threading
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+from archive_input import open_input_text
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+# 读取线程每次放入队列的行数
+READ_BATCH_LINES = 4096
+
+_DONE = object()
+_END_OF_FILE = object()
+
+
+class CodeBlockPipeline:
+    """
+    流水线式的代码块处理器
+
+    读取、解析、保存分为三个阶段：读取线程逐行读取文件并按批放入队列，解析在调用线程中进行，
+    写入线程把代码块保存到磁盘。阶段之间用有界队列连接，队列满时上游阶段阻塞等待，
+    从而在读取的同时解析和写入，且内存中最多只保留有限批的行，不会把整个文件读入内存。
+    """
+
+    def __init__(self, detector: Any, queue_size: int = 4):
+        """
+        初始化流水线
+
+        :param detector: CodeBlockDetector, 用于解析和保存代码块的检测器
+        :param queue_size: int, 每个阶段之间队列的最大长度（读取队列中为行的批数）
+        """
+        self.detector = detector
+        self.queue_size = max(1, queue_size)
+
+    def run(self, file_paths: List[str],
+            on_saved: Optional[Callable[[str, List[Tuple[str, str, str]], List[Tuple[int, int]], List[Optional[str]]], None]] = None,
+            before_parse: Optional[Callable[[str], None]] = None) -> int:
+        """
+        按顺序处理文件列表
+
+        :param file_paths: List[str], 要处理的文件路径
+        :param on_saved: Optional[Callable], 每个文件保存完成后在写入线程中调用，
+                         参数为 (文件路径, 代码块列表, 代码块位置列表, 保存路径列表)
+        :param before_parse: Optional[Callable[[str], None]], 每个文件解析前在解析线程中调用，参数为文件路径
+        :return: int, 检测到的代码块总数
+        """
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        totals = {'blocks': 0}
+
+        # 阶段线程在当前日志上下文（运行 ID）的副本中运行
+        reader = threading.Thread(target=contextvars.copy_context().run,
+                                  args=(self._read_stage, file_paths, read_queue), daemon=True)
+        writer = threading.Thread(target=contextvars.copy_context().run,
+                                  args=(self._write_stage, write_queue, on_saved, totals), daemon=True)
+        reader.start()
+        writer.start()
+
+        log_info(f"流水线开始处理 {len(file_paths)} 个文件，队列长度: {self.queue_size}")
+        reader_done = False
+        try:
+            # 读取线程按 file_paths 的顺序放入每个文件的各批行，并以 _END_OF_FILE 结束
+            for file_path in file_paths:
+                if before_parse:
+                    before_parse(file_path)
+                lines = self._iter_lines(read_queue)
+                try:
+                    code_blocks, block_locations = self.detector.parse_lines(file_path, lines)
+                except Exception as e:
+                    log_error(f"解析文件时出错 {file_path}: {str(e)}")
+                    continue
+                finally:
+                    # 解析出错时跳过该文件剩余的行
+                    for _ in lines:
+                        pass
+                log_info(f"代码块检测完成: {file_path}，共检测到 {len(code_blocks)} 个代码块", important=True)
+                if code_blocks:
+                    write_queue.put((file_path, code_blocks, block_locations))
+        finally:
+            write_queue.put(_DONE)
+            writer.join()
+            # 异常退出时清空读取队列，避免读取线程阻塞在 put 上
+            while not reader_done:
+                reader_done = read_queue.get() is _DONE
+            reader.join()
+
+        log_info(f"流水线处理完成，共检测到 {totals['blocks']} 个代码块")
+        return totals['blocks']
+
+    @staticmethod
+    def _iter_lines(read_queue: queue.Queue) -> Iterator[str]:
+        """
+        逐行返回读取队列中当前文件的内容，直到 _END_OF_FILE
+
+        :param read_queue: queue.Queue, 读取结果队列
+        :return: Iterator[str], 文件的各行
+        :raises Exception: 读取线程读取该文件时出错
+        """
+        while True:
+            item = read_queue.get()
+            if item is _END_OF_FILE:
+                return
+            if isinstance(item, Exception):
+                # 读取线程在出错后仍会放入 _END_OF_FILE
+                while read_queue.get() is not _END_OF_FILE:
+                    pass
+                raise item
+            yield from item
+
+    def _read_stage(self, file_paths: List[str], read_queue: queue.Queue) -> None:
+        """
+        读取阶段：依次逐行读取文件，每 READ_BATCH_LINES 行作为一批放入队列，每个文件以 _END_OF_FILE 结束
+
+        :param file_paths: List[str], 要读取的文件路径
+        :param read_queue: queue.Queue, 读取结果队列
+        :return: None
+        """
+        try:
+            for file_path in file_paths:
+                try:
+                    with open_input_text(file_path) as lines:
+                        while True:
+                            batch = list(itertools.islice(lines, READ_BATCH_LINES))
+                            if not batch:
+                                break
+                            read_queue.put(batch)
+                except Exception as e:
+                    log_error(f"读取文件 {file_path} 时出错: {str(e)}")
+                    read_queue.put(e)
+                read_queue.put(_END_OF_FILE)
+        finally:
+            read_queue.put(_DONE)
+
+    def _write_stage(self, write_queue: queue.Queue, on_saved: Optional[Callable], totals: dict) -> None:
+        """
+        写入阶段：把解析出的代码块保存到磁盘
+
+        :param write_queue: queue.Queue, 待写入的代码块队列
+        :param on_saved: Optional[Callable], 保存完成后的回调
+        :param totals: dict, 统计信息
+        :return: None
+        """
+        while True:
+            item = write_queue.get()
+            if item is _DONE:
+                return
+            file_path, code_blocks, block_locations = item
+            try:
+                saved_paths = self.detector.save_code_blocks(
+                    os.path.dirname(file_path), code_blocks, block_locations, file_path
+                )
+                totals['blocks'] += len(code_blocks)
+                self.detector.display_code_blocks(file_path, code_blocks, block_locations, saved_paths)
+                if on_saved:
+                    on_saved(file_path, code_blocks, block_locations, saved_paths)
+            except Exception as e:
+                log_error(f"保存文件 {file_path} 的代码块时出错: {str(e)}")
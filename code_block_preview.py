@@ -0,0 +1,113 @@
+import io
+import itertools
+import os
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from archive_input import read_input_bytes, split_member_path
+from output_sinks import ArchiveSink, MemorySink, OutputSink
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+# 预览最多显示的行数和字符数，超过部分不会被读取
+PREVIEW_MAX_LINES = 200
+PREVIEW_MAX_CHARS = 64 * 1024
+
+
+class CodeBlockReference(NamedTuple):
+    """
+    代码块引用：只记录代码块的位置，不持有代码内容，预览时再按需读取
+    """
+
+    source_file: str
+    target_path: str
+    language: str
+    start_line: int
+    end_line: int
+    saved_path: Optional[str]
+
+    @property
+    def line_count(self) -> int:
+        """
+        代码块内容的行数（不含围栏）
+        """
+        return max(0, self.end_line - self.start_line - 1)
+
+
+def build_block_references(source_file: str, code_blocks: List[Tuple[str, str, str]],
+                           block_locations: List[Tuple[int, int]],
+                           saved_paths: List[Optional[str]]) -> List[CodeBlockReference]:
+    """
+    为一个源文件中检测到的代码块创建引用
+
+    :param source_file: str, 源文件路径
+    :param code_blocks: List[Tuple[str, str, str]], 代码块列表
+    :param block_locations: List[Tuple[int, int]], 代码块在源文件中的位置（从1开始的开始、结束围栏行）
+    :param saved_paths: List[Optional[str]], 代码块实际保存的路径
+    :return: List[CodeBlockReference], 代码块引用列表
+    """
+    references = []
+    for index, (target_path, lang, _) in enumerate(code_blocks):
+        start_line, end_line = block_locations[index] if index < len(block_locations) else (0, 0)
+        saved_path = saved_paths[index] if index < len(saved_paths) else None
+        references.append(CodeBlockReference(source_file, target_path, lang, start_line, end_line, saved_path))
+    return references
+
+
+def _take_lines(lines: Iterable[str], max_lines: int, max_chars: int) -> Tuple[str, bool]:
+    """
+    从行迭代器中取出不超过限制的内容
+
+    :param lines: Iterable[str], 行迭代器（保留换行符）
+    :param max_lines: int, 最大行数
+    :param max_chars: int, 最大字符数
+    :return: Tuple[str, bool], (预览内容, 是否被截断)
+    """
+    taken = []
+    size = 0
+    for count, line in enumerate(lines):
+        if count >= max_lines or size + len(line) > max_chars:
+            return ''.join(taken), True
+        taken.append(line)
+        size += len(line)
+    return ''.join(taken), False
+
+
+def read_block_preview(reference: CodeBlockReference, output_sink: Optional[OutputSink] = None,
+                       max_lines: int = PREVIEW_MAX_LINES, max_chars: int = PREVIEW_MAX_CHARS) -> Tuple[str, bool]:
+    """
+    按需读取代码块预览
+
+    依次尝试：内存输出（MemorySink 及归档输出）中保存的文件、磁盘上保存的文件、源文件中代码块所在的行。
+    只读取到预览上限为止，不会把整个大文件读入预览。
+
+    :param reference: CodeBlockReference, 代码块引用
+    :param output_sink: Optional[OutputSink], 本次运行的输出写入器
+    :param max_lines: int, 最大行数
+    :param max_chars: int, 最大字符数
+    :return: Tuple[str, bool], (预览内容, 是否被截断)
+    """
+    saved_path = reference.saved_path
+    if saved_path:
+        if isinstance(output_sink, (MemorySink, ArchiveSink)) and output_sink.exists(saved_path):
+            return _take_lines(io.StringIO(output_sink.read_text(saved_path)), max_lines, max_chars)
+        if os.path.isfile(saved_path):
+            with open(saved_path, 'r', encoding='utf-8', errors='replace') as f:
+                return _take_lines(f, max_lines, max_chars)
+
+    # 没有保存的文件（例如 NullSink 或保存失败）时从源文件中读取代码块内容
+    if reference.end_line <= reference.start_line:
+        return '', False
+    body_lines = itertools.islice(_iter_source_lines(reference.source_file), reference.start_line, reference.end_line - 1)
+    return _take_lines(body_lines, max_lines, max_chars)
+
+
+def _iter_source_lines(source_file: str) -> Iterable[str]:
+    """
+    逐行读取源文件；归档成员只能整体读取
+
+    :param source_file: str, 源文件路径或归档成员路径
+    :return: Iterable[str], 行迭代器
+    """
+    if split_member_path(source_file) is not None:
+        yield from io.StringIO(read_input_bytes(source_file).decode('utf-8', errors='replace'), newline=None)
+        return
+    with open(source_file, 'r', encoding='utf-8', errors='replace') as f:
+        yield from f
@@ -1,29 +1,37 @@
+import contextlib
 import logging
 from code_block_detector import CodeBlockDetector
 from code_block_metadata_extractor import CodeBlockMetadataExtractor
+from output_index import OutputIndex, output_index_session, update_output_index, OUTPUT_INDEX_FILE
+from code_block_pipeline import CodeBlockPipeline
+from archive_input import list_input_files, is_archive_file, input_mtime, input_archive_session
+from settings import Settings, SettingsManager
 import os
 import inspect
 import time
-from typing import Dict, Any, List, Tuple, Optional
-from logging_utils import log_info, log_warning, log_error, log_debug
+from typing import ContextManager, Dict, Any, Callable, List, Tuple, Optional
+from logging_utils import log_stage, run_context, log_info, log_warning, log_error, log_debug
 
 class CodeBlockProcessor:
     """
     代码块处理器类，用于处理和管理代码块的检测和元数据提取
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Any, settings_manager: Optional[SettingsManager] = None):
         """
         初始化代码块处理器
 
-        :param config: Dict[str, Any], 配置信息字典
+        :param config: Union[Settings, configparser.ConfigParser], 配置快照或配置对象
+        :param settings_manager: Optional[SettingsManager], 配置热加载管理器；提供时在每个文件开始前检查配置变化
         """
-        self.config = config
-        self.code_block_detector = CodeBlockDetector(config)
-        self.metadata_extractor = CodeBlockMetadataExtractor(config)
+        self.settings = Settings.coerce(config)
+        self.settings_manager = settings_manager
+        self.code_block_detector = CodeBlockDetector(self.settings)
+        self.metadata_extractor = CodeBlockMetadataExtractor(self.settings)
         self.gui = None
         self.structure_folder = None
         self.root_folder = None
+        self.block_observer = None
         log_info("CodeBlockProcessor 初始化完成")
 
     def set_gui(self, gui: Any) -> None:
@@ -53,84 +61,209 @@ class CodeBlockProcessor:
         log_info(f"文件处理完成: {file_path}")
         return result
 
-    def process_files(self, input_dir: str, output_dir: str, file_types: List[str], gui: Any, structure_folder: str, root_folder: str) -> Tuple[int, int, int]:
+    def process_files(self, input_dir: str, output_dir: str, file_types: List[str], gui: Any, structure_folder: str, root_folder: str,
+                      project_trees: Optional[Dict[str, Dict[str, Any]]] = None) -> Tuple[int, int, int]:
         """
         处理指定目录下的所有文件
 
-        :param input_dir: str, 输入目录
+        :param input_dir: str, 输入目录，也可以是 zip/tar 归档文件
         :param output_dir: str, 输出目录
         :param file_types: List[str], 要处理的文件类型列表
         :param gui: Any, GUI对象，用于更新进度和日志
         :param structure_folder: str, 结构文件夹路径
         :param root_folder: str, 根文件夹名称
+        :param project_trees: Optional[Dict[str, Dict[str, Any]]], 多项目时的 根文件夹 -> 结构信息，用于路由代码块
         :return: Tuple[int, int, int], 元组 (总文件数, 处理的文件数, 代码块数)
         """
-        self.set_structure_info(structure_folder, root_folder)
+        with run_context(), input_archive_session():
+            self.set_structure_info(structure_folder, root_folder, project_trees)
         
-        total_files = 0
-        processed_files = 0
-        code_block_count = 0
+            total_files = 0
+            processed_files = 0
+            code_block_count = 0
 
-        log_info(f"开始处理文件 - 输入目录: {input_dir}, 输出目录: {output_dir}")
-        log_info(f"处理的文件类型: {', '.join(file_types)}")
+            log_info(f"开始处理文件 - 输入目录: {input_dir}, 输出目录: {output_dir}")
+            log_info(f"处理的文件类型: {', '.join(file_types)}")
 
-        if not os.path.isdir(input_dir):
-            log_error(f"输入目录不存在或不是一个有效的目录: {input_dir}")
+            if not os.path.isdir(input_dir) and not is_archive_file(input_dir):
+                log_error(f"输入目录不存在或不是一个有效的目录: {input_dir}")
+                return total_files, processed_files, code_block_count
+
+            file_paths = self.collect_input_files(input_dir, file_types)
+            total_files = len(file_paths)
+
+            with self.output_index_session(structure_folder) as output_index:
+                if self.settings.pipeline:
+                    processed_files, code_block_count = self._process_files_pipelined(file_paths, structure_folder, output_index)
+                else:
+                    for file_path in file_paths:
+                        log_info(f"处理文件: {file_path}")
+                        self.refresh_settings()
+
+                        try:
+                            code_blocks = self.code_block_detector.detect_code_blocks(file_path)
+
+                            if code_blocks:
+                                processed_files += 1
+                                code_block_count += len(code_blocks)
+                                self.save_block_metadata(file_path, code_blocks, structure_folder, output_index=output_index)
+                                log_info(f"文件 {file_path} 处理完成，发现 {len(code_blocks)} 个代码块")
+                            else:
+                                log_info(f"文件 {file_path} 中未发现代码块")
+                        except Exception as e:
+                            log_error(f"处理文件时出错 {file_path}: {str(e)}")
+
+            log_info(f"目录 {input_dir} 扫描完成")
+            log_info(f"文件处理完成 - 总文件数: {total_files}, 处理的文件数: {processed_files}, 提取的代码块数: {code_block_count}")
             return total_files, processed_files, code_block_count
 
+    def collect_input_files(self, input_dir: str, file_types: List[str]) -> List[str]:
+        """
+        列出输入目录中需要处理的文件（不包括子目录）
+
+        目录中的 zip/tar 归档（或作为输入目录的归档本身）会展开为匹配的成员路径，
+        成员按文件名匹配文件类型后才会被读取，不会解压到磁盘。
+        返回顺序由 [Extraction] input_order 决定，也是多个文件写入同一路径时的写入顺序（后写入的生效）：
+        name 按文件名排序（tar 归档中的成员保持归档中的顺序），mtime 按修改时间从早到晚排序（修改时间相同的保持 name 顺序）。
+
+        :param input_dir: str, 输入目录或归档文件
+        :param file_types: List[str], 要处理的文件类型列表
+        :return: List[str], 按处理顺序排列的匹配文件路径列表
+        """
         # 预处理文件类型列表
-        processed_file_types = [ft.lower().lstrip('.') for ft in file_types]
+        processed_file_types = [ft.strip().lower().lstrip('.') for ft in file_types]
         log_info(f"处理后的文件类型列表: {processed_file_types}")
 
-        # 只扫描 input_dir 中的文件，不包括子目录
-        files = [f for f in os.listdir(input_dir) if os.path.isfile(os.path.join(input_dir, f))]
+        def matches(file_name: str) -> bool:
+            file_extension = os.path.splitext(file_name)[1].lower().lstrip('.')
+            return file_extension in processed_file_types or (not file_extension and '' in processed_file_types)
+
         log_info(f"正在扫描目录: {input_dir}")
-        log_info(f"当前目录中的文件数量: {len(files)}")
-        
-        for file in files:
-            file_extension = os.path.splitext(file)[1].lower().lstrip('.')
-            if file_extension in processed_file_types or (not file_extension and '' in processed_file_types):
-                total_files += 1
-                file_path = os.path.join(input_dir, file)
-                log_info(f"处理文件: {file_path}")
-                
-                try:
-                    code_blocks = self.code_block_detector.detect_code_blocks(file_path)
-                    
-                    if code_blocks:
-                        processed_files += 1
-                        code_block_count += len(code_blocks)
-                        log_info(f"文件 {file_path} 处理完成，发现 {len(code_blocks)} 个代码块")
-                    else:
-                        log_info(f"文件 {file_path} 中未发现代码块")
-                except Exception as e:
-                    log_error(f"处理文件时出错 {file_path}: {str(e)}")
-            else:
-                log_info(f"跳过不匹配的文件: {file} (扩展名: {file_extension})")
-
-        log_info(f"目录 {input_dir} 扫描完成")
-        log_info(f"文件处理完成 - 总文件数: {total_files}, 处理的文件数: {processed_files}, 提取的代码块数: {code_block_count}")
-        return total_files, processed_files, code_block_count
-
-    def update_config(self, new_config: Dict[str, Any]) -> None:
-        """
-        更新配置
-
-        :param new_config: Dict[str, Any], 新的配置信息
+        file_paths = list_input_files(input_dir, matches)
+        if self.settings.input_order == 'mtime':
+            # list_input_files 已按 name 顺序排列，稳定排序保证修改时间相同的文件仍按 name 顺序排列
+            file_paths.sort(key=input_mtime)
+        log_info(f"匹配的文件数量: {len(file_paths)}，处理顺序: {self.settings.input_order}")
+        return file_paths
+
+    def _process_files_pipelined(self, file_paths: List[str], structure_folder: str,
+                                 output_index: Optional[OutputIndex] = None) -> Tuple[int, int]:
+        """
+        以流水线方式处理文件：读取、解析和写入在不同阶段重叠进行
+
+        :param file_paths: List[str], 要处理的文件路径
+        :param structure_folder: str, 结构文件夹路径
+        :param output_index: Optional[OutputIndex], 本次运行的输出索引，只在写入线程中使用
+        :return: Tuple[int, int], (处理的文件数, 代码块数)
+        """
+        counts = {'files': 0}
+
+        def on_saved(file_path, code_blocks, block_locations, saved_paths):
+            counts['files'] += 1
+            self.save_block_metadata(file_path, code_blocks, structure_folder, block_locations, saved_paths, output_index)
+            log_info(f"文件 {file_path} 处理完成，发现 {len(code_blocks)} 个代码块")
+
+        queue_size = self.settings.pipeline_queue_size
+        code_block_count = CodeBlockPipeline(self.code_block_detector, queue_size).run(
+            file_paths, on_saved, before_parse=lambda file_path: self.refresh_settings()
+        )
+        return counts['files'], code_block_count
+
+    def output_index_session(self, structure_folder: str) -> ContextManager[Optional[OutputIndex]]:
+        """
+        为一次运行打开输出索引，所有文件的记录在运行结束时一次提交；输出不写入磁盘时不打开索引
+
+        :param structure_folder: str, 结构文件夹路径（输出根目录）
+        :return: ContextManager[Optional[OutputIndex]], 得到本次运行的索引，不需要索引时为 None
+        """
+        output_sink = self.code_block_detector.output_sink
+        if not structure_folder or not os.path.isdir(structure_folder) or (
+                output_sink is not None and not output_sink.writes_to_disk):
+            return contextlib.nullcontext()
+        return output_index_session(structure_folder, self.settings.output_index_file or OUTPUT_INDEX_FILE)
+
+    def save_block_metadata(self, file_path: str, code_blocks: List[Tuple[str, str, str]], structure_folder: str,
+                            block_locations: Optional[List[Tuple[int, int]]] = None,
+                            saved_paths: Optional[List[Optional[str]]] = None,
+                            output_index: Optional[OutputIndex] = None) -> None:
+        """
+        通知代码块观察者，并为刚检测并保存的代码块生成元数据，写入输出根目录下的元数据索引和输出索引
+
+        :param file_path: str, 源文件路径
+        :param code_blocks: List[Tuple[str, str, str]], 检测到的代码块列表
+        :param structure_folder: str, 结构文件夹路径（输出根目录）
+        :param block_locations: Optional[List[Tuple[int, int]]], 代码块位置，默认取检测器最近一次的结果
+        :param saved_paths: Optional[List[Optional[str]]], 代码块保存路径，默认取检测器最近一次的结果
+        :param output_index: Optional[OutputIndex], output_index_session 打开的本次运行的索引，为 None 时单独打开并提交
+        :return: None
+        """
+        with log_stage('metadata', file_path):
+            if block_locations is None:
+                block_locations = self.code_block_detector.block_locations
+            if saved_paths is None:
+                saved_paths = self.code_block_detector.saved_block_paths
+            if self.block_observer is not None:
+                self.block_observer(file_path, code_blocks, block_locations, saved_paths)
+
+            if not structure_folder or not os.path.isdir(structure_folder):
+                return
+            output_sink = self.code_block_detector.output_sink
+            if output_sink is not None and not output_sink.writes_to_disk:
+                return
+            records = self.metadata_extractor.build_block_metadata(file_path, code_blocks, block_locations, saved_paths)
+            self.metadata_extractor.save_block_index(structure_folder, records)
+            index_file = self.settings.output_index_file or OUTPUT_INDEX_FILE
+            update_output_index(structure_folder, index_file, block_records=records, index=output_index)
+
+    def apply_settings(self, settings: Settings) -> None:
+        """
+        切换到新的配置快照；检测器和元数据提取器只替换快照引用，不会重新创建
+
+        :param settings: Settings, 配置快照
         :return: None
         """
-        self.config = new_config
-        self.code_block_detector.update_config(new_config)
-        self.metadata_extractor.update_config(new_config)
+        self.settings = settings
+        self.code_block_detector.apply_settings(settings)
+        self.metadata_extractor.apply_settings(settings)
         log_info("CodeBlockProcessor 配置已更新")
 
-    def set_structure_info(self, structure_folder: str, root_folder: str) -> None:
+    def refresh_settings(self) -> None:
+        """
+        在两个文件之间检查配置文件是否变化，变化时切换到新的快照
+
+        :return: None
+        """
+        if self.settings_manager is not None:
+            self.settings_manager.watch(self)
+
+    def set_block_observer(self, observer: Optional[Callable[[str, List[Tuple[str, str, str]], List[Tuple[int, int]], List[Optional[str]]], None]]) -> None:
+        """
+        设置代码块观察者：每个源文件的代码块保存后调用，参数为 (源文件路径, 代码块列表, 代码块位置列表, 保存路径列表)
+
+        :param observer: Optional[Callable], 观察者，为 None 时取消
+        :return: None
+        """
+        self.block_observer = observer
+
+    def set_output_sink(self, output_sink: Optional[Any], path_resolver: Optional[Any] = None) -> None:
+        """
+        设置本次运行的输出写入器
+
+        :param output_sink: Optional[OutputSink], 输出写入器，为 None 时直接写入目录
+        :param path_resolver: Optional[TargetPathResolver], 与结构文件共用的路径解析器
+        :return: None
+        """
+        self.code_block_detector.set_output_sink(output_sink, path_resolver)
+
+    def set_structure_info(self, structure_folder: str, root_folder: str,
+                           project_trees: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
         """
         设置结构文件夹和根文件夹信息
 
         :param structure_folder: str, 结构文件夹路径
         :param root_folder: str, 根文件夹名称
+        :param project_trees: Optional[Dict[str, Dict[str, Any]]], 多项目时的 根文件夹 -> 结构信息
         :return: None
         """
-        self.code_block_detector.set_structure_info(structure_folder, root_folder)
+        self.code_block_detector.set_structure_info(structure_folder, root_folder, project_trees)
         log_info(f"结构信息已设置 - structure_folder: {structure_folder}, root_folder: {root_folder}")
\ No newline at end of file
@@ -0,0 +1,181 @@
+import hashlib
+import os
+import tempfile
+import weakref
+from typing import Iterator, List, Optional, Union
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+# 从临时文件读取时每次读取的字符数
+READ_CHUNK_SIZE = 1024 * 1024
+SPILL_FILE_PREFIX = 'auto_save_code_block_'
+
+
+def _remove_file(path: str) -> None:
+    """
+    删除临时文件，文件已不存在时忽略
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class SpilledCode:
+    """
+    已写入临时文件的大代码块
+
+    大小、行数、空行数和 SHA-256 在写入临时文件的同时计算，元数据不需要重新读取内容；
+    临时文件在对象被回收时删除。
+    """
+
+    def __init__(self, path: str, first_line: str, size: int, line_count: int,
+                 blank_line_count: int, sha256: str):
+        """
+        :param path: str, 临时文件路径
+        :param first_line: str, 第一行内容（包括换行符），用于在保存时确定文件头的位置
+        :param size: int, UTF-8 字节数
+        :param line_count: int, 行数
+        :param blank_line_count: int, 空行数
+        :param sha256: str, 内容的 SHA-256
+        """
+        self.path = path
+        self.first_line = first_line
+        self.size = size
+        self.line_count = line_count
+        self.blank_line_count = blank_line_count
+        self.sha256 = sha256
+        self._finalizer = weakref.finalize(self, _remove_file, path)
+
+    def iter_chunks(self, skip_first_line: bool = False) -> Iterator[str]:
+        """
+        分块读取内容
+
+        :param skip_first_line: bool, 是否跳过第一行
+        :return: Iterator[str], 内容块
+        """
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            if skip_first_line:
+                f.readline()
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    def read(self) -> str:
+        """
+        读取全部内容（只应在确实需要整个字符串时调用）
+
+        :return: str, 代码内容
+        """
+        return ''.join(self.iter_chunks())
+
+    def discard(self) -> None:
+        """
+        立即删除临时文件
+        """
+        self._finalizer()
+
+
+def code_text(code: Union[str, SpilledCode]) -> str:
+    """
+    把代码块内容统一为字符串
+
+    :param code: Union[str, SpilledCode], 代码内容或临时文件中的代码块
+    :return: str, 代码内容
+    """
+    return code.read() if isinstance(code, SpilledCode) else code
+
+
+class CodeBuffer:
+    """
+    代码块内容缓冲区
+
+    内容先保存在内存中；与同一文件中已保存在内存中的代码块合计超过阈值后，已有内容和之后的
+    每一行都直接写入临时文件，因此解析一个文件时所有代码块占用的内存合计不超过阈值。
+    """
+
+    def __init__(self, spill_threshold: int = 0, spill_dir: Optional[str] = None, buffered: int = 0):
+        """
+        :param spill_threshold: int, 写入临时文件的阈值（字符数），0 表示始终保存在内存中
+        :param spill_dir: Optional[str], 临时文件目录，默认使用系统临时目录
+        :param buffered: int, 同一文件中之前的代码块已占用的字符数，计入阈值
+        """
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or None
+        self.buffered = buffered
+        self.parts: List[str] = []
+        self.length = 0
+        self.line_count = 0
+        self._file = None
+        self._path = None
+        self._hash = None
+        self._size = 0
+        self._blank_lines = 0
+        self._first_line = None
+
+    def append(self, line: str) -> None:
+        """
+        追加一行
+
+        :param line: str, 代码行（包括换行符）
+        :return: None
+        """
+        self.line_count += 1
+        if self._file is not None:
+            self._write(line)
+            return
+        self.parts.append(line)
+        self.length += len(line)
+        if self.spill_threshold and self.buffered + self.length > self.spill_threshold:
+            self._spill()
+
+    def _spill(self) -> None:
+        """
+        把已缓冲的内容写入新的临时文件，之后的内容直接写入该文件
+        """
+        fd, self._path = tempfile.mkstemp(prefix=SPILL_FILE_PREFIX, suffix='.tmp', dir=self.spill_dir)
+        self._file = os.fdopen(fd, 'w', encoding='utf-8', newline='')
+        self._hash = hashlib.sha256()
+        parts, self.parts = self.parts, []
+        for part in parts:
+            self._write(part)
+        log_debug(f"内存中的代码块合计超过 {self.spill_threshold} 个字符，写入临时文件: {self._path}")
+
+    def _write(self, line: str) -> None:
+        """
+        写入临时文件并更新统计信息
+        """
+        if self._first_line is None:
+            self._first_line = line
+        data = line.encode('utf-8')
+        self._hash.update(data)
+        self._size += len(data)
+        if not line.strip():
+            self._blank_lines += 1
+        self._file.write(line)
+
+    def finish(self) -> Union[str, SpilledCode]:
+        """
+        结束缓冲
+
+        :return: Union[str, SpilledCode], 内容较小时为字符串，否则为临时文件中的代码块
+        """
+        if self._file is None:
+            code = ''.join(self.parts)
+            self.parts = []
+            return code
+        self._file.close()
+        self._file = None
+        return SpilledCode(self._path, self._first_line or '', self._size, self.line_count,
+                           self._blank_lines, self._hash.hexdigest())
+
+    def discard(self) -> None:
+        """
+        放弃缓冲的内容（例如文件结束时代码块仍未关闭）
+        """
+        self.parts = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            _remove_file(self._path)
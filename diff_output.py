@@ -0,0 +1,191 @@
+import difflib
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from code_buffer import code_text
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+DIFF_FORMATS = ('patch', 'files')
+PATCH_FILE = 'changes.patch'
+DIFF_SUFFIX = '.diff'
+
+# 需要比较的文件少于该数量时直接在当前进程中计算，避免启动进程池的开销
+MIN_PARALLEL_DIFFS = 8
+
+
+class DiffCollector:
+    """
+    收集一次运行中每个输出文件最终保存的代码内容
+
+    作为 CodeBlockProcessor 的代码块观察者使用：同一路径被多个代码块写入时只保留最后一次的内容，
+    与直接写入目录时的结果一致。
+    """
+
+    def __init__(self):
+        self.contents: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, file_path: str, code_blocks: List[Tuple[str, str, str]],
+            block_locations: List[Tuple[int, int]], saved_paths: List[Optional[str]]) -> None:
+        """
+        记录一个源文件中保存的代码块
+
+        :param file_path: str, 源文件路径
+        :param code_blocks: List[Tuple[str, str, str]], 代码块列表
+        :param block_locations: List[Tuple[int, int]], 代码块位置
+        :param saved_paths: List[Optional[str]], 代码块实际保存的路径，保存失败的为 None
+        :return: None
+        """
+        with self._lock:
+            for (_, _, code), saved_path in zip(code_blocks, saved_paths):
+                if saved_path:
+                    self.contents[saved_path] = code
+
+    def targets(self, structure_folder: str, strip_root: bool) -> Dict[str, str]:
+        """
+        把收集到的输出路径转换为相对于已有目录的路径
+
+        :param structure_folder: str, 本次运行的结构文件夹（输出路径的根目录）
+        :param strip_root: bool, 是否去掉第一级的项目根文件夹（只有一个项目时已有目录就是该项目）
+        :return: Dict[str, str], 以 / 分隔的相对路径 -> 代码内容
+        """
+        targets = {}
+        for saved_path, code in self.contents.items():
+            relative = os.path.relpath(saved_path, structure_folder).replace(os.sep, '/')
+            if strip_root and '/' in relative:
+                relative = relative.split('/', 1)[1]
+            targets[relative] = code_text(code)
+        return targets
+
+
+def _digest(data: bytes) -> bytes:
+    """
+    计算内容哈希
+
+    :param data: bytes, 内容
+    :return: bytes, blake2b 摘要
+    """
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def is_unchanged(existing_path: str, new_data: bytes) -> bool:
+    """
+    快速判断已有文件与新内容是否相同：先比较大小，大小相同时再比较哈希
+
+    :param existing_path: str, 已有文件路径
+    :param new_data: bytes, 新内容
+    :return: bool, 是否相同；文件不存在时返回 False
+    """
+    try:
+        if os.path.getsize(existing_path) != len(new_data):
+            return False
+        with open(existing_path, 'rb') as f:
+            return _digest(f.read()) == _digest(new_data)
+    except OSError:
+        return False
+
+
+def unified_diff(relative_path: str, existing_path: Optional[str], new_text: str) -> str:
+    """
+    生成单个文件的 unified diff
+
+    :param relative_path: str, 以 / 分隔的相对路径，用于 a/ 和 b/ 文件头
+    :param existing_path: Optional[str], 已有文件路径，为 None 表示新文件
+    :param new_text: str, 新内容
+    :return: str, diff 文本，没有差异时为空字符串
+    """
+    if existing_path is None:
+        old_lines, from_file = [], '/dev/null'
+    else:
+        with open(existing_path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+            old_lines, from_file = f.read().splitlines(keepends=True), f'a/{relative_path}'
+    new_lines = new_text.splitlines(keepends=True)
+
+    diff_lines = []
+    for line in difflib.unified_diff(old_lines, new_lines, from_file, f'b/{relative_path}'):
+        diff_lines.append(line)
+        if not line.endswith('\n'):
+            diff_lines.append('\n\\ No newline at end of file\n')
+    return ''.join(diff_lines)
+
+
+def _diff_job(job: Tuple[str, Optional[str], str]) -> Tuple[str, str]:
+    """
+    进程池中执行的比较任务
+
+    :param job: Tuple[str, Optional[str], str], (相对路径, 已有文件路径, 新内容)
+    :return: Tuple[str, str], (相对路径, diff 文本)
+    """
+    relative_path, existing_path, new_text = job
+    return relative_path, unified_diff(relative_path, existing_path, new_text)
+
+
+def compute_diffs(targets: Dict[str, str], checkout_dir: str, workers: int = 4) -> Tuple[List[Tuple[str, str]], int]:
+    """
+    把新内容与已有目录比较，生成有变化的文件的 diff
+
+    大小和哈希都相同的文件在当前进程中直接跳过，只有可能变化的文件才交给进程池计算 diff。
+
+    :param targets: Dict[str, str], 相对路径 -> 新内容
+    :param checkout_dir: str, 已有目录
+    :param workers: int, 计算 diff 的进程数
+    :return: Tuple[List[Tuple[str, str]], int], (按路径排序的 (相对路径, diff 文本) 列表, 未变化的文件数)
+    """
+    checkout_dir = os.path.abspath(checkout_dir)
+    jobs = []
+    unchanged = 0
+    for relative_path in sorted(targets):
+        new_text = targets[relative_path]
+        existing_path = os.path.join(checkout_dir, *relative_path.split('/'))
+        if not os.path.isfile(existing_path):
+            jobs.append((relative_path, None, new_text))
+        elif is_unchanged(existing_path, new_text.encode('utf-8')):
+            unchanged += 1
+        else:
+            jobs.append((relative_path, existing_path, new_text))
+
+    log_info(f"共 {len(targets)} 个文件，{unchanged} 个未变化，{len(jobs)} 个需要比较")
+    if len(jobs) < MIN_PARALLEL_DIFFS or workers <= 1:
+        results = [_diff_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_diff_job, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+    diffs = [(relative_path, diff) for relative_path, diff in results if diff]
+    # 只有换行符等被哈希检查视为不同但 difflib 认为相同的文件也算未变化
+    unchanged += len(results) - len(diffs)
+    return diffs, unchanged
+
+
+def write_diffs(diffs: List[Tuple[str, str]], output_dir: str, diff_format: str = 'patch') -> List[str]:
+    """
+    写出 diff：合并为一个补丁文件，或每个文件一个 .diff 文件（保持目录结构）
+
+    :param diffs: List[Tuple[str, str]], (相对路径, diff 文本) 列表
+    :param output_dir: str, 输出目录
+    :param diff_format: str, patch 或 files
+    :return: List[str], 写出的文件路径
+    """
+    if diff_format not in DIFF_FORMATS:
+        raise ValueError(f"不支持的 diff 输出格式: {diff_format}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    if diff_format == 'patch':
+        patch_path = os.path.join(output_dir, PATCH_FILE)
+        with open(patch_path, 'w', encoding='utf-8', newline='') as f:
+            for _, diff in diffs:
+                f.write(diff)
+        log_info(f"补丁已保存到: {patch_path}，共 {len(diffs)} 个文件", important=True)
+        return [patch_path]
+
+    written = []
+    for relative_path, diff in diffs:
+        diff_path = os.path.join(output_dir, *relative_path.split('/')) + DIFF_SUFFIX
+        os.makedirs(os.path.dirname(diff_path), exist_ok=True)
+        with open(diff_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(diff)
+        written.append(diff_path)
+    log_info(f"已在 {output_dir} 中保存 {len(written)} 个 diff 文件", important=True)
+    return written
@@ -0,0 +1,309 @@
+import os
+import hmac
+import json
+import queue
+import secrets
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import urlparse, parse_qs
+from extraction_service import ExtractionService
+from archive_input import is_archive_file
+from settings import Settings, SettingsManager
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+# 允许的监听地址：请求的 Host 头只接受本机地址，监听其他地址的服务无法处理任何请求
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost')
+# 上传文件名中不允许出现的字符：引号、路径分隔符和控制字符（包括 CR/LF）
+_UNSAFE_NAME_CHARS = frozenset('"\'\\/' + ''.join(chr(code) for code in range(32)) + chr(127))
+
+
+class ExtractionDaemon:
+    """
+    本地常驻提取服务
+
+    启动时一次性解析配置并创建若干个预热好的 ExtractionService，之后通过 HTTP
+    接收转录文本上传或目录路径，在工作线程池中执行提取并返回 JSON 结果或打包好的目录树。
+
+    除 /health 外的请求都必须携带 Authorization: Bearer <token>；Host 不是本机地址或带有
+    Origin 头（浏览器发起的跨站请求）的请求一律拒绝，/run 的输出目录限制在 [Daemon] output_root 之内。
+    """
+
+    def __init__(self, config: Any, host: Optional[str] = None, port: Optional[int] = None,
+                 workers: Optional[int] = None, settings_manager: Optional[SettingsManager] = None):
+        """
+        初始化提取服务进程
+
+        :param config: Union[Settings, configparser.ConfigParser], 配置快照或配置对象
+        :param host: Optional[str], 监听地址，默认读取 [Daemon] host，只能是本机地址
+        :param port: Optional[int], 监听端口，默认读取 [Daemon] port
+        :param workers: Optional[int], 工作线程数（同时也是预热服务实例数），默认读取 [Daemon] workers
+        :param settings_manager: Optional[SettingsManager], 配置热加载管理器，提供时各服务实例在文件之间切换到新配置
+        """
+        self.settings = Settings.coerce(config)
+        # 监听地址和线程数在启动后无法更改，只在启动时读取一次
+        self.host = host or self.settings.daemon_host
+        if self.host not in LOOPBACK_HOSTS:
+            raise ValueError(f"提取服务只能监听本机地址（{', '.join(LOOPBACK_HOSTS)}）: {self.host}")
+        self.port = port if port is not None else self.settings.daemon_port
+        self.workers = max(1, workers or self.settings.daemon_workers)
+        self.max_upload_size = self.settings.max_file_size
+        # 未配置令牌时每次启动生成一个新的随机令牌
+        self.token_generated = not self.settings.daemon_token
+        self.token = self.settings.daemon_token or secrets.token_urlsafe(32)
+        self.output_root = os.path.realpath(self.settings.daemon_output_root)
+
+        self.services = queue.Queue()
+        for _ in range(self.workers):
+            self.services.put(ExtractionService(self.settings, settings_manager))
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.server = ThreadingHTTPServer((self.host, self.port), _ExtractionRequestHandler)
+        self.server.extraction_daemon = self
+        log_info(f"提取服务已就绪: http://{self.host}:{self.server.server_address[1]}，工作线程数: {self.workers}")
+
+    def submit(self, job: Callable[[ExtractionService], Any]) -> Any:
+        """
+        在工作线程池中用一个空闲的服务实例执行任务，并等待结果
+
+        :param job: Callable[[ExtractionService], Any], 要执行的任务
+        :return: Any, 任务返回值
+        """
+        def run_job():
+            service = self.services.get()
+            try:
+                return job(service)
+            finally:
+                self.services.put(service)
+
+        return self.executor.submit(run_job).result()
+
+    def serve_forever(self) -> None:
+        """
+        持续处理请求，直到 shutdown 被调用
+
+        :return: None
+        """
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.executor.shutdown(wait=True)
+
+    def is_authorized(self, authorization: Optional[str]) -> bool:
+        """
+        检查 Authorization 头中的令牌
+
+        :param authorization: Optional[str], Authorization 请求头
+        :return: bool, 令牌是否正确
+        """
+        scheme, _, token = (authorization or '').partition(' ')
+        return scheme.lower() == 'bearer' and hmac.compare_digest(token.strip().encode('utf-8'), self.token.encode('utf-8'))
+
+    def resolve_output_dir(self, output_dir: Optional[str]) -> Optional[str]:
+        """
+        把请求中的输出目录解析到 output_root 之内
+
+        :param output_dir: Optional[str], 请求中的输出目录，相对路径相对于 output_root，为空时使用 output_root
+        :return: Optional[str], 解析后的绝对路径，不在 output_root 之内时返回 None
+        """
+        resolved = os.path.realpath(os.path.join(self.output_root, output_dir or ''))
+        if os.path.commonpath([resolved, self.output_root]) != self.output_root:
+            return None
+        return resolved
+
+    def shutdown(self) -> None:
+        """
+        停止服务
+
+        :return: None
+        """
+        self.server.shutdown()
+
+
+def _zip_directory(directory: str, target: Any) -> None:
+    """
+    把目录树写入 zip 归档，归档内路径相对于目录本身
+
+    :param directory: str, 要打包的目录
+    :param target: Any, 可写的文件对象
+    :return: None
+    """
+    with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for dir_path, _, file_names in os.walk(directory):
+            for file_name in sorted(file_names):
+                full_path = os.path.join(dir_path, file_name)
+                archive.write(full_path, os.path.relpath(full_path, directory))
+
+
+class _ExtractionRequestHandler(BaseHTTPRequestHandler):
+    """
+    提取服务的 HTTP 请求处理器
+
+    GET  /health                     服务状态
+    POST /extract                    请求体为转录文本，返回检测到的代码块（JSON）
+    POST /extract?format=zip&name=x  请求体为转录文本，运行完整流程并返回 zip 目录树
+    POST /run                        请求体为 {"input_dir", "output_dir", "format", "archive_format"}，处理本地目录
+    """
+
+    server_version = 'AutoSaveCode'
+
+    # 允许的 Host 请求头（不含端口），用于拒绝 DNS 重绑定
+    ALLOWED_HOSTS = LOOPBACK_HOSTS
+
+    @property
+    def daemon(self) -> ExtractionDaemon:
+        """
+        所属的提取服务
+        """
+        return self.server.extraction_daemon
+
+    def log_message(self, format: str, *args) -> None:
+        """
+        把访问日志写入调试日志，而不是标准错误输出
+        """
+        log_debug(f"HTTP {self.address_string()} {format % args}")
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        """
+        发送 JSON 响应
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_zip(self, directory: str, name: str) -> None:
+        """
+        把目录树打包到临时文件后分块发送，避免整个归档驻留内存
+        """
+        with tempfile.TemporaryFile() as buffer:
+            _zip_directory(directory, buffer)
+            size = buffer.tell()
+            buffer.seek(0)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('Content-Disposition', f'attachment; filename="{name}.zip"')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            shutil.copyfileobj(buffer, self.wfile)
+
+    def _check_request(self, require_token: bool = True) -> bool:
+        """
+        检查 Host、Origin 和令牌；不通过时直接发送 403/401 并返回 False
+        """
+        host = (self.headers.get('Host') or '').strip().lower().rsplit(':', 1)[0]
+        if host not in self.ALLOWED_HOSTS or self.headers.get('Origin') is not None:
+            log_warning(f"拒绝来自 {self.address_string()} 的请求: Host={self.headers.get('Host')}, Origin={self.headers.get('Origin')}")
+            self._send_json(403, {'error': '只接受来自本机的非浏览器请求'})
+            return False
+        if require_token and not self.daemon.is_authorized(self.headers.get('Authorization')):
+            self._send_json(401, {'error': '缺少或错误的令牌'})
+            return False
+        return True
+
+    def _read_body(self) -> Optional[bytes]:
+        """
+        读取请求体；Content-Length 缺失或无效时返回 400，超过大小限制时返回 413，两种情况都返回 None
+        """
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_json(400, {'error': '缺少或无效的 Content-Length'})
+            return None
+        if length > self.daemon.max_upload_size:
+            self._send_json(413, {'error': f'请求体超过 {self.daemon.max_upload_size} 字节'})
+            return None
+        return self.rfile.read(length)
+
+    def do_GET(self) -> None:
+        if not self._check_request(require_token=False):
+            return
+        if urlparse(self.path).path == '/health':
+            self._send_json(200, {'status': 'ok', 'workers': self.daemon.workers})
+        else:
+            self._send_json(404, {'error': '未知路径'})
+
+    def do_POST(self) -> None:
+        if not self._check_request():
+            return
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/extract':
+                self._handle_extract(params)
+            elif url.path == '/run':
+                self._handle_run()
+            else:
+                self._send_json(404, {'error': '未知路径'})
+        except Exception as e:
+            log_error(f"处理请求 {self.path} 时出错: {str(e)}")
+            self._send_json(500, {'error': str(e)})
+
+    def _handle_extract(self, params: Dict[str, str]) -> None:
+        """
+        处理转录文本上传
+        """
+        body = self._read_body()
+        if body is None:
+            return
+        name = os.path.basename(params.get('name') or 'transcript.md')
+        # 文件名会写入临时目录并出现在 Content-Disposition 头中
+        if name in ('', '.', '..') or any(char in _UNSAFE_NAME_CHARS for char in name):
+            self._send_json(400, {'error': f'无效的文件名: {name!r}'})
+            return
+
+        if params.get('format') != 'zip':
+            blocks = self.daemon.submit(lambda service: service.extract(body, name))
+            self._send_json(200, {'name': name, 'blocks': blocks})
+            return
+
+        with tempfile.TemporaryDirectory() as work_dir:
+            input_dir = os.path.join(work_dir, 'input')
+            os.makedirs(input_dir)
+            with open(os.path.join(input_dir, name), 'wb') as f:
+                f.write(body)
+            # 需要打包的是输出目录本身，这里总是直接写入目录
+            result = self.daemon.submit(lambda service: service.run(input_dir, os.path.join(work_dir, 'output'), archive_format=''))
+            if not result['structure_folder']:
+                self._send_json(422, {'error': '未找到文件结构', 'result': result})
+                return
+            self._send_zip(result['structure_folder'], os.path.splitext(name)[0])
+
+    def _handle_run(self) -> None:
+        """
+        处理本地目录提取请求
+        """
+        body = self._read_body()
+        if body is None:
+            return
+        try:
+            request = json.loads(body.decode('utf-8') or '{}')
+        except ValueError:
+            self._send_json(400, {'error': '请求体不是有效的 JSON'})
+            return
+        if not isinstance(request, dict):
+            self._send_json(400, {'error': '请求体必须是 JSON 对象'})
+            return
+
+        input_dir = request.get('input_dir')
+        if not input_dir or not (os.path.isdir(input_dir) or is_archive_file(input_dir)):
+            self._send_json(400, {'error': f'输入目录不存在: {input_dir}'})
+            return
+        output_dir = self.daemon.resolve_output_dir(request.get('output_dir'))
+        if output_dir is None:
+            self._send_json(403, {'error': f"输出目录必须位于 {self.daemon.output_root} 之内: {request.get('output_dir')}"})
+            return
+        result = self.daemon.submit(
+            lambda service: service.run(input_dir, output_dir, request.get('file_types'), request.get('archive_format'))
+        )
+        if request.get('format') == 'zip' and result['structure_folder']:
+            self._send_zip(result['structure_folder'], os.path.basename(result['structure_folder']))
+        else:
+            self._send_json(200, result)
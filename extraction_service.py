@@ -0,0 +1,250 @@
+import io
+import os
+import threading
+from typing import Any, Dict, List, Optional, Union
+from code_block_processor import CodeBlockProcessor
+from file_structure_extractor import FileStructureExtractor
+from output_sinks import NullSink, OutputSink
+from archive_input import input_archive_session
+from diff_output import DiffCollector, compute_diffs, write_diffs
+from utils import allocate_output_dir
+from code_buffer import code_text
+from settings import DEFAULT_SETTINGS, Settings, SettingsManager, load_config, load_settings
+from logging_utils import log_stage, run_context, log_info, log_warning, log_error, log_debug
+
+_TEXT_ENCODINGS = ('utf-8', 'gbk', 'gb2312')
+
+
+def decode_text(data: Union[str, bytes]) -> str:
+    """
+    把内存中的输入统一转换为字符串
+
+    :param data: Union[str, bytes], 文本或字节
+    :return: str, 解码后的文本
+    """
+    if isinstance(data, str):
+        return data
+    for encoding in _TEXT_ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+class ExtractionService:
+    """
+    可嵌入的进程内提取服务
+
+    在构造时创建一次结构提取器和代码块处理器并在之后的所有调用中复用，
+    适合在长期运行的工作进程中被反复调用。所有方法都是线程安全的。
+    """
+
+    def __init__(self, config: Any = None, settings_manager: Optional[SettingsManager] = None):
+        """
+        初始化提取服务
+
+        :param config: Union[Settings, configparser.ConfigParser, None], 配置快照或配置对象，
+                       默认使用 settings_manager 的当前快照或读取当前目录的 settings.ini
+        :param settings_manager: Optional[SettingsManager], 配置热加载管理器，提供时在文件之间检查配置变化
+        """
+        if config is None and settings_manager is not None:
+            config = settings_manager.current
+        self.settings = Settings.coerce(config)
+        self.structure_extractor = FileStructureExtractor(self.settings, settings_manager)
+        self.code_processor = CodeBlockProcessor(self.settings, settings_manager)
+        self.detector = self.code_processor.code_block_detector
+        self.structure_detector = self.structure_extractor.file_structure_detector
+        # diff 在持有锁的情况下调用 run，因此使用可重入锁
+        self._lock = threading.RLock()
+        log_info("ExtractionService 初始化完成")
+
+    def extract(self, text: Union[str, bytes], source_name: str = '<memory>') -> List[Dict[str, Any]]:
+        """
+        从内存中的文本提取代码块，不读写任何文件
+
+        :param text: Union[str, bytes], Markdown 文本或其字节
+        :param source_name: str, 用于日志和结果中的来源名称
+        :return: List[Dict[str, Any]], 代码块列表，每项包含 path、language、code、start_line、end_line
+        """
+        # newline=None 与按文本模式读取文件时一样，把 \r\n 和 \r 统一为 \n
+        lines = io.StringIO(decode_text(text), newline=None).readlines()
+        with run_context():
+            return self._parse_lines(lines, source_name)
+
+    def _parse_lines(self, lines: List[str], source_name: str) -> List[Dict[str, Any]]:
+        """
+        用复用的检测器解析行列表
+
+        :param lines: List[str], 文本的行列表
+        :param source_name: str, 来源名称
+        :return: List[Dict[str, Any]], 代码块列表
+        """
+        with self._lock:
+            code_blocks, block_locations = self.detector.parse_lines(source_name, lines)
+        return [
+            {
+                'path': path,
+                'language': lang,
+                'code': code_text(code),
+                'start_line': start_line,
+                'end_line': end_line,
+            }
+            for (path, lang, code), (start_line, end_line) in zip(code_blocks, block_locations)
+        ]
+
+    def extract_structures(self, text: Union[str, bytes], source_name: str = 'project') -> List[Dict[str, Any]]:
+        """
+        从内存中的文本提取所有文件结构
+
+        :param text: Union[str, bytes], Markdown 文本或其字节
+        :param source_name: str, 结构上方没有根目录行时使用的根目录名
+        :return: List[Dict[str, Any]], 结构列表，每项包含 root、structure、line
+        """
+        content = decode_text(text)
+        return [
+            {'root': self.structure_detector.get_root_name(structure), 'structure': structure, 'line': line}
+            for line, structure in self.structure_detector.find_structures_in_text(content, source_name)
+        ]
+
+    def extract_dir(self, path: str, file_types: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        提取目录中所有匹配文件的代码块，只在内存中返回结果，不写任何文件
+
+        :param path: str, 输入目录
+        :param file_types: Optional[List[str]], 文件类型列表，默认使用配置中的 FileTypes
+        :return: Dict[str, List[Dict[str, Any]]], 文件路径 -> 代码块列表
+        """
+        if file_types is None:
+            file_types = self.code_processor.settings.file_type_list()
+        results = {}
+        with run_context(), input_archive_session():
+            for file_path in self.code_processor.collect_input_files(path, file_types):
+                lines = self.detector.read_lines(file_path)
+                if lines is None:
+                    continue
+                results[file_path] = self._parse_lines(lines, file_path)
+        return results
+
+    def run(self, input_dir: str, output_dir: str, file_types: Optional[List[str]] = None,
+            archive_format: Optional[str] = None, output_sink: Optional[OutputSink] = None) -> Dict[str, Any]:
+        """
+        运行完整流程：发现文件结构、创建输出目录并保存代码块
+
+        :param input_dir: str, 输入目录
+        :param output_dir: str, 输出目录
+        :param file_types: Optional[List[str]], 文件类型列表，默认使用配置中的 FileTypes
+        :param archive_format: Optional[str], 归档格式（zip、tar、tar.gz），空字符串表示写入目录，默认读取 [Output] archive_format
+        :param output_sink: Optional[OutputSink], 指定的输出写入器（如 MemorySink），此时结构文件夹为它的根目录
+        :return: Dict[str, Any], 包含 structure_folder、archive、projects、total_files、processed_files、code_blocks 的结果
+        """
+        if file_types is None:
+            file_types = self.code_processor.settings.file_type_list()
+        with self._lock, run_context(), input_archive_session():
+            with log_stage('discover', input_dir):
+                structures = self.structure_extractor.extract_file_structures(input_dir)
+            with log_stage('structure', input_dir):
+                structure_folder, project_trees = self.structure_extractor.save_structures(output_dir, structures, archive_format, output_sink)
+            if not structure_folder:
+                log_error(f"错误: 无法保存文件结构: {input_dir}")
+                return {'structure_folder': None, 'archive': None, 'projects': [], 'total_files': 0, 'processed_files': 0, 'code_blocks': 0}
+            self.code_processor.set_output_sink(self.structure_extractor.output_sink, self.structure_extractor.path_resolver)
+            try:
+                total_files, processed_files, code_block_count = self.code_processor.process_files(
+                    input_dir=input_dir,
+                    output_dir=output_dir,
+                    file_types=file_types,
+                    gui=None,
+                    structure_folder=structure_folder,
+                    root_folder=self.structure_extractor.get_root_folder(),
+                    project_trees=project_trees
+                )
+            finally:
+                self.code_processor.set_output_sink(None)
+                archive_path = self.structure_extractor.close_output()
+        return {
+            'structure_folder': structure_folder,
+            'archive': archive_path,
+            'projects': list(project_trees),
+            'total_files': total_files,
+            'processed_files': processed_files,
+            'code_blocks': code_block_count,
+        }
+
+    def diff(self, input_dir: str, checkout_dir: str, output_dir: str, diff_format: str = 'patch',
+             file_types: Optional[List[str]] = None, workers: Optional[int] = None) -> Dict[str, Any]:
+        """
+        运行完整流程但不写出代码文件，而是把代码块与已有目录比较并输出 diff
+
+        只有一个项目时已有目录对应该项目的根文件夹；多个项目时已有目录中每个项目是一个子目录。
+
+        :param input_dir: str, 输入目录
+        :param checkout_dir: str, 要比较的已有目录（例如代码仓库的工作区）
+        :param output_dir: str, diff 的输出目录，补丁保存在其中新建的 diff_N 目录
+        :param diff_format: str, patch（合并为一个补丁文件）或 files（每个文件一个 .diff）
+        :param file_types: Optional[List[str]], 文件类型列表，默认使用配置中的 FileTypes
+        :param workers: Optional[int], 计算 diff 的进程数，默认读取 [Output] diff_workers
+        :return: Dict[str, Any], 包含 run 的结果以及 diff_files、changed_files、unchanged_files
+        """
+        with run_context():
+            collector = DiffCollector()
+            with self._lock:
+                self.code_processor.set_block_observer(collector.add)
+                try:
+                    # 代码文件只需要交给观察者，不写入任何地方
+                    result = self.run(input_dir, output_dir, file_types,
+                                      output_sink=NullSink(os.path.join(os.path.abspath(output_dir), 'code')))
+                finally:
+                    self.code_processor.set_block_observer(None)
+
+            result.update({'diff_files': [], 'changed_files': [], 'unchanged_files': 0})
+            if not result['structure_folder']:
+                return result
+            targets = collector.targets(result['structure_folder'], strip_root=len(result['projects']) == 1)
+            with log_stage('diff', checkout_dir):
+                diffs, unchanged = compute_diffs(targets, checkout_dir, workers or self.settings.diff_workers)
+            result['changed_files'] = [relative_path for relative_path, _ in diffs]
+            result['unchanged_files'] = unchanged
+            if diffs:
+                result['diff_files'] = write_diffs(diffs, allocate_output_dir(output_dir, 'diff'), diff_format)
+            return result
+
+
+_default_service = None
+_default_service_lock = threading.Lock()
+
+
+def get_service() -> ExtractionService:
+    """
+    获取进程内共享的提取服务（首次调用时创建）
+
+    :return: ExtractionService, 共享的提取服务
+    """
+    global _default_service
+    if _default_service is None:
+        with _default_service_lock:
+            if _default_service is None:
+                _default_service = ExtractionService()
+    return _default_service
+
+
+def extract(text: Union[str, bytes], source_name: str = '<memory>') -> List[Dict[str, Any]]:
+    """
+    使用共享服务从内存中的文本提取代码块
+
+    :param text: Union[str, bytes], Markdown 文本或其字节
+    :param source_name: str, 来源名称
+    :return: List[Dict[str, Any]], 代码块列表
+    """
+    return get_service().extract(text, source_name)
+
+
+def extract_dir(path: str, file_types: Optional[List[str]] = None) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    使用共享服务提取目录中所有匹配文件的代码块
+
+    :param path: str, 输入目录
+    :param file_types: Optional[List[str]], 文件类型列表
+    :return: Dict[str, List[Dict[str, Any]]], 文件路径 -> 代码块列表
+    """
+    return get_service().extract_dir(path, file_types)
@@ -1,6 +1,11 @@
 import os
 from datetime import datetime
 from file_structure_detector import FileStructureDetector
+from output_index import update_output_index, OUTPUT_INDEX_FILE
+from utils import allocate_output_dir, add_file_header
+from output_sinks import OutputSink, create_output_sink
+from path_resolver import TargetPathResolver
+from settings import Settings, SettingsManager
 import traceback
 from typing import Dict, Any, Tuple, Optional
 from logging_utils import log_info, log_warning, log_error, log_debug
@@ -10,17 +15,21 @@ class FileStructureExtractor:
     文件结构提取器类，用于提取和保存文件结构
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Any, settings_manager: Optional[SettingsManager] = None):
         """
         初始化文件结构提取器
 
-        :param config: Dict[str, Any], 配置信息，包含输出目录等设置
+        :param config: Union[Settings, configparser.ConfigParser], 配置快照或配置对象
+        :param settings_manager: Optional[SettingsManager], 配置热加载管理器；提供时在每次提取前检查配置变化
         """
-        self.config = config
-        self.file_structure_detector = FileStructureDetector(config)
+        self.settings = Settings.coerce(config)
+        self.settings_manager = settings_manager
+        self.file_structure_detector = FileStructureDetector(self.settings)
         self.gui = None
         self.structure_folder = None
         self.root_folder = None
+        self.output_sink = None
+        self.path_resolver = None
         log_info("FileStructureExtractor 初始化完成")
 
     def set_gui(self, gui: Any) -> None:
@@ -33,15 +42,15 @@ class FileStructureExtractor:
         self.gui = gui
         self.file_structure_detector.set_gui(gui)
 
-    def update_config(self, new_config: Dict[str, Any]) -> None:
+    def apply_settings(self, settings: Settings) -> None:
         """
-        更新配置信息
+        切换到新的配置快照
 
-        :param new_config: Dict[str, Any], 新的配置信息
+        :param settings: Settings, 配置快照
         :return: None
         """
-        self.config = new_config
-        self.file_structure_detector.update_config(new_config)
+        self.settings = settings
+        self.file_structure_detector.apply_settings(settings)
         log_info("FileStructureExtractor 配置已更新")
 
     def extract_file_structure(self, directory: str) -> str:
@@ -60,6 +69,20 @@ class FileStructureExtractor:
         
         return structure
 
+    def extract_file_structures(self, directory: str) -> Dict[str, Dict[str, Any]]:
+        """
+        提取目录中所有候选文件里的全部文件结构
+
+        :param directory: str, 要提取结构的目录
+        :return: Dict[str, Dict[str, Any]], 根目录名 -> {'structure', 'source_file', 'line'}
+        """
+        log_info(f"开始提取所有文件结构，目录: {directory}")
+        if self.settings_manager is not None:
+            self.settings_manager.watch(self)
+        structures = self.file_structure_detector.discover_structures(directory)
+        log_info(f"文件结构提取完成，共 {len(structures)} 个项目: {', '.join(structures)}")
+        return structures
+
     def _print_structure(self, structure: str, indent: str = "") -> None:
         """
         打印文件结构信息
@@ -83,27 +106,16 @@ class FileStructureExtractor:
         
         if os.path.basename(output_dir) == 'code':
             base_dir = output_dir
-            parent_dir = os.path.dirname(output_dir)
+            # 只写 code 时上级目录为空字符串，此时在当前目录中分配
+            parent_dir = os.path.dirname(os.path.abspath(output_dir)) or '.'
         else:
             base_dir = os.path.join(output_dir, 'code')
-            parent_dir = output_dir
+            parent_dir = output_dir or '.'
 
         log_info(f"基础目录: {base_dir}")
         log_info(f"父目录: {parent_dir}")
 
-        if not os.path.exists(base_dir):
-            os.makedirs(base_dir)
-            log_info(f"创建新目录: {base_dir}")
-            return base_dir
-
-        index = 1
-        while True:
-            new_dir = os.path.join(parent_dir, f"code_{index}")
-            if not os.path.exists(new_dir):
-                os.makedirs(new_dir)
-                log_info(f"创建新目录: {new_dir}")
-                return new_dir
-            index += 1
+        return allocate_output_dir(parent_dir, 'code')
 
     def _process_structure(self, structure: str) -> Dict[str, Dict[str, list]]:
         """
@@ -124,6 +136,8 @@ class FileStructureExtractor:
         current_path.append(root_dir)
 
         for line in lines[1:]:
+            if '├' not in line and '└' not in line:  # 只有 │ 的分隔行
+                continue
             level = self._calculate_level(line)
             item = line.strip().split('── ')[-1].strip()
             
@@ -135,7 +149,7 @@ class FileStructureExtractor:
                 current_path.append(folder)
                 
                 full_path = '/'.join(filter(None, current_path))  # 使用 filter 移除空字符串
-                log_info(f"处理文件夹: {full_path}")
+                log_debug(f"处理文件夹: {full_path}")
                 if full_path not in processed_structure:
                     processed_structure[full_path] = {'dirs': [], 'files': []}
                 
@@ -146,7 +160,7 @@ class FileStructureExtractor:
                     processed_structure[parent_path]['dirs'].append(folder)
             else:  # 文件
                 parent_path = '/'.join(filter(None, current_path))
-                log_info(f"处理文件: {item} 在 {parent_path}")
+                log_debug(f"处理文件: {item} 在 {parent_path}")
                 if parent_path not in processed_structure:
                     processed_structure[parent_path] = {'dirs': [], 'files': []}
                 if item not in processed_structure[parent_path]['files']:
@@ -154,8 +168,9 @@ class FileStructureExtractor:
             
             last_level = level
         
-        log_info("文件结构处理完成")
-        log_info(f"处理后的结构键: {list(processed_structure.keys())}")
+        log_info(f"文件结构处理完成: {root_dir}，共 {len(processed_structure)} 个文件夹，"
+                 f"{sum(len(content['files']) for content in processed_structure.values())} 个文件")
+        log_debug(f"处理后的结构键: {list(processed_structure.keys())}")
         return processed_structure
 
     def _calculate_level(self, line: str) -> int:
@@ -168,58 +183,145 @@ class FileStructureExtractor:
         if not line.strip():  # 空行
             return -1
         
-        level = line.count('│   ') + (1 if '├── ' in line or '└── ' in line else 0)
-        return max(0, level)  # 确保层级不小于0
-
-    def save_structure(self, output_dir: str, structure: str) -> Tuple[str, str]:
+        # 以分支符号所在的列计算层级，兼容 │ 和空格两种缩进
+        branch_index = max(line.find('├'), line.find('└'))
+        if branch_index == -1:
+            return max(0, line.count('│   '))
+        return branch_index // 4 + 1
+
+    def save_structure(self, output_dir: str, structure: str,
+                       output_sink: Optional[OutputSink] = None) -> Tuple[str, str]:
         """
         根据提取的结构在输出目录中创建相应的文件夹和文件
 
         :param output_dir: str, 输出目录
         :param structure: str, 提取的结构（字符串形式）
+        :param output_sink: Optional[OutputSink], 输出写入器，默认按配置创建
         :return: Tuple[str, str], (structure_folder, root_folder)
         """
-        self.structure_folder = self.create_unique_output_dir(output_dir)
-        log_info(f"最终使用的输出目录: {self.structure_folder}")
-        
-        processed_structure = self._process_structure(structure)
-        
-        log_info(f"处理后的结构键: {list(processed_structure.keys())}")
-        
-        if not processed_structure:
-            log_error("错误: 处理后的结构为空")
+        if not structure:
+            log_error("错误: 没有可保存的文件结构")
             return None, None
 
-        first_key = list(processed_structure.keys())[0]
-        log_info(f"第一个键: {first_key}")
-        
-        self.root_folder = first_key.split('/')[-1]
-        log_info(f"根文件夹名称: {self.root_folder}")
-
-        if not self.root_folder:
-            log_error("错误: 无法确定根文件夹名称")
+        root_name = self.file_structure_detector.get_root_name(structure)
+        structure_folder, project_trees = self.save_structures(output_dir, {root_name: {'structure': structure}},
+                                                               output_sink=output_sink)
+        if not project_trees:
             return None, None
+        return structure_folder, self.root_folder
+
+    def save_structures(self, output_dir: str, structures: Dict[str, Dict[str, Any]],
+                        archive_format: Optional[str] = None,
+                        output_sink: Optional[OutputSink] = None) -> Tuple[Optional[str], Dict[str, Dict[str, Any]]]:
+        """
+        把多个项目的文件结构保存到同一个输出目录中，每个项目一个根文件夹
+
+        所有写入都经过 self.output_sink，路径由 self.path_resolver 解析；代码块应使用同一个解析器写入，
+        处理完成后需调用 close_output。
+
+        :param output_dir: str, 输出目录
+        :param structures: Dict[str, Dict[str, Any]], extract_file_structures 返回的结构索引
+        :param archive_format: Optional[str], 归档格式（zip、tar、tar.gz），为空时直接写入目录，
+                               默认读取 [Output] archive_format
+        :param output_sink: Optional[OutputSink], 指定的输出写入器，此时使用它的根目录作为结构文件夹，
+                            忽略 output_dir 和 archive_format
+        :return: Tuple[Optional[str], Dict[str, Dict[str, Any]]], (structure_folder, project_trees)，
+                 project_trees 为 根文件夹 -> {'source_file', 'line', 'top_level', 'files'}，供代码块路由使用
+        """
+        if not structures:
+            log_error("错误: 没有可保存的文件结构")
+            return None, {}
+
+        if output_sink is not None:
+            self.structure_folder = output_sink.root_dir
+            if output_sink.writes_to_disk:
+                os.makedirs(self.structure_folder, exist_ok=True)
+        else:
+            self.structure_folder = self.create_unique_output_dir(output_dir)
+            if archive_format is None:
+                archive_format = self.settings.archive_format
+            output_sink = create_output_sink(self.structure_folder, archive_format)
+        self.output_sink = output_sink
+        self.path_resolver = TargetPathResolver(output_sink)
+        log_info(f"最终使用的输出目录: {self.structure_folder}")
+
+        project_trees = {}
+        structure_files = []
+        for info in structures.values():
+            structure = info['structure']
+            processed_structure = self._process_structure(structure)
+
+            if not processed_structure:
+                log_error("错误: 处理后的结构为空")
+                continue
+
+            first_key = list(processed_structure.keys())[0]
+            log_info(f"第一个键: {first_key}")
+
+            root_folder = first_key.split('/')[-1]
+            log_info(f"根文件夹名称: {root_folder}")
+
+            if not root_folder:
+                log_error("错误: 无法确定根文件夹名称")
+                continue
+
+            declared_files = []
+            for relative_path, content in processed_structure.items():
+                try:
+                    current_path = self.path_resolver.resolve(relative_path)
+                except ValueError as e:
+                    log_warning(f"跳过目录 {relative_path}: {str(e)}")
+                    continue
+
+                self.path_resolver.ensure_dir(current_path)
+                log_debug(f"创建目录: {current_path}")
+
+                for file in content['files']:
+                    try:
+                        file_path = self.path_resolver.resolve(relative_path, file)
+                    except ValueError as e:
+                        log_warning(f"跳过文件 {relative_path}/{file}: {str(e)}")
+                        continue
+                    self.path_resolver.write_text(file_path, add_file_header(file_path, '', [f"This file represents: {os.path.join(relative_path, file)}"]))
+                    structure_files.append(os.path.relpath(file_path, self.structure_folder).replace(os.sep, '/'))
+                    declared_files.append(os.path.relpath(os.path.join(relative_path, file), first_key).replace(os.sep, '/'))
+                    log_debug(f"创建文件: {file_path}")
+
+            log_info(f"项目 {root_folder} 的结构已创建，共 {len(declared_files)} 个文件")
+            project_trees[root_folder] = {
+                'source_file': info.get('source_file'),
+                'line': info.get('line', 0),
+                'top_level': set(processed_structure[first_key]['dirs']) | set(processed_structure[first_key]['files']),
+                'files': declared_files
+            }
+
+        if not project_trees:
+            return None, {}
+        self.root_folder = next(iter(project_trees))
 
-        for relative_path, content in processed_structure.items():
-            current_path = os.path.normpath(os.path.join(self.structure_folder, relative_path))
-            
-            os.makedirs(current_path, exist_ok=True)
-            log_info(f"创建目录: {current_path}")
-            
-            for file in content['files']:
-                file_path = os.path.normpath(os.path.join(current_path, file))
-                with open(file_path, 'w') as f:
-                    f.write(f"# This file represents: {os.path.join(relative_path, file)}\n")
-                log_info(f"创建文件: {file_path}")
-        
         structure_file = os.path.join(self.structure_folder, 'project_structure.md')
-        with open(structure_file, 'w') as f:
-            f.write("# Project Structure\n\n")
-            f.write(structure)
+        output_sink.write_text(structure_file, "# Project Structure\n\n" + '\n\n'.join(info['structure'] for info in structures.values()))
         log_info(f"项目结构描述文件已保存到: {structure_file}")
 
-        log_info(f"文件结构创建完成")
-        return self.structure_folder, self.root_folder
+        if output_sink.writes_to_disk:
+            index_file = self.settings.output_index_file or OUTPUT_INDEX_FILE
+            update_output_index(self.structure_folder, index_file, structure_files=structure_files)
+
+        log_info(f"文件结构创建完成，共 {len(project_trees)} 个项目")
+        return self.structure_folder, project_trees
+
+    def close_output(self) -> Optional[str]:
+        """
+        完成本次运行的输出；归档模式下把所有内容写入归档
+
+        :return: Optional[str], 归档文件路径，其他输出方式返回 None
+        """
+        if not self.output_sink:
+            return None
+        archive_path = self.output_sink.close()
+        self.output_sink = None
+        self.path_resolver = None
+        return archive_path
 
     def run(self, directory: str) -> Tuple[Optional[str], Optional[str]]:
         """
@@ -230,7 +332,8 @@ class FileStructureExtractor:
         """
         log_info("开始运行文件结构提取和保存流程...")
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_dir = os.path.join(self.config['output']['directory'], f"file_structure_{timestamp}")
+        # 配置中没有单独的输出目录，输出保存在输入目录下
+        output_dir = os.path.join(directory, f"file_structure_{timestamp}")
         os.makedirs(output_dir, exist_ok=True)
         log_info(f"创建输出目录: {output_dir}")
 
@@ -263,5 +366,11 @@ class FileStructureExtractor:
         return self.root_folder
 
 if __name__ == "__main__":
-    # 这里可以添加一些测试代码或使用示例
-    pass
\ No newline at end of file
+    # 使用示例：把一段结构描述保存到内存输出中，并列出生成的占位文件
+    from output_sinks import MemorySink
+
+    example_structure = "demo/\n├── src/\n│   └── main.py\n└── README.md"
+    example_sink = MemorySink(os.path.join(os.getcwd(), 'code'))
+    extractor = FileStructureExtractor(None)
+    print(extractor.save_structure('', example_structure, output_sink=example_sink))
+    print(sorted(example_sink.files))
\ No newline at end of file
@@ -1,19 +1,32 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import threading
+import asyncio
 import time
 import os
+import configparser
 from file_structure_extractor import FileStructureExtractor
 from code_block_processor import CodeBlockProcessor
-from code_block_detector import CodeBlockDetector
+from async_processor import AsyncCodeBlockProcessor
+from output_sinks import ARCHIVE_EXTENSIONS
+from archive_input import input_archive_session
+from settings import SETTINGS_FILE, Settings, SettingsManager, apply_log_settings
+from code_block_preview import CodeBlockReference, read_block_preview
 from utils import create_unique_output_dir, normalize_path, is_valid_path, get_comment_syntax
 import yaml
 import logging
 import traceback
 import inspect
-from typing import Dict, Any
+from typing import Dict, Any, List
 from datetime import datetime
-from logging_utils import get_logger
+from logging_utils import get_logger, log_stage, run_context
+
+# 第一项表示直接写入目录，其余为归档格式
+OUTPUT_FORMATS = ['目录'] + list(ARCHIVE_EXTENSIONS)
+
+# 代码块列表的刷新间隔（毫秒）和每次最多插入的行数，避免大量代码块一次性涌入界面
+PREVIEW_REFRESH_MS = 200
+PREVIEW_BATCH_SIZE = 500
 
 class AutoSaveCodeGUI:
     """
@@ -25,20 +38,31 @@ class AutoSaveCodeGUI:
         初始化 AutoSaveCodeGUI 类
 
         :param master: tkinter 主窗口
-        :param config: 配置信息字典
+        :param config: 配置信息字典（ConfigParser），用于设置窗口的显示和保存
         """
         self.master = master
         self.master.title("Auto Save Code")
         self.master.geometry("800x600")
 
         self.config = config
+        # 处理过程中在文件之间检查 settings.ini 是否被外部修改
+        self.settings_manager = SettingsManager(SETTINGS_FILE)
+        settings = Settings.from_config(self.config)
 
-        self.structure_extractor = FileStructureExtractor(self.config)
-        self.code_processor = CodeBlockProcessor(self.config)
-        self.code_block_detector = CodeBlockDetector(self.config)
+        self.structure_extractor = FileStructureExtractor(settings, self.settings_manager)
+        self.code_processor = CodeBlockProcessor(settings, self.settings_manager)
+        self.async_processor = AsyncCodeBlockProcessor(self.code_processor)
+        self.code_block_detector = self.code_processor.code_block_detector
 
         self.is_running = False
+        # 代码块预览只保存引用；处理线程把新引用放入待插入列表，由主线程定时批量插入列表
+        self.block_references: List[CodeBlockReference] = []
+        self._pending_blocks: List[CodeBlockReference] = []
+        self._pending_lock = threading.Lock()
+        # 本次运行的输出写入器；close_output 之后仍保留，预览从中读取内存或归档中的代码块
+        self.preview_sink = None
         self.create_widgets()
+        self.master.after(PREVIEW_REFRESH_MS, self.flush_code_blocks)
 
         self.code_block_detector.set_gui(self)
 
@@ -75,9 +99,15 @@ class AutoSaveCodeGUI:
         self.file_types = tk.StringVar(value=self.config.get('FileTypes', 'types'))
         ttk.Entry(main_frame, textvariable=self.file_types, width=50).grid(row=2, column=1, padx=5, pady=5)
 
+        # 输出格式：目录或归档
+        ttk.Label(main_frame, text="输出格式:").grid(row=3, column=0, sticky=tk.W, padx=5, pady=5)
+        self.output_format = tk.StringVar(value=self.config.get('Output', 'archive_format', fallback='') or OUTPUT_FORMATS[0])
+        ttk.Combobox(main_frame, textvariable=self.output_format, values=OUTPUT_FORMATS,
+                     state="readonly", width=10).grid(row=3, column=1, sticky=tk.W, padx=5, pady=5)
+
         # 按钮框架
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=3, column=0, columnspan=3, pady=10)
+        button_frame.grid(row=4, column=0, columnspan=3, pady=10)
 
         # 执行按钮
         self.execute_button = ttk.Button(button_frame, text="执行", command=self.execute)
@@ -93,20 +123,66 @@ class AutoSaveCodeGUI:
 
         # 进度条
         self.progress = ttk.Progressbar(main_frame, orient="horizontal", length=300, mode="determinate")
-        self.progress.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
+        self.progress.grid(row=5, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
+
+        # 日志和代码块预览分为两个标签页
+        notebook = ttk.Notebook(main_frame)
+        notebook.grid(row=6, column=0, columnspan=4, padx=5, pady=5, sticky="nsew")
 
         # 日志文本框
-        self.log_text = tk.Text(main_frame, wrap=tk.WORD, width=80, height=20)
-        self.log_text.grid(row=5, column=0, columnspan=3, padx=5, pady=5, sticky="nsew")
+        log_frame = ttk.Frame(notebook)
+        log_frame.columnconfigure(0, weight=1)
+        log_frame.rowconfigure(0, weight=1)
+        notebook.add(log_frame, text="日志")
+        self.log_text = tk.Text(log_frame, wrap=tk.WORD, width=80, height=20)
+        self.log_text.grid(row=0, column=0, sticky="nsew")
 
         # 滚动条
-        scrollbar = ttk.Scrollbar(main_frame, orient="vertical", command=self.log_text.yview)
-        scrollbar.grid(row=5, column=3, sticky="ns")
+        scrollbar = ttk.Scrollbar(log_frame, orient="vertical", command=self.log_text.yview)
+        scrollbar.grid(row=0, column=1, sticky="ns")
         self.log_text.configure(yscrollcommand=scrollbar.set)
 
+        self.create_preview_panel(notebook)
+
         # 配置网格权重
         main_frame.columnconfigure(1, weight=1)
-        main_frame.rowconfigure(5, weight=1)
+        main_frame.rowconfigure(6, weight=1)
+
+    def create_preview_panel(self, notebook: ttk.Notebook):
+        """
+        创建代码块预览标签页：上方为代码块列表，下方显示选中代码块的内容
+
+        :param notebook: ttk.Notebook, 所属的标签页控件
+        :return: None
+        """
+        panes = ttk.PanedWindow(notebook, orient=tk.VERTICAL)
+        notebook.add(panes, text="代码块")
+
+        list_frame = ttk.Frame(panes)
+        list_frame.columnconfigure(0, weight=1)
+        list_frame.rowconfigure(0, weight=1)
+        self.block_list = ttk.Treeview(list_frame, columns=("path", "lang", "lines", "source"),
+                                       show="headings", selectmode="browse", height=8)
+        for column, text, width in (("path", "目标路径", 260), ("lang", "语言", 70),
+                                    ("lines", "行数", 50), ("source", "来源", 200)):
+            self.block_list.heading(column, text=text)
+            self.block_list.column(column, width=width, stretch=column in ("path", "source"))
+        self.block_list.grid(row=0, column=0, sticky="nsew")
+        list_scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self.block_list.yview)
+        list_scrollbar.grid(row=0, column=1, sticky="ns")
+        self.block_list.configure(yscrollcommand=list_scrollbar.set)
+        self.block_list.bind("<<TreeviewSelect>>", self.show_selected_block)
+        panes.add(list_frame, weight=1)
+
+        preview_frame = ttk.Frame(panes)
+        preview_frame.columnconfigure(0, weight=1)
+        preview_frame.rowconfigure(0, weight=1)
+        self.preview_text = tk.Text(preview_frame, wrap=tk.NONE, height=10, state=tk.DISABLED)
+        self.preview_text.grid(row=0, column=0, sticky="nsew")
+        preview_scrollbar = ttk.Scrollbar(preview_frame, orient="vertical", command=self.preview_text.yview)
+        preview_scrollbar.grid(row=0, column=1, sticky="ns")
+        self.preview_text.configure(yscrollcommand=preview_scrollbar.set)
+        panes.add(preview_frame, weight=1)
 
     def browse_input(self):
         """
@@ -130,11 +206,15 @@ class AutoSaveCodeGUI:
 
     def execute(self):
         """
-        执行主程序，在新线程中运行 execute_thread 方法
+        执行主程序，在新线程中运行 execute_thread 方法；同一时间只允许一次执行
 
         :return: None
         """
+        if self.is_running:
+            self.log_info("程序正在执行中，请等待当前任务完成", level="warning")
+            return
         self.is_running = True
+        self.clear_code_blocks()
         threading.Thread(target=self.execute_thread, daemon=True).start()
 
     def execute_thread(self):
@@ -143,60 +223,71 @@ class AutoSaveCodeGUI:
 
         :return: None
         """
-        try:
-            input_dir = self.input_dir.get()
-            output_dir = self.output_dir.get()
-            self.log_info(f"输入目录: {input_dir}")
-            self.log_info(f"输出目录: {output_dir}")
+        with run_context(), input_archive_session():
+            try:
+                input_dir = self.input_dir.get()
+                output_dir = self.output_dir.get()
+                self.log_info(f"输入目录: {input_dir}")
+                self.log_info(f"输出目录: {output_dir}")
             
-            file_types = [t.strip() for t in self.file_types.get().split(',')]
-            self.log_info(f"文件类型: {file_types}")
+                file_types = [t.strip() for t in self.file_types.get().split(',')]
+                self.log_info(f"文件类型: {file_types}")
             
-            # 设置 GUI 对象
-            self.structure_extractor.set_gui(self)
+                # 设置 GUI 对象
+                self.structure_extractor.set_gui(self)
             
-            self.log_info("正在提取项目结构...")
-            structure = self.structure_extractor.extract_file_structure(input_dir)
+                self.log_info("正在提取项目结构...")
+                with log_stage('discover', input_dir):
+                    structures = self.structure_extractor.extract_file_structures(input_dir)
             
-            self.log_info("正在创建文件结构...")
-            structure_folder, root_folder = self.structure_extractor.save_structure(output_dir, structure)
+                self.log_info("正在创建文件结构...")
+                output_format = self.output_format.get()
+                archive_format = '' if output_format == OUTPUT_FORMATS[0] else output_format
+                with log_stage('structure', input_dir):
+                    structure_folder, project_trees = self.structure_extractor.save_structures(output_dir, structures, archive_format)
+                root_folder = self.structure_extractor.get_root_folder() if project_trees else None
+                self.preview_sink = self.structure_extractor.output_sink
             
-            if structure_folder and root_folder:
-                self.log_info(f"文件结构已保存。结构文件夹: {structure_folder}, 根文件夹: {root_folder}")
+                if structure_folder and root_folder:
+                    self.log_info(f"文件结构已保存。结构文件夹: {structure_folder}, 项目根文件夹: {', '.join(project_trees)}")
                 
-                # 设置 CodeBlockProcessor 的结构信息
-                self.code_processor.set_structure_info(structure_folder, root_folder)
+                    # 设置 CodeBlockProcessor 的结构信息
+                    self.code_processor.set_structure_info(structure_folder, root_folder, project_trees)
+                    self.code_processor.set_output_sink(self.structure_extractor.output_sink, self.structure_extractor.path_resolver)
                 
-                # 更新进度条
-                self.update_progress(0)
+                    # 更新进度条
+                    self.update_progress(0)
                 
-                try:
-                    # 处理文件
-                    total_files, processed_files, code_block_count = self.code_processor.process_files(
-                        input_dir=input_dir, 
-                        output_dir=output_dir, 
-                        file_types=file_types, 
-                        gui=self,
-                        structure_folder=structure_folder,
-                        root_folder=root_folder
-                    )
+                    try:
+                        # 处理文件：在本线程的事件循环中并发调度每个文件
+                        total_files, processed_files, code_block_count = asyncio.run(self.async_processor.process_files(
+                            input_dir=input_dir, 
+                            file_types=file_types, 
+                            structure_folder=structure_folder,
+                            root_folder=root_folder,
+                            project_trees=project_trees
+                        ))
                     
-                    if all(isinstance(x, int) for x in (total_files, processed_files, code_block_count)):
-                        self.display_statistics(total_files, processed_files, code_block_count)
-                    else:
-                        self.log_info("错误: 处理文件返回了无效的统计数据", level="error")
-                except Exception as e:
-                    self.log_info(f"处理文件时出错: {str(e)}", level="error")
-                finally:
-                    # 完成后更新进度条
-                    self.update_progress(100)
-            else:
-                self.log_info("错误: 无法保存文件结构", level="error")
-        except Exception as e:
-            self.log_info(f"执行过程中出错: {str(e)}", "error")
-            self.logger.error(f"执行过程中出错: {str(e)}\n{traceback.format_exc()}")
-        finally:
-            self.is_running = False
+                        if all(isinstance(x, int) for x in (total_files, processed_files, code_block_count)):
+                            self.display_statistics(total_files, processed_files, code_block_count)
+                        else:
+                            self.log_info("错误: 处理文件返回了无效的统计数据", level="error")
+                    except Exception as e:
+                        self.log_info(f"处理文件时出错: {str(e)}", level="error")
+                    finally:
+                        self.code_processor.set_output_sink(None)
+                        archive_path = self.structure_extractor.close_output()
+                        if archive_path:
+                            self.log_info(f"输出已打包为: {archive_path}")
+                        # 完成后更新进度条
+                        self.update_progress(100)
+                else:
+                    self.log_info("错误: 无法保存文件结构", level="error")
+            except Exception as e:
+                self.log_info(f"执行过程中出错: {str(e)}", "error")
+                self.logger.error(f"执行过程中出错: {str(e)}\n{traceback.format_exc()}")
+            finally:
+                self.is_running = False
 
     def open_settings(self):
         """
@@ -325,44 +416,37 @@ class AutoSaveCodeGUI:
         :param settings_window: 设置窗口
         :return: None
         """
-        # 更新配置
-        self.config.set('FileTypes', 'types', self.file_types_entry.get())
-        self.config.set('Extraction', 'max_file_size', self.max_file_size_entry.get())
-        self.config.set('Extraction', 'encoding', self.encoding_entry.get())
-        self.config.set('Output', 'structure_file', self.structure_file_entry.get())
-        self.config.set('StructureDiscovery', 'special_chars', self.special_chars_entry.get())
-        self.config.set('code_block_detection', 'start_marker', self.start_marker_entry.get())
-        self.config.set('code_block_detection', 'end_marker', self.end_marker_entry.get())
-        self.config.set('code_block_detection', 'min_occurrences', self.min_occurrences_entry.get())
-        self.config.set('code_block_detection', 'indentation_level', self.indentation_level_entry.get())
-
-        # 更新文件类型
-        new_file_types = self.file_types_entry.get()
-        self.config.set('FileTypes', 'types', new_file_types)
-        
-        # 创建一个新的配置字典
-        new_config = {
-            'FileTypes': {'types': new_file_types},
-            'code_block_detection': {
-                'start_marker': self.start_marker_entry.get(),
-                'end_marker': self.end_marker_entry.get(),
-                'min_occurrences': self.min_occurrences_entry.get(),
-                'indentation_level': self.indentation_level_entry.get()
-            }
-        }
-        
-        # 更新 CodeBlockDetector 的配置
-        self.code_block_detector.update_config(new_config)
+        # 在配置副本上写入新值，校验通过后才替换当前配置，无效的值不会留在运行中的配置里
+        config = configparser.ConfigParser()
+        config.read_dict({section: dict(self.config.items(section, raw=True)) for section in self.config.sections()})
+        config.set('FileTypes', 'types', self.file_types_entry.get())
+        config.set('Extraction', 'max_file_size', self.max_file_size_entry.get())
+        config.set('Extraction', 'encoding', self.encoding_entry.get())
+        config.set('Output', 'structure_file', self.structure_file_entry.get())
+        config.set('StructureDiscovery', 'special_chars', self.special_chars_entry.get())
+        config.set('code_block_detection', 'start_marker', self.start_marker_entry.get())
+        config.set('code_block_detection', 'end_marker', self.end_marker_entry.get())
+        config.set('code_block_detection', 'min_occurrences', self.min_occurrences_entry.get())
+        config.set('code_block_detection', 'indentation_level', self.indentation_level_entry.get())
+
+        # 先校验再保存，无效的配置不会写入文件
+        try:
+            settings = Settings.from_config(config)
+        except ValueError as e:
+            messagebox.showerror("错误", str(e))
+            return
 
-        with open('settings.ini', 'w') as configfile:
+        self.config = config
+        with open(SETTINGS_FILE, 'w', encoding='utf-8') as configfile:
             self.config.write(configfile)
 
-        # 更新 FileStructureExtractor 和 CodeBlockProcessor 的设置
-        self.structure_extractor.update_config(self.config)
-        self.code_processor.update_config(self.config)
+        # 用新的快照替换 FileStructureExtractor 和 CodeBlockProcessor 的设置
+        apply_log_settings(settings)
+        self.structure_extractor.apply_settings(settings)
+        self.code_processor.apply_settings(settings)
 
         # 更新主界面的文件类型
-        self.file_types.set(new_file_types)
+        self.file_types.set(self.file_types_entry.get())
 
         messagebox.showinfo("成功", "设置已保存")
         settings_window.destroy()
@@ -411,21 +495,76 @@ class AutoSaveCodeGUI:
                 self.logger.info(log_message)
 
 
-    def display_code_block(self, file_path: str, lang: str, code: str):
+    def add_code_blocks(self, references: List[CodeBlockReference]):
+        """
+        添加代码块引用到预览列表；可在处理线程中调用，实际插入由主线程的 flush_code_blocks 完成
+
+        :param references: 代码块引用列表
+        :return: None
+        """
+        with self._pending_lock:
+            self._pending_blocks.extend(references)
+
+    def flush_code_blocks(self):
+        """
+        定时把待插入的代码块引用批量插入列表，每次最多插入 PREVIEW_BATCH_SIZE 个
+
+        :return: None
+        """
+        with self._pending_lock:
+            batch = self._pending_blocks[:PREVIEW_BATCH_SIZE]
+            del self._pending_blocks[:PREVIEW_BATCH_SIZE]
+        for reference in batch:
+            iid = str(len(self.block_references))
+            self.block_references.append(reference)
+            source = f"{os.path.basename(reference.source_file)}:{reference.start_line}"
+            self.block_list.insert("", tk.END, iid=iid,
+                                   values=(reference.target_path, reference.language, reference.line_count, source))
+        self.master.after(PREVIEW_REFRESH_MS, self.flush_code_blocks)
+
+    def clear_code_blocks(self):
+        """
+        清空代码块列表和预览
+
+        :return: None
+        """
+        with self._pending_lock:
+            self._pending_blocks.clear()
+        self.block_references = []
+        self.preview_sink = None
+        self.block_list.delete(*self.block_list.get_children())
+        self.set_preview_text("")
+
+    def show_selected_block(self, event=None):
+        """
+        读取并显示选中代码块的预览；内容只在选中时从保存的文件或输出缓冲区中读取
+
+        :param event: 选择事件
+        :return: None
+        """
+        selection = self.block_list.selection()
+        if not selection:
+            return
+        reference = self.block_references[int(selection[0])]
+        try:
+            preview, truncated = read_block_preview(reference, self.preview_sink)
+            if truncated:
+                preview += "\n... (更多内容被省略)"
+        except Exception as e:
+            preview = f"读取代码块预览时出错: {str(e)}"
+        self.set_preview_text(f"代码块 ({reference.language}) 来自文件: {reference.source_file}\n{'-' * 50}\n{preview}")
+
+    def set_preview_text(self, text: str):
         """
-        在GUI中显示代码块预览
+        替换预览区域的内容
 
-        :param file_path: 代码块所在文件路径
-        :param lang: 代码言
-        :param code: 代码内容
+        :param text: 要显示的内容
         :return: None
         """
-        preview_lines = code.split('\n')[:10]
-        preview = '\n'.join(preview_lines)
-        self.log_info(f"\n代码块 ({lang}) 来自文件: {file_path}\n{preview}\n...")
-        if len(code.split('\n')) > 10:
-            self.log_info("... (更多行被省略)")
-        self.log_info("-"*50)
+        self.preview_text.configure(state=tk.NORMAL)
+        self.preview_text.delete("1.0", tk.END)
+        self.preview_text.insert("1.0", text)
+        self.preview_text.configure(state=tk.DISABLED)
 
     def log_general(self, message: str, level: str = "info"):
         """
@@ -1,8 +1,63 @@
+import contextlib
+import contextvars
+import json
 import logging
 import os
 import inspect
+import time
+import threading
+import uuid
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional
+
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+DEFAULT_LOG_LEVEL = 'info'
+# 进度汇总日志的默认最小间隔（秒）
+DEFAULT_PROGRESS_INTERVAL = 5.0
+LOG_FORMATS = ('text', 'json')
+LOG_FILE_SUFFIXES = {'text': '.log', 'json': '.jsonl'}
+
+# 当前的运行 ID、源文件和处理阶段；asyncio 任务会继承，线程需要通过 copy_context 传递
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('auto_save_code_log_context', default={})
+# 查找调用者时跳过的文件：本模块和 contextlib（log_stage 结束时从 contextlib 中调用）
+_SKIPPED_CALLER_FILES = frozenset({__file__, contextlib.__file__})
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    把日志记录格式化为一行 JSON
+
+    字段顺序、输出字典和 JSON 编码器在创建时分配，每条记录只填充字段值后编码；
+    logging.Handler 在写入时持有锁，因此同一个输出字典不会被并发修改。
+    """
+
+    FIELDS = ('time', 'level', 'run_id', 'file', 'stage', 'duration_ms', 'module', 'function', 'line', 'message')
+
+    def __init__(self):
+        super().__init__()
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=str)
+        self._fields = dict.fromkeys(self.FIELDS)
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = getattr(record, 'context', None) or {}
+        fields = self._fields
+        fields['time'] = record.created
+        fields['level'] = record.levelname
+        fields['run_id'] = context.get('run_id')
+        fields['file'] = context.get('file')
+        fields['stage'] = context.get('stage')
+        fields['duration_ms'] = getattr(record, 'duration_ms', None)
+        fields['module'] = getattr(record, 'caller_file', None)
+        fields['function'] = getattr(record, 'caller_func', None)
+        fields['line'] = getattr(record, 'caller_line', None)
+        fields['message'] = record.getMessage()
+        return self._encoder.encode(fields)
+
 
 class CustomLogger:
     _instance = None
@@ -30,25 +85,77 @@ class CustomLogger:
         self.logger = logging.getLogger('AutoSaveCode')
         self.logger.setLevel(logging.DEBUG)
 
+        # 创建文件处理器并添加到logger
+        self.log_format = 'text'
+        self.file_handler = self._create_file_handler(self.log_format)
+        self.logger.addHandler(self.file_handler)
+        self._handler_lock = threading.Lock()
+        
+        # GUI对象，初始为None
+        self.gui = None
+
+        # 日志级别：模块名（不含 .py）-> 级别，未列出的模块使用默认级别
+        self.default_level = LOG_LEVELS[DEFAULT_LOG_LEVEL]
+        self.module_levels: Dict[str, int] = {}
+        self.min_level = self.default_level
+        self.progress_interval = DEFAULT_PROGRESS_INTERVAL
+
+    @staticmethod
+    def _create_file_handler(log_format: str) -> logging.FileHandler:
+        """
+        在 logs 目录中创建新的日志文件处理器；文件在写入第一条记录时才创建，
+        启动时读取配置并切换格式之前没有写入任何记录的文件不会留在磁盘上
+        :param log_format: text 或 json
+        :return: 文件处理器
+        """
         # 创建日志目录
         log_dir = "logs"
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
 
-        # 创建文件处理器
-        log_file = os.path.join(log_dir, f"auto_save_code_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
-        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        log_file = os.path.join(log_dir, f"auto_save_code_{datetime.now().strftime('%Y%m%d_%H%M%S')}{LOG_FILE_SUFFIXES[log_format]}")
+        file_handler = logging.FileHandler(log_file, encoding='utf-8', delay=True)
         file_handler.setLevel(logging.DEBUG)
 
         # 创建格式化器
-        file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-        file_handler.setFormatter(file_formatter)
+        if log_format == 'json':
+            file_handler.setFormatter(JsonLinesFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        return file_handler
 
-        # 将文件处理器添加到logger
-        self.logger.addHandler(file_handler)
-        
-        # GUI对象，初始为None
-        self.gui = None
+    def set_format(self, log_format: str):
+        """
+        切换日志文件格式；格式变化时改为写入新的日志文件（.log 或 .jsonl），同一个文件中不会混用两种格式
+        :param log_format: text 或 json
+        """
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"不支持的日志格式: {log_format}")
+        with self._handler_lock:
+            if log_format == self.log_format:
+                return
+            old_handler, self.file_handler = self.file_handler, self._create_file_handler(log_format)
+            self.logger.addHandler(self.file_handler)
+            self.logger.removeHandler(old_handler)
+            self.log_format = log_format
+            old_handler.close()
+
+    def set_levels(self, level: str = DEFAULT_LOG_LEVEL, module_levels: Optional[Dict[str, str]] = None,
+                   progress_interval: Optional[float] = None):
+        """
+        设置默认日志级别和各模块的日志级别
+        :param level: 默认级别（debug、info、warning、error）
+        :param module_levels: 模块名（如 code_block_detector）-> 级别
+        :param progress_interval: 进度汇总日志的最小间隔（秒）
+        """
+        default_level = LOG_LEVELS[level.lower()]
+        levels = {module: LOG_LEVELS[module_level.lower()] for module, module_level in (module_levels or {}).items()}
+        # 先替换模块级别再更新最低级别，其他线程不会看到不完整的配置
+        self.module_levels = levels
+        self.default_level = default_level
+        self.min_level = min([default_level] + list(levels.values()))
+        if progress_interval is not None:
+            self.progress_interval = progress_interval
 
     def find_caller(self):
         """
@@ -56,7 +163,7 @@ class CustomLogger:
         """
         frame = inspect.currentframe()
         while frame:
-            if frame.f_code.co_filename != __file__:
+            if frame.f_code.co_filename not in _SKIPPED_CALLER_FILES:
                 return (
                     os.path.basename(frame.f_code.co_filename),
                     frame.f_code.co_name,
@@ -72,24 +179,35 @@ class CustomLogger:
         """
         self.gui = gui
 
-    def log(self, message: str, level: str = "info", display_gui: bool = True, important: bool = False):
+    def log(self, message: str, level: str = "info", display_gui: bool = True, important: bool = False,
+            duration_ms: Optional[float] = None):
         """
         记录日志
         :param message: 日志消息
         :param level: 日志级别
         :param display_gui: 是否在GUI中显示
         :param important: 是否为重要消息
+        :param duration_ms: 阶段耗时（毫秒），只写入 JSON 格式的日志
         """
+        # 低于所有模块级别的消息直接丢弃，不再查找调用者
+        levelno = LOG_LEVELS[level]
+        if levelno < self.min_level:
+            return
+
         # 获取调用者的信息
         filename, func_name, lineno = self.find_caller()
+        if levelno < self.module_levels.get(os.path.splitext(filename)[0], self.default_level):
+            return
 
-        # 构造完整的日志消息，包含文件名等信息
-        full_message = f"[{filename}:{func_name}:{lineno}] {message}"
-
-        # 获取对应的日志函数
-        log_func = getattr(self.logger, level.lower())
-        # 记录日志到文件
-        log_func(full_message)
+        if self.log_format == 'json':
+            # 调用者和上下文作为独立字段交给 JsonLinesFormatter，消息本身不加前缀
+            self.logger.log(levelno, message, extra={
+                'caller_file': filename, 'caller_func': func_name, 'caller_line': lineno,
+                'context': _log_context.get(), 'duration_ms': duration_ms,
+            })
+        else:
+            # 构造完整的日志消息，包含文件名等信息
+            self.logger.log(levelno, f"[{filename}:{func_name}:{lineno}] {message}")
 
         # 如果需要在GUI中显示，且GUI对象存在，且消息重要
         if display_gui and self.gui and important:
@@ -126,6 +244,55 @@ def get_logger():
     """
     return CustomLogger.get_instance()
 
+def new_run_id() -> str:
+    """
+    生成新的运行 ID
+    """
+    return uuid.uuid4().hex[:12]
+
+@contextlib.contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    在 with 块内为日志记录附加上下文字段（run_id、file、stage），退出时恢复原来的上下文
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+@contextlib.contextmanager
+def run_context() -> Iterator[None]:
+    """
+    为一次运行分配运行 ID；已经处于某次运行中时（例如 diff 内部调用 run）沿用外层的运行 ID
+    """
+    if _log_context.get().get('run_id'):
+        yield
+        return
+    with log_context(run_id=new_run_id()):
+        yield
+
+@contextlib.contextmanager
+def log_stage(stage: str, source_file: Optional[str] = None) -> Iterator[None]:
+    """
+    标记一个处理阶段：块内的日志带有 stage 和 file 字段，结束时记录该阶段的耗时
+
+    JSON 格式下耗时记录为 info 级别并带有 duration_ms 字段，便于统计各阶段的耗时分布；
+    文本格式下只在 debug 级别记录。
+    """
+    fields = {'stage': stage}
+    if source_file:
+        fields['file'] = source_file
+    started = time.perf_counter()
+    with log_context(**fields):
+        try:
+            yield
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            logger = get_logger()
+            level = "info" if logger.log_format == 'json' else "debug"
+            logger.log(f"阶段 {stage} 完成，用时 {duration_ms:.1f} 毫秒", level, display_gui=False, duration_ms=duration_ms)
+
 def log_info(message: str, display_gui: bool = True, important: bool = False):
     """
     记录info级别的日志
@@ -148,4 +315,53 @@ def log_debug(message: str, display_gui: bool = False, important: bool = False):
     """
     记录debug级别的日志
     """
-    get_logger().debug(message, display_gui, important)
\ No newline at end of file
+    get_logger().debug(message, display_gui, important)
+
+class ProgressLogger:
+    """
+    限频的进度汇总日志
+
+    循环中只更新计数，距离上一条汇总超过 [Logging] progress_interval 秒时才记录一条
+    “已处理 100000 行，37 个代码块” 形式的日志，代替逐行或逐项的日志。
+    """
+
+    def __init__(self, description: str, units: Dict[str, str], interval: Optional[float] = None):
+        """
+        :param description: str, 日志前缀，例如 "正在解析 chat.md"
+        :param units: Dict[str, str], 计数名称 -> 单位，按顺序输出，例如 {'lines': '行', 'blocks': '个代码块'}
+        :param interval: Optional[float], 最小间隔（秒），默认读取日志配置
+        """
+        self.description = description
+        self.units = units
+        self.counts = dict.fromkeys(units, 0)
+        self.interval = get_logger().progress_interval if interval is None else interval
+        self._last_time = time.monotonic()
+        self.reported = False
+
+    def add(self, **counts: int):
+        """
+        累加计数，到达间隔时记录汇总
+        """
+        for name, count in counts.items():
+            self.counts[name] += count
+        self._maybe_log()
+
+    def report(self, **totals: int):
+        """
+        设置计数的当前总数，到达间隔时记录汇总
+        """
+        self.counts.update(totals)
+        self._maybe_log()
+
+    def _maybe_log(self):
+        now = time.monotonic()
+        if now - self._last_time >= self.interval:
+            self._last_time = now
+            self.reported = True
+            log_info(self.summary())
+
+    def summary(self) -> str:
+        """
+        当前计数的汇总文本
+        """
+        return f"{self.description}: 已处理 " + "，".join(f"{self.counts[name]} {unit}" for name, unit in self.units.items())
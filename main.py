@@ -1,50 +1,128 @@
 import tkinter as tk
-import configparser
+import argparse
+import json
 import os
+import sys
 from gui import AutoSaveCodeGUI
 from logging_utils import get_logger
+from output_index import OutputIndex
+from extraction_daemon import ExtractionDaemon
+from extraction_service import ExtractionService
+from diff_output import DIFF_FORMATS
+from settings import SETTINGS_FILE, Settings, SettingsManager, apply_log_settings, load_config
 
 def load_settings():
-    config = configparser.ConfigParser()
-    if os.path.exists('settings.ini'):
-        config.read('settings.ini')
-    else:
-        create_default_settings(config)
-    
-    # 确保 'code_block_detection' 部分存在
-    if 'code_block_detection' not in config:
-        config['code_block_detection'] = {
-            'start_marker': '```',
-            'end_marker': '```',
-            'min_occurrences': '2',
-            'indentation_level': '4'
-        }
-        with open('settings.ini', 'w') as configfile:
-            config.write(configfile)
-    
-    return config
-
-def create_default_settings(config):
-    config['Symbols'] = {
-        'directory': '/',
-        'file': ''
-    }
-    config['FileTypes'] = {
-        'types': '.py, .js, .html, .css, .md'
-    }
-    config['Extraction'] = {
-        'max_file_size': '10485760',
-        'encoding': 'utf-8'
-    }
-    config['Output'] = {
-        'structure_file': 'project_structure.md'
-    }
-    with open('settings.ini', 'w') as configfile:
-        config.write(configfile)
+    """
+    读取 settings.ini，缺少的选项使用默认值；启动时不会写回配置文件
+
+    :return: configparser.ConfigParser, 配置对象
+    """
+    return load_config(SETTINGS_FILE)
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Auto Save Code")
+    subparsers = parser.add_subparsers(dest='command')
+
+    query_parser = subparsers.add_parser('query', help='查询输出目录的索引')
+    query_parser.add_argument('output_root', help='输出根目录（如 code_1）')
+    query_parser.add_argument('--path', help='按完整路径或路径后缀查找来源')
+    query_parser.add_argument('--language', help='代码语言')
+    query_parser.add_argument('--kind', choices=['structure', 'block'], help='记录类型')
+    query_parser.add_argument('--min-lines', type=int, help='最小行数')
+    query_parser.add_argument('--max-lines', type=int, help='最大行数')
+    query_parser.add_argument('--min-size', type=int, help='最小字节数')
+    query_parser.add_argument('--max-size', type=int, help='最大字节数')
+    query_parser.add_argument('--source', help='来源文件路径')
+    query_parser.add_argument('--limit', type=int, help='返回记录数上限')
+    query_parser.add_argument('--rebuild', action='store_true', help='查询前从目录树重建索引')
+
+    diff_parser = subparsers.add_parser('diff', help='把代码块与已有目录比较并输出补丁，不改动已有目录')
+    diff_parser.add_argument('input_dir', help='输入目录或归档')
+    diff_parser.add_argument('checkout_dir', help='要比较的已有目录')
+    diff_parser.add_argument('--output', default='.', help='补丁输出目录，默认为当前目录')
+    diff_parser.add_argument('--format', choices=DIFF_FORMATS, default='patch', help='patch 合并为一个补丁文件，files 每个文件一个 .diff')
+    diff_parser.add_argument('--workers', type=int, help='计算 diff 的进程数，默认读取 [Output] diff_workers')
+
+    daemon_parser = subparsers.add_parser('daemon', help='启动本地 HTTP 提取服务')
+    daemon_parser.add_argument('--host', help='监听地址（127.0.0.1 或 localhost），默认读取 [Daemon] host')
+    daemon_parser.add_argument('--port', type=int, help='监听端口，默认读取 [Daemon] port')
+    daemon_parser.add_argument('--workers', type=int, help='工作线程数，默认读取 [Daemon] workers')
+    return parser
+
+def run_query(args, config):
+    settings = Settings.from_config(config)
+    index_file = settings.output_index_file
+    if not args.rebuild and not os.path.isfile(os.path.join(args.output_root, index_file)):
+        print(f"索引不存在: {os.path.join(args.output_root, index_file)}，可使用 --rebuild 重建", file=sys.stderr)
+        return 1
+
+    with OutputIndex(args.output_root, index_file) as index:
+        if args.rebuild:
+            index.rebuild_from_tree(settings.block_index_file)
+        if args.path:
+            rows = index.find_path(args.path)
+        else:
+            rows = index.query(
+                language=args.language,
+                kind=args.kind,
+                min_lines=args.min_lines,
+                max_lines=args.max_lines,
+                min_size=args.min_size,
+                max_size=args.max_size,
+                source_file=args.source,
+                limit=args.limit
+            )
+    for row in rows:
+        print(json.dumps(row, ensure_ascii=False))
+    return 0
+
+def run_diff(args, config):
+    get_logger()
+    result = ExtractionService(config).diff(args.input_dir, args.checkout_dir, args.output, args.format, workers=args.workers)
+    if not result['structure_folder']:
+        print(f"未找到文件结构: {args.input_dir}", file=sys.stderr)
+        return 1
+    print(f"变化的文件: {len(result['changed_files'])}，未变化的文件: {result['unchanged_files']}")
+    for diff_file in result['diff_files']:
+        print(diff_file)
+    return 0
+
+def run_daemon(args, config):
+    get_logger()
+    try:
+        daemon = ExtractionDaemon(config, host=args.host, port=args.port, workers=args.workers,
+                                  settings_manager=SettingsManager(SETTINGS_FILE))
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    print(f"提取服务已启动: http://{daemon.host}:{daemon.server.server_address[1]}")
+    if daemon.token_generated:
+        # 令牌只输出到终端，不写入日志文件
+        print(f"本次启动的访问令牌: {daemon.token}")
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
 
 if __name__ == "__main__":
+    args = build_arg_parser().parse_args()
+    config = load_settings()
+    try:
+        settings = Settings.from_config(config)
+    except ValueError as e:
+        print(f"{SETTINGS_FILE}: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    apply_log_settings(settings)
+
+    if args.command == 'query':
+        sys.exit(run_query(args, config))
+    if args.command == 'diff':
+        sys.exit(run_diff(args, config))
+    if args.command == 'daemon':
+        sys.exit(run_daemon(args, config))
+
     get_logger()  # 初始化日志系统
     root = tk.Tk()
-    config = load_settings()
     app = AutoSaveCodeGUI(root, config)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,312 @@
+import os
+import json
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional, Iterable
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+OUTPUT_INDEX_FILE = 'output_index.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    rpath TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    target_path TEXT,
+    language TEXT,
+    size INTEGER,
+    lines INTEGER,
+    source_file TEXT,
+    start_line INTEGER,
+    end_line INTEGER,
+    sha256 TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_entries_rpath ON entries (rpath);
+CREATE INDEX IF NOT EXISTS idx_entries_language_lines ON entries (language, lines);
+CREATE INDEX IF NOT EXISTS idx_entries_size ON entries (size);
+CREATE INDEX IF NOT EXISTS idx_entries_source ON entries (source_file);
+"""
+
+_COLUMNS = ('path', 'kind', 'target_path', 'language', 'size', 'lines',
+            'source_file', 'start_line', 'end_line', 'sha256')
+
+
+def _reverse_path(path: str) -> str:
+    """
+    将路径按组件倒序，用于把后缀查询转换为可走索引的前缀查询
+
+    :param path: str, 以 / 分隔的相对路径
+    :return: str, 倒序后的路径
+    """
+    return '/'.join(reversed(path.strip('/').split('/')))
+
+
+class OutputIndex:
+    """
+    输出目录树的持久化索引
+
+    在 save_structure 和 save_code_blocks 期间写入，记录每个输出文件的
+    目标路径、语言、大小、行数和来源位置，查询时无需再扫描 code_N 目录。
+    """
+
+    def __init__(self, output_root: str, index_file: str = OUTPUT_INDEX_FILE, autocommit: bool = True):
+        """
+        打开（必要时创建）输出根目录下的索引
+
+        :param output_root: str, 输出根目录（即结构文件夹）
+        :param index_file: str, 索引文件名
+        :param autocommit: bool, 每次写入后立即提交；为 False 时由 commit 或 close 统一提交
+        """
+        self.output_root = os.path.abspath(output_root)
+        self.index_path = os.path.join(self.output_root, index_file)
+        self.autocommit = autocommit
+        # 一次运行的索引会在写入线程或线程池中使用，调用方保证同一时间只有一个线程写入
+        self.connection = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.connection.executescript(_SCHEMA)
+
+    def commit(self) -> None:
+        """
+        提交尚未提交的写入
+
+        :return: None
+        """
+        self.connection.commit()
+
+    def close(self) -> None:
+        """
+        提交尚未提交的写入并关闭索引连接
+
+        :return: None
+        """
+        try:
+            self.connection.commit()
+        finally:
+            self.connection.close()
+
+    def __enter__(self) -> 'OutputIndex':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _relative(self, path: str) -> str:
+        """
+        把输出文件路径转换为相对于输出根目录的 / 分隔路径
+
+        :param path: str, 绝对路径或相对于输出根目录的路径
+        :return: str, 相对路径
+        """
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.output_root)
+        return path.replace(os.sep, '/').strip('/')
+
+    def _upsert(self, rows: Iterable[Dict[str, Any]]) -> int:
+        """
+        批量写入或替换索引记录
+
+        :param rows: Iterable[Dict[str, Any]], 记录列表，必须包含 path 和 kind
+        :return: int, 写入的记录数
+        """
+        values = []
+        for row in rows:
+            path = self._relative(row['path'])
+            values.append((path, _reverse_path(path)) + tuple(row.get(column) for column in _COLUMNS[1:]))
+        sql = (f"INSERT OR REPLACE INTO entries (path, rpath, {', '.join(_COLUMNS[1:])}) "
+               f"VALUES ({', '.join('?' * (len(_COLUMNS) + 1))})")
+        if self.autocommit:
+            with self.connection:
+                self.connection.executemany(sql, values)
+        else:
+            self.connection.executemany(sql, values)
+        return len(values)
+
+    def record_structure_files(self, relative_paths: Iterable[str]) -> int:
+        """
+        记录 save_structure 创建的占位文件
+
+        :param relative_paths: Iterable[str], 相对于输出根目录的文件路径
+        :return: int, 写入的记录数
+        """
+        return self._upsert({'path': path, 'kind': 'structure', 'target_path': path}
+                            for path in relative_paths)
+
+    def record_blocks(self, records: Iterable[Any]) -> int:
+        """
+        记录 save_code_blocks 保存的代码块
+
+        :param records: Iterable[BlockMetadata], 代码块元数据（未成功保存的会被跳过）
+        :return: int, 写入的记录数
+        """
+        return self._upsert({
+            'path': record.output_path,
+            'kind': 'block',
+            'target_path': record.target_path,
+            'language': record.language,
+            'size': record.size,
+            'lines': record.line_count,
+            'source_file': record.source_file,
+            'start_line': record.start_line,
+            'end_line': record.end_line,
+            'sha256': record.content_hash,
+        } for record in records if record.output_path)
+
+    def _fetch(self, sql: str, params: Iterable[Any]) -> List[Dict[str, Any]]:
+        cursor = self.connection.execute(sql, tuple(params))
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def find_path(self, path: str) -> List[Dict[str, Any]]:
+        """
+        按路径查找输出文件，支持完整路径或路径后缀（如 backend/app/__init__.py）
+
+        :param path: str, 要查找的路径
+        :return: List[Dict[str, Any]], 匹配的记录
+        """
+        reversed_path = _reverse_path(path.replace('\\', '/'))
+        # 后缀匹配即倒序路径的前缀匹配；'0' 是 '/' 的下一个字符，用作范围上界
+        return self._fetch(
+            f"SELECT {', '.join(_COLUMNS)} FROM entries WHERE rpath = ? OR (rpath >= ? AND rpath < ?) ORDER BY path",
+            (reversed_path, reversed_path + '/', reversed_path + '0')
+        )
+
+    def query(self, language: Optional[str] = None, kind: Optional[str] = None,
+              min_lines: Optional[int] = None, max_lines: Optional[int] = None,
+              min_size: Optional[int] = None, max_size: Optional[int] = None,
+              source_file: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        按条件查询输出文件
+
+        :param language: Optional[str], 代码语言
+        :param kind: Optional[str], 记录类型（'structure' 或 'block'）
+        :param min_lines: Optional[int], 最小行数
+        :param max_lines: Optional[int], 最大行数
+        :param min_size: Optional[int], 最小字节数
+        :param max_size: Optional[int], 最大字节数
+        :param source_file: Optional[str], 来源文件路径
+        :param limit: Optional[int], 返回记录数上限
+        :return: List[Dict[str, Any]], 匹配的记录
+        """
+        conditions = []
+        params = []
+        for column, operator, value in (
+            ('language', '=', language),
+            ('kind', '=', kind),
+            ('lines', '>=', min_lines),
+            ('lines', '<=', max_lines),
+            ('size', '>=', min_size),
+            ('size', '<=', max_size),
+            ('source_file', '=', source_file),
+        ):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        sql = f"SELECT {', '.join(_COLUMNS)} FROM entries"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY path"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._fetch(sql, params)
+
+    def rebuild_from_tree(self, block_index_file: Optional[str] = None) -> int:
+        """
+        为没有索引的旧输出目录重建索引：遍历目录树，并合并 JSON-lines 元数据索引
+
+        :param block_index_file: Optional[str], 元数据索引文件名，存在时用于补充代码块信息
+        :return: int, 写入的记录数
+        """
+        skip = {os.path.basename(self.index_path)}
+        blocks = {}
+        if block_index_file:
+            skip.add(block_index_file)
+            block_index_path = os.path.join(self.output_root, block_index_file)
+            if os.path.isfile(block_index_path):
+                with open(block_index_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue
+                        if record.get('output_path'):
+                            blocks[self._relative(record['output_path'])] = record
+
+        rows = []
+        for dir_path, _, file_names in os.walk(self.output_root):
+            for file_name in file_names:
+                full_path = os.path.join(dir_path, file_name)
+                path = self._relative(full_path)
+                if path in skip or path == 'project_structure.md':
+                    continue
+                record = blocks.get(path)
+                if record:
+                    rows.append(dict(record, path=path, kind='block'))
+                else:
+                    rows.append({'path': path, 'kind': 'structure', 'target_path': path,
+                                 'size': os.path.getsize(full_path)})
+        count = self._upsert(rows)
+        log_info(f"已重建输出索引: {self.index_path}，共 {count} 条记录")
+        return count
+
+
+@contextmanager
+def output_index_session(output_root: str, index_file: str) -> Iterator[Optional[OutputIndex]]:
+    """
+    为一次运行打开输出索引：期间每个文件的写入都使用同一个连接，结束时统一提交一次
+
+    :param output_root: str, 输出根目录
+    :param index_file: str, 索引文件名
+    :return: Iterator[Optional[OutputIndex]], 打开的索引，无法打开时为 None（此时每次写入单独打开索引）
+    """
+    try:
+        index = OutputIndex(output_root, index_file, autocommit=False)
+    except sqlite3.Error as e:
+        log_error(f"打开输出索引时出错 {output_root}: {str(e)}")
+        index = None
+    try:
+        yield index
+    finally:
+        if index is not None:
+            try:
+                index.close()
+                log_debug(f"输出索引已提交: {index.index_path}")
+            except sqlite3.Error as e:
+                log_error(f"提交输出索引时出错 {output_root}: {str(e)}")
+
+
+def update_output_index(output_root: str, index_file: str, structure_files: Optional[Iterable[str]] = None,
+                        block_records: Optional[Iterable[Any]] = None, index: Optional[OutputIndex] = None) -> None:
+    """
+    在保存阶段更新输出索引；索引写入失败只记录错误，不影响输出
+
+    :param output_root: str, 输出根目录
+    :param index_file: str, 索引文件名
+    :param structure_files: Optional[Iterable[str]], save_structure 创建的相对文件路径
+    :param block_records: Optional[Iterable[BlockMetadata]], save_code_blocks 保存的代码块元数据
+    :param index: Optional[OutputIndex], output_index_session 打开的本次运行的索引，由它在运行结束时提交；
+                  为 None 时单独打开索引并立即提交
+    :return: None
+    """
+    try:
+        if index is not None:
+            count = _record(index, structure_files, block_records)
+        else:
+            with OutputIndex(output_root, index_file) as opened_index:
+                count = _record(opened_index, structure_files, block_records)
+        log_debug(f"输出索引已更新: {count} 条记录")
+    except sqlite3.Error as e:
+        log_error(f"更新输出索引时出错 {output_root}: {str(e)}")
+
+
+def _record(index: OutputIndex, structure_files: Optional[Iterable[str]], block_records: Optional[Iterable[Any]]) -> int:
+    """
+    把结构文件和代码块元数据写入索引
+
+    :return: int, 写入的记录数
+    """
+    count = 0
+    if structure_files:
+        count += index.record_structure_files(structure_files)
+    if block_records:
+        count += index.record_blocks(block_records)
+    return count
@@ -0,0 +1,372 @@
+import contextlib
+import itertools
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from typing import Dict, Iterable, Optional
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+ARCHIVE_EXTENSIONS = {
+    'zip': '.zip',
+    'tar': '.tar',
+    'tar.gz': '.tar.gz',
+}
+
+# 输出方式：目录、内存、空输出以及各种归档格式
+SINK_KINDS = ('directory', 'memory', 'null') + tuple(ARCHIVE_EXTENSIONS)
+
+
+class OutputSink:
+    """
+    输出写入接口
+
+    结构占位文件、project_structure.md 和代码块都通过它写入，调用方只使用
+    输出根目录下的绝对路径，由具体实现决定内容最终落在磁盘、内存还是归档中。
+    """
+
+    # 内容是否最终写入磁盘；为 False 时调用方也不应在磁盘上写入元数据索引
+    writes_to_disk = True
+
+    def __init__(self, root_dir: str):
+        """
+        初始化输出写入器
+
+        :param root_dir: str, 输出根目录（结构文件夹）
+        """
+        self.root_dir = os.path.abspath(root_dir)
+
+    def _relative(self, path: str) -> str:
+        """
+        把输出路径转换为相对于输出根目录的路径
+
+        :param path: str, 绝对路径或相对于输出根目录的路径
+        :return: str, 以 / 分隔的相对路径
+        """
+        full_path = os.path.abspath(os.path.join(self.root_dir, path))
+        relative = os.path.relpath(full_path, self.root_dir).replace(os.sep, '/')
+        if relative == '.' or relative.startswith('../'):
+            raise ValueError(f"路径不在输出根目录中: {path}")
+        return relative
+
+    def makedirs(self, path: str) -> None:
+        """
+        创建目录（包括空目录）
+
+        :param path: str, 目录路径
+        :return: None
+        """
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        """
+        检查文件是否已存在
+
+        :param path: str, 文件路径
+        :return: bool, 是否已存在
+        """
+        raise NotImplementedError
+
+    def write_text(self, path: str, content: str, encoding: str = 'utf-8') -> int:
+        """
+        写入文本文件，已存在的同名文件被覆盖
+
+        :param path: str, 文件路径
+        :param content: str, 文件内容
+        :param encoding: str, 编码
+        :return: int, 写入的字节数
+        """
+        raise NotImplementedError
+
+    def write_chunks(self, path: str, chunks: Iterable[str], encoding: str = 'utf-8') -> int:
+        """
+        分块写入文本文件，用于不应整体读入内存的大文件；默认实现把内容拼接后调用 write_text
+
+        :param path: str, 文件路径
+        :param chunks: Iterable[str], 内容块
+        :param encoding: str, 编码
+        :return: int, 写入的字节数
+        """
+        return self.write_text(path, ''.join(chunks), encoding)
+
+    def close(self) -> Optional[str]:
+        """
+        完成输出
+
+        :return: Optional[str], 生成的归档文件路径，没有归档时返回 None
+        """
+        return None
+
+
+class FileSystemSink(OutputSink):
+    """
+    直接写入输出目录
+    """
+
+    def makedirs(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+    def write_text(self, path: str, content: str, encoding: str = 'utf-8') -> int:
+        with open(path, 'w', encoding=encoding) as f:
+            f.write(content)
+        return os.path.getsize(path)
+
+    def write_chunks(self, path: str, chunks: Iterable[str], encoding: str = 'utf-8') -> int:
+        # 先写入同一目录下的临时文件，完成后再重命名到目标路径，不会留下写了一半的文件
+        temp_path = f"{path}.tmp"
+        try:
+            with open(temp_path, 'w', encoding=encoding) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            # open 失败时临时文件并不存在，删除失败不能掩盖原来的异常
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+            raise
+        return os.path.getsize(path)
+
+
+class MemorySink(OutputSink):
+    """
+    把所有输出保存在内存中，适合测试和嵌入调用
+    """
+
+    writes_to_disk = False
+
+    def __init__(self, root_dir: str):
+        super().__init__(root_dir)
+        self.files: Dict[str, bytes] = {}
+        self.dirs = set()
+
+    def makedirs(self, path: str) -> None:
+        full_path = os.path.abspath(os.path.join(self.root_dir, path))
+        if full_path == self.root_dir:
+            return
+        self.dirs.add(self._relative(full_path))
+
+    def exists(self, path: str) -> bool:
+        return self._relative(path) in self.files
+
+    def write_text(self, path: str, content: str, encoding: str = 'utf-8') -> int:
+        data = content.encode(encoding)
+        self.files[self._relative(path)] = data
+        return len(data)
+
+    def read_text(self, path: str, encoding: str = 'utf-8') -> str:
+        """
+        读取已写入的文件
+
+        :param path: str, 文件路径（绝对路径或相对于输出根目录）
+        :param encoding: str, 编码
+        :return: str, 文件内容
+        """
+        return self.files[self._relative(path)].decode(encoding)
+
+
+class NullSink(OutputSink):
+    """
+    丢弃所有内容，只统计写入的文件数和字节数，用于在没有磁盘写入的情况下衡量解析性能
+    """
+
+    writes_to_disk = False
+
+    def __init__(self, root_dir: str):
+        super().__init__(root_dir)
+        # 只记录路径，使"文件是否已存在"的判断与其他写入器一致
+        self.paths = set()
+        self.bytes_written = 0
+
+    def makedirs(self, path: str) -> None:
+        pass
+
+    def exists(self, path: str) -> bool:
+        return path in self.paths
+
+    def write_text(self, path: str, content: str, encoding: str = 'utf-8') -> int:
+        size = len(content.encode(encoding))
+        self.paths.add(path)
+        self.bytes_written += size
+        return size
+
+    def write_chunks(self, path: str, chunks: Iterable[str], encoding: str = 'utf-8') -> int:
+        size = sum(len(chunk.encode(encoding)) for chunk in chunks)
+        self.paths.add(path)
+        self.bytes_written += size
+        return size
+
+
+class ArchiveSink(OutputSink):
+    """
+    归档输出
+
+    每次写入都直接流式写入暂存目录中的一个文件，并记录 相对路径 -> 暂存文件 的映射，
+    同一路径再次写入时替换映射中的暂存文件，因此内存中只保存路径，不保存文件内容。
+    close 时按路径顺序把每个路径最终的暂存文件流式写入单个 zip 或 tar 归档，
+    归档内的目录布局与直接写入目录时完全相同。
+    """
+
+    writes_to_disk = True
+
+    def __init__(self, root_dir: str, archive_format: str = 'zip'):
+        """
+        初始化归档输出
+
+        :param root_dir: str, 输出根目录（结构文件夹），归档文件保存为 root_dir + 扩展名，
+                         暂存目录创建在它的上级目录中
+        :param archive_format: str, 归档格式：zip、tar 或 tar.gz
+        """
+        if archive_format not in ARCHIVE_EXTENSIONS:
+            raise ValueError(f"不支持的归档格式: {archive_format}")
+        super().__init__(root_dir)
+        self.archive_format = archive_format
+        self.archive_path = self.root_dir + ARCHIVE_EXTENSIONS[archive_format]
+        self.closed = False
+        self.dirs = set()
+        self._staged: Dict[str, str] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        parent_dir = os.path.dirname(self.root_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        self._staging_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(self.root_dir)}-", suffix='.staging', dir=parent_dir)
+
+    def makedirs(self, path: str) -> None:
+        full_path = os.path.abspath(os.path.join(self.root_dir, path))
+        if full_path == self.root_dir:
+            return
+        with self._lock:
+            self.dirs.add(self._relative(full_path))
+
+    def exists(self, path: str) -> bool:
+        return self._relative(path) in self._staged
+
+    def write_text(self, path: str, content: str, encoding: str = 'utf-8') -> int:
+        return self.write_chunks(path, (content,), encoding)
+
+    def write_chunks(self, path: str, chunks: Iterable[str], encoding: str = 'utf-8') -> int:
+        relative = self._relative(path)
+        staged_path = os.path.join(self._staging_dir, f"{next(self._counter):08d}")
+        try:
+            with open(staged_path, 'w', encoding=encoding) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(staged_path)
+            raise
+        with self._lock:
+            replaced = self._staged.get(relative)
+            self._staged[relative] = staged_path
+        if replaced:
+            os.remove(replaced)
+        return os.path.getsize(staged_path)
+
+    def read_text(self, path: str, encoding: str = 'utf-8') -> str:
+        """
+        读取已写入的文件：关闭前从暂存文件读取，关闭后从归档中读取
+
+        :param path: str, 文件路径（绝对路径或相对于输出根目录）
+        :param encoding: str, 编码
+        :return: str, 文件内容
+        """
+        relative = self._relative(path)
+        if not self.closed:
+            with open(self._staged[relative], 'r', encoding=encoding) as f:
+                return f.read()
+        if self.archive_format == 'zip':
+            with zipfile.ZipFile(self.archive_path) as archive:
+                return archive.read(relative).decode(encoding)
+        with tarfile.open(self.archive_path, 'r:*') as archive:
+            return archive.extractfile(relative).read().decode(encoding)
+
+    def close(self) -> Optional[str]:
+        """
+        把所有记录的目录和每个路径最终的暂存文件顺序写入归档，然后删除暂存目录
+
+        :return: Optional[str], 归档文件路径，重复关闭时返回 None
+        """
+        if self.closed:
+            return None
+        self.closed = True
+
+        # 文件所在的目录由文件条目隐含，只需为空目录单独写入条目
+        parents = {path.rsplit('/', 1)[0] for path in self._staged if '/' in path}
+        file_dirs = set()
+        for parent in parents:
+            parts = parent.split('/')
+            file_dirs.update('/'.join(parts[:i]) for i in range(1, len(parts) + 1))
+        empty_dirs = sorted(self.dirs - file_dirs)
+
+        try:
+            if self.archive_format == 'zip':
+                self._write_zip(empty_dirs)
+            else:
+                self._write_tar(empty_dirs)
+        finally:
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+        log_info(f"已写入归档: {self.archive_path}，共 {len(self._staged)} 个文件", important=True)
+        return self.archive_path
+
+    def _write_zip(self, empty_dirs) -> None:
+        """
+        写入 zip 归档，文件内容从暂存文件分块复制
+
+        :param empty_dirs: List[str], 需要单独写入条目的空目录
+        :return: None
+        """
+        with zipfile.ZipFile(self.archive_path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for directory in empty_dirs:
+                archive.writestr(directory + '/', b'')
+            for path in sorted(self._staged):
+                archive.write(self._staged[path], path)
+
+    def _write_tar(self, empty_dirs) -> None:
+        """
+        写入 tar 或 tar.gz 归档，文件内容从暂存文件分块复制
+
+        :param empty_dirs: List[str], 需要单独写入条目的空目录
+        :return: None
+        """
+        mode = 'w:gz' if self.archive_format == 'tar.gz' else 'w'
+        now = time.time()
+        with tarfile.open(self.archive_path, mode) as archive:
+            for directory in empty_dirs:
+                info = tarfile.TarInfo(directory)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                info.mtime = now
+                archive.addfile(info)
+            for path in sorted(self._staged):
+                staged_path = self._staged[path]
+                info = tarfile.TarInfo(path)
+                info.size = os.path.getsize(staged_path)
+                info.mode = 0o644
+                info.mtime = now
+                with open(staged_path, 'rb') as f:
+                    archive.addfile(info, f)
+
+
+def create_output_sink(root_dir: str, kind: Optional[str] = None) -> OutputSink:
+    """
+    按名称创建输出写入器
+
+    :param root_dir: str, 输出根目录（结构文件夹）
+    :param kind: Optional[str], directory、memory、null、zip、tar 或 tar.gz，为空时写入目录
+    :return: OutputSink, 输出写入器
+    """
+    kind = (kind or 'directory').strip()
+    if kind in ARCHIVE_EXTENSIONS:
+        return ArchiveSink(root_dir, kind)
+    if kind == 'memory':
+        return MemorySink(root_dir)
+    if kind == 'null':
+        return NullSink(root_dir)
+    if kind == 'directory':
+        return FileSystemSink(root_dir)
+    raise ValueError(f"不支持的输出方式: {kind}")
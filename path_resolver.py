@@ -0,0 +1,124 @@
+import os
+import threading
+from typing import Dict, Iterable, Set, Tuple
+from output_sinks import OutputSink
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+
+class TargetPathResolver:
+    """
+    输出路径解析器
+
+    在一次运行中把 (根文件夹, 相对路径) 解析为输出根目录下的绝对路径并缓存结果：
+    输出根目录只规范化一次，已创建的目录只调用一次 makedirs，重复保存同一路径只需一次字典查找和一次写入。
+    解析时拒绝跳出输出根目录的路径，并把只有大小写不同的路径统一为第一次出现时的写法，
+    使输出在大小写敏感和不敏感的文件系统上保持一致。
+    """
+
+    def __init__(self, output_sink: OutputSink):
+        """
+        初始化路径解析器
+
+        :param output_sink: OutputSink, 本次运行的输出写入器，它的根目录就是输出根目录
+        """
+        self.output_sink = output_sink
+        self.root_dir = output_sink.root_dir
+        self._resolved: Dict[Tuple[str, ...], str] = {}
+        # 大小写折叠后的路径 -> 第一次出现时的写法，目录和文件共用
+        self._canonical: Dict[str, str] = {self.root_dir.casefold(): self.root_dir}
+        self._created_dirs: Set[str] = {self.root_dir}
+        self._written: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def resolve(self, *parts: str) -> str:
+        """
+        把相对于输出根目录的路径片段解析为绝对路径
+
+        :param parts: str, 路径片段，例如 (根文件夹, 项目内相对路径)，可以包含 / 或 \\
+        :return: str, 输出根目录下的绝对路径
+        :raises ValueError: 路径为空或跳出输出根目录时抛出
+        """
+        resolved = self._resolved.get(parts)
+        if resolved is not None:
+            return resolved
+
+        segments = [segment for part in parts for segment in part.replace('\\', '/').split('/')
+                    if segment and segment != '.']
+        full_path = os.path.normpath(os.path.join(self.root_dir, *segments))
+        if full_path == self.root_dir or os.path.commonpath([self.root_dir, full_path]) != self.root_dir:
+            raise ValueError(f"路径不在输出根目录中: {'/'.join(parts)}")
+
+        with self._lock:
+            resolved = self._resolved.get(parts)
+            if resolved is None:
+                resolved = self._canonicalize(full_path)
+                self._resolved[parts] = resolved
+        return resolved
+
+    def _canonicalize(self, full_path: str) -> str:
+        """
+        逐级把路径统一为第一次出现时的大小写写法
+
+        :param full_path: str, 输出根目录下的绝对路径
+        :return: str, 统一大小写后的路径
+        """
+        current = self.root_dir
+        for segment in os.path.relpath(full_path, self.root_dir).split(os.sep):
+            candidate = os.path.join(current, segment)
+            canonical = self._canonical.setdefault(candidate.casefold(), candidate)
+            if canonical != candidate:
+                log_warning(f"路径只有大小写与已有路径不同，将使用已有路径: {candidate} -> {canonical}")
+            current = canonical
+        return current
+
+    def ensure_dir(self, directory: str) -> None:
+        """
+        创建目录，同一目录只创建一次
+
+        :param directory: str, resolve 返回的目录路径
+        :return: None
+        """
+        if directory in self._created_dirs:
+            return
+        self.output_sink.makedirs(directory)
+        with self._lock:
+            self._created_dirs.add(directory)
+
+    def exists(self, path: str) -> bool:
+        """
+        检查文件是否已写入；本次运行没有写过的路径才询问输出写入器
+
+        :param path: str, resolve 返回的文件路径
+        :return: bool, 是否已存在
+        """
+        return path in self._written or self.output_sink.exists(path)
+
+    def write_text(self, path: str, content: str, encoding: str = 'utf-8') -> int:
+        """
+        写入文件，必要时先创建所在目录
+
+        :param path: str, resolve 返回的文件路径
+        :param content: str, 文件内容
+        :param encoding: str, 编码
+        :return: int, 写入的字节数
+        """
+        self.ensure_dir(os.path.dirname(path))
+        size = self.output_sink.write_text(path, content, encoding)
+        with self._lock:
+            self._written.add(path)
+        return size
+
+    def write_chunks(self, path: str, chunks: Iterable[str], encoding: str = 'utf-8') -> int:
+        """
+        分块写入文件，必要时先创建所在目录
+
+        :param path: str, resolve 返回的文件路径
+        :param chunks: Iterable[str], 内容块
+        :param encoding: str, 编码
+        :return: int, 写入的字节数
+        """
+        self.ensure_dir(os.path.dirname(path))
+        size = self.output_sink.write_chunks(path, chunks, encoding)
+        with self._lock:
+            self._written.add(path)
+        return size
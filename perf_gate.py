@@ -0,0 +1,409 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional, Tuple
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(REPO_DIR, 'perf', 'baseline.json')
+HISTORY_FILE = os.path.join(REPO_DIR, 'perf', 'history.jsonl')
+SAMPLE_FILE = os.path.join(REPO_DIR, 'sample_source_file.md')
+
+# 与参考提交在同一台机器上比较时的容差：吞吐量最多下降 35%（交替运行相同代码时波动仍可达 20% 以上），峰值内存最多增加 20%
+DEFAULT_TOLERANCES = {'throughput': 0.35, 'memory': 0.2}
+
+# 基线只记录与机器无关的输出信息和默认的参考提交；吞吐量和峰值内存只与同一台机器上的参考提交比较
+BASELINE_KEYS = ('tree_sha256', 'output_files', 'code_blocks', 'input_bytes')
+
+# 语料用例：名称 -> 生成参数。transcripts 为生成的转录文件数，blocks 为每个文件的代码块数，
+# block_lines 为每个代码块的行数；sample 表示同时复制仓库中的 sample_source_file.md；
+# timed 为 False 的用例运行时间太短，只检查输出和峰值内存，不检查吞吐量
+CORPUS_CASES = {
+    'sample': {'sample': True, 'transcripts': 0, 'blocks': 0, 'block_lines': 0, 'timed': False},
+    'large': {'sample': False, 'transcripts': 1, 'blocks': 2000, 'block_lines': 100, 'timed': True},
+    'wide': {'sample': True, 'transcripts': 200, 'blocks': 20, 'block_lines': 40, 'timed': True},
+}
+
+LANGUAGES = (('python', 'py'), ('javascript', 'js'), ('css', 'css'), ('html', 'html'))
+
+# 输出树中与运行环境有关的路径在计算哈希前替换为固定占位符
+INPUT_PLACEHOLDER = b'<input>'
+OUTPUT_PLACEHOLDER = b'<output>'
+
+
+def generate_transcript(path: str, seed: int, blocks: int, block_lines: int) -> None:
+    """
+    生成一个确定性的转录文件：开头是项目结构，之后是交替出现的说明文字和代码块
+
+    同一个文件路径会被多个代码块重复写入，用来覆盖后写入生效的逻辑。
+
+    :param path: str, 输出文件路径
+    :param seed: int, 随机种子，相同的种子生成相同的内容
+    :param blocks: int, 代码块数量
+    :param block_lines: int, 每个代码块的行数
+    :return: None
+    """
+    rng = random.Random(seed)
+    project = f'bench{seed}'
+    module_count = max(1, blocks // 4)
+    modules = []
+    for index in range(module_count):
+        lang, extension = LANGUAGES[index % len(LANGUAGES)]
+        modules.append((lang, f'pkg{index % 8}/module{index}.{extension}'))
+
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(f'# 转录 {seed}\n\n{project}/\n')
+        packages = sorted({module_path.split('/')[0] for _, module_path in modules})
+        for package_index, package in enumerate(packages):
+            last_package = package_index == len(packages) - 1
+            f.write(f"{'└──' if last_package else '├──'} {package}/\n")
+            files = [module_path.split('/')[1] for _, module_path in modules if module_path.startswith(package + '/')]
+            for file_index, file_name in enumerate(files):
+                prefix = '    ' if last_package else '│   '
+                f.write(f"{prefix}{'└──' if file_index == len(files) - 1 else '├──'} {file_name}\n")
+        f.write('\n')
+
+        for block in range(blocks):
+            lang, module_path = modules[rng.randrange(module_count)]
+            f.write(f'第 {block} 步：修改 {module_path}。\n\n')
+            if block % 2:
+                f.write(f'## {module_path}\n```{lang}\n')
+            else:
+                f.write(f'```{lang}:{module_path}\n')
+            for line in range(block_lines):
+                if line % 10 == 9:
+                    f.write('\n')
+                else:
+                    f.write(f'value_{block}_{line} = {rng.randrange(1 << 30)}  # {"x" * rng.randrange(40)}\n')
+            f.write('```\n\n')
+
+
+def build_corpus(case: str, input_dir: str) -> int:
+    """
+    生成一个用例的输入目录
+
+    :param case: str, 用例名称
+    :param input_dir: str, 输入目录
+    :return: int, 输入文件的总字节数
+    """
+    spec = CORPUS_CASES[case]
+    os.makedirs(input_dir, exist_ok=True)
+    if spec['sample']:
+        shutil.copyfile(SAMPLE_FILE, os.path.join(input_dir, os.path.basename(SAMPLE_FILE)))
+    for index in range(spec['transcripts']):
+        generate_transcript(os.path.join(input_dir, f'transcript_{index:04d}.md'), index,
+                            spec['blocks'], spec['block_lines'])
+    return sum(entry.stat().st_size for entry in os.scandir(input_dir) if entry.is_file())
+
+
+def hash_output_tree(structure_folder: str, input_dir: str, skip_names: Tuple[str, ...]) -> Tuple[str, int]:
+    """
+    计算输出目录树的哈希：按相对路径排序，依次加入路径和内容
+
+    内容中的输入、输出目录绝对路径会替换为占位符，使不同机器和临时目录上的结果可以比较；
+    元数据索引文件包含修改时间等运行信息，不参与比较。
+
+    :param structure_folder: str, 本次运行的结构文件夹
+    :param input_dir: str, 输入目录
+    :param skip_names: Tuple[str, ...], 不参与比较的文件名
+    :return: Tuple[str, int], (SHA-256, 文件数)
+    """
+    replacements = [(os.path.abspath(structure_folder).encode('utf-8'), OUTPUT_PLACEHOLDER),
+                    (os.path.abspath(input_dir).encode('utf-8'), INPUT_PLACEHOLDER)]
+    paths = []
+    for current_dir, _, file_names in os.walk(structure_folder):
+        for file_name in file_names:
+            if file_name not in skip_names:
+                paths.append(os.path.join(current_dir, file_name))
+
+    digest = hashlib.sha256()
+    relative_paths = sorted(os.path.relpath(path, structure_folder).replace(os.sep, '/') for path in paths)
+    for relative_path in relative_paths:
+        with open(os.path.join(structure_folder, *relative_path.split('/')), 'rb') as f:
+            data = f.read()
+        for old, new in replacements:
+            data = data.replace(old, new)
+        digest.update(relative_path.encode('utf-8') + b'\0')
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest(), len(relative_paths)
+
+
+def _import_resource() -> Optional[Any]:
+    """
+    导入 resource 模块，Windows 上没有该模块时返回 None
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource
+
+
+def run_worker(case: str, input_dir: str, output_dir: str, code_dir: str = REPO_DIR) -> Dict[str, Any]:
+    """
+    在子进程中运行一次完整提取并测量耗时和峰值内存
+
+    :param case: str, 用例名称
+    :param input_dir: str, 输入目录
+    :param output_dir: str, 输出目录
+    :param code_dir: str, 被测代码所在目录（当前工作区或导出的参考提交）
+    :return: Dict[str, Any], 测量结果
+    """
+    sys.path.insert(0, code_dir)
+    import settings as settings_module
+    from extraction_service import ExtractionService
+
+    config = settings_module.load_config(os.path.join(code_dir, 'settings.ini'))
+    settings = settings_module.Settings.from_config(config)
+    # 较早的提交没有日志配置
+    if hasattr(settings_module, 'apply_log_settings'):
+        settings_module.apply_log_settings(settings)
+    service = ExtractionService(config)
+    resource = _import_resource()
+    if resource is None:
+        # 没有 resource 模块时用 tracemalloc 记录 Python 分配的峰值内存；它会拖慢运行，
+        # 但当前工作区和参考提交以同样的方式测量，比较结果仍然有效
+        tracemalloc.start()
+    started = time.perf_counter()
+    result = service.run(input_dir, output_dir, ['.md'], '')
+    elapsed = time.perf_counter() - started
+
+    tree_hash, file_count = hash_output_tree(result['structure_folder'], input_dir,
+                                             (settings.block_index_file, settings.output_index_file))
+    if resource is None:
+        peak_rss = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    else:
+        # ru_maxrss 在 macOS 上的单位是字节，在 Linux 上是 KB
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            peak_rss *= 1024
+    return {
+        'case': case,
+        'seconds': elapsed,
+        'peak_rss': peak_rss,
+        'tree_sha256': tree_hash,
+        'output_files': file_count,
+        'code_blocks': result['code_blocks'],
+    }
+
+
+def measure_case(case: str, repeat: int, work_dir: str, code_dirs: List[str]) -> List[Dict[str, Any]]:
+    """
+    生成用例语料，在独立子进程中用每份代码重复运行，各取最快的一次作为结果
+
+    每次运行都使用新的子进程，峰值内存不受前一次运行和本进程的影响；有多份代码时交替运行，
+    机器负载的波动对各份代码的影响相同。
+
+    :param case: str, 用例名称
+    :param repeat: int, 重复次数
+    :param work_dir: str, 临时工作目录
+    :param code_dirs: List[str], 被测代码目录，第一个为当前工作区
+    :return: List[Dict[str, Any]], 与 code_dirs 对应的测量结果，包括吞吐量（字节/秒）
+    """
+    input_dir = os.path.join(work_dir, case, 'input')
+    input_bytes = build_corpus(case, input_dir)
+    runs: List[List[Dict[str, Any]]] = [[] for _ in code_dirs]
+    for attempt in range(repeat):
+        for code_index, code_dir in enumerate(code_dirs):
+            run_dir = os.path.join(work_dir, case, f'run_{code_index}_{attempt}')
+            os.makedirs(run_dir)
+            # 子进程的工作目录为临时目录，日志文件也写在其中
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--worker', case, input_dir,
+                 os.path.join(run_dir, 'output'), code_dir],
+                cwd=run_dir, capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                raise RuntimeError(f"用例 {case} 运行失败 ({code_dir}):\n{completed.stderr}")
+            runs[code_index].append(json.loads(completed.stdout.strip().splitlines()[-1]))
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    results = []
+    for code_runs in runs:
+        best = min(code_runs, key=lambda run: run['seconds'])
+        hashes = {run['tree_sha256'] for run in code_runs}
+        results.append(dict(best,
+                            input_bytes=input_bytes,
+                            throughput=input_bytes / best['seconds'] if best['seconds'] > 0 else 0.0,
+                            peak_rss=max(run['peak_rss'] for run in code_runs),
+                            stable_output=len(hashes) == 1))
+    return results
+
+
+def check_case(result: Dict[str, Any], baseline: Optional[Dict[str, Any]], tolerances: Dict[str, float],
+               reference: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    把测量结果与基线和参考提交比较
+
+    输出哈希与基线比较，这是与机器无关的硬性检查；吞吐量和峰值内存只与同一台机器上
+    交替运行的参考提交比较，没有参考提交时不检查。
+
+    :param result: Dict[str, Any], 当前工作区的测量结果
+    :param baseline: Optional[Dict[str, Any]], 该用例的基线，没有基线时不检查输出哈希
+    :param tolerances: Dict[str, float], throughput 和 memory 的容差比例
+    :param reference: Optional[Dict[str, Any]], 参考提交的测量结果
+    :return: List[str], 失败原因，通过时为空
+    """
+    failures = []
+    if not result['stable_output']:
+        failures.append('多次运行的输出不一致')
+    if baseline is not None and result['tree_sha256'] != baseline['tree_sha256']:
+        failures.append(f"输出与基线不一致: {result['tree_sha256'][:12]} != {baseline['tree_sha256'][:12]}")
+    if reference is None:
+        return failures
+
+    min_throughput = reference['throughput'] * (1 - tolerances['throughput'])
+    if CORPUS_CASES[result['case']]['timed'] and result['throughput'] < min_throughput:
+        failures.append(f"吞吐量 {result['throughput'] / 1e6:.2f} MB/s 低于参考提交的预算 {min_throughput / 1e6:.2f} MB/s")
+    max_peak_rss = reference['peak_rss'] * (1 + tolerances['memory'])
+    if result['peak_rss'] > max_peak_rss:
+        failures.append(f"峰值内存 {result['peak_rss'] / 2 ** 20:.1f} MiB 超过参考提交的预算 {max_peak_rss / 2 ** 20:.1f} MiB")
+    return failures
+
+
+def export_commit(revision: str, target_dir: str) -> str:
+    """
+    把指定提交的代码导出到目录中，作为同一台机器上的性能参考
+
+    :param revision: str, git 提交、分支或标签
+    :param target_dir: str, 导出目录
+    :return: str, 解析后的提交哈希
+    """
+    commit = subprocess.run(['git', 'rev-parse', '--verify', f'{revision}^{{commit}}'], cwd=REPO_DIR,
+                            capture_output=True, text=True, check=True).stdout.strip()
+    archive = subprocess.run(['git', 'archive', '--format=tar', commit], cwd=REPO_DIR, capture_output=True, check=True).stdout
+    os.makedirs(target_dir)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target_dir)
+    return commit
+
+
+def current_commit() -> Optional[str]:
+    """
+    获取当前的 git 提交，工作区有未提交的修改时加上 -dirty（基线文件本身的修改不计算在内）
+
+    :return: Optional[str], 提交哈希，不在 git 仓库中时为 None
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no', '--', '.',
+                                ':(exclude)' + os.path.relpath(BASELINE_FILE, REPO_DIR)],
+                               cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    """
+    读取基线文件，文件不存在时返回空基线
+
+    :param path: str, 基线文件路径
+    :return: Dict[str, Any], 包含 tolerances、reference（默认参考提交）和 cases 的基线
+    """
+    if not os.path.isfile(path):
+        return {'tolerances': dict(DEFAULT_TOLERANCES), 'reference': None, 'cases': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    baseline['tolerances'] = dict(DEFAULT_TOLERANCES, **baseline.get('tolerances', {}))
+    baseline.setdefault('cases', {})
+    baseline.setdefault('reference', None)
+    return baseline
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Auto Save Code 性能回归检查')
+    parser.add_argument('--cases', nargs='+', choices=sorted(CORPUS_CASES), default=sorted(CORPUS_CASES), help='要运行的用例')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例的运行次数，取最快的一次')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='基线文件（输出哈希）')
+    parser.add_argument('--against', metavar='REV', help='在本机交替运行该提交作为参考，检查吞吐量和峰值内存是否退化，默认使用基线中的 reference')
+    parser.add_argument('--no-reference', action='store_true', help='不运行参考提交，只检查输出哈希')
+    parser.add_argument('--history', default=HISTORY_FILE, help='追加记录每次检查结果的 JSON Lines 文件（只保存在本机，不提交）')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果更新基线，而不是与基线比较')
+    parser.add_argument('--worker', nargs=4, metavar=('CASE', 'INPUT', 'OUTPUT', 'CODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_worker(*args.worker)))
+        return 0
+
+    commit = current_commit()
+    if args.update_baseline and (commit is None or commit.endswith('-dirty')):
+        print("基线只能在没有未提交修改的提交上记录，请先提交或暂存修改")
+        return 2
+
+    baseline = load_baseline(args.baseline)
+    tolerances = baseline['tolerances']
+    # 更新基线时不需要参考提交；否则默认与基线中记录的提交比较
+    against = None if args.update_baseline or args.no_reference else args.against or baseline['reference']
+    if against is None and not (args.update_baseline or args.no_reference):
+        print("基线中没有参考提交，只检查输出哈希；可以用 --against 指定参考提交")
+    work_dir = tempfile.mkdtemp(prefix='auto_save_code_perf_')
+    results = {}
+    references = {}
+    reference_commit = None
+    failed = False
+    try:
+        code_dirs = [REPO_DIR]
+        if against:
+            try:
+                reference_commit = export_commit(against, os.path.join(work_dir, 'reference'))
+            except subprocess.CalledProcessError:
+                print(f"无法导出参考提交 {against}，请用 --against 指定本地存在的提交，或用 --no-reference 只检查输出哈希")
+                return 2
+            code_dirs.append(os.path.join(work_dir, 'reference'))
+            print(f"参考提交: {reference_commit}")
+        for case in args.cases:
+            measured = measure_case(case, max(1, args.repeat), work_dir, code_dirs)
+            result = measured[0]
+            reference = measured[1] if against else None
+            failures = [] if args.update_baseline else check_case(result, baseline['cases'].get(case), tolerances, reference)
+            result['failures'] = failures
+            results[case] = result
+            if reference is not None:
+                references[case] = reference
+            failed = failed or bool(failures)
+            status = '失败' if failures else '通过'
+            print(f"{case}: {status} - {result['seconds']:.2f} 秒, {result['throughput'] / 1e6:.2f} MB/s, "
+                  f"峰值内存 {result['peak_rss'] / 2 ** 20:.1f} MiB, {result['output_files']} 个输出文件")
+            if reference is not None:
+                print(f"  参考提交: {reference['seconds']:.2f} 秒, {reference['throughput'] / 1e6:.2f} MB/s, "
+                      f"峰值内存 {reference['peak_rss'] / 2 ** 20:.1f} MiB")
+            for failure in failures:
+                print(f"  {failure}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.history)), exist_ok=True)
+    with open(args.history, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'time': time.time(), 'commit': commit, 'passed': not failed,
+                            'update_baseline': args.update_baseline, 'results': results,
+                            'reference_commit': reference_commit, 'reference_results': references},
+                           ensure_ascii=False) + '\n')
+
+    if args.update_baseline:
+        for case, result in results.items():
+            baseline['cases'][case] = dict({key: result[key] for key in BASELINE_KEYS}, commit=commit)
+        # 之后的检查默认与记录基线的提交比较吞吐量和峰值内存
+        baseline['reference'] = commit
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"基线已更新: {args.baseline}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
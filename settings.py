@@ -0,0 +1,404 @@
+import os
+import re
+import configparser
+import threading
+from dataclasses import dataclass
+from typing import Any, FrozenSet, List, Optional, Pattern, Tuple, Union
+from logging_utils import LOG_FORMATS, LOG_LEVELS, get_logger, log_info, log_warning, log_error, log_debug
+
+SETTINGS_FILE = 'settings.ini'
+
+DEFAULT_SETTINGS = {
+    'Symbols': {'directory': '/', 'file': ''},
+    'FileTypes': {'types': '.md, .js, .html, .css'},
+    'Extraction': {
+        'max_file_size': '10485760',
+        'encoding': 'utf-8',
+        'pipeline': 'false',
+        'pipeline_queue_size': '4',
+        'max_concurrency': '4',
+        'file_timeout': '0',
+        'spill_threshold': '8388608',
+        'spill_dir': '',
+        'input_order': 'name',
+    },
+    'Output': {
+        'structure_file': 'project_structure.md',
+        'block_index_file': 'block_index.jsonl',
+        'output_index_file': 'output_index.sqlite',
+        'archive_format': '',
+        'diff_workers': '4',
+    },
+    'StructureDiscovery': {'special_chars': '├, │, └, ─', 'workers': '8'},
+    'code_block_detection': {
+        'start_marker': '```',
+        'end_marker': '```',
+        'min_occurrences': '2',
+        'indentation_level': '4',
+        'heading_window': '2',
+    },
+    'Daemon': {'host': '127.0.0.1', 'port': '8765', 'workers': '2', 'token': '', 'output_root': 'daemon_output'},
+    'Logging': {'level': 'info', 'module_levels': '', 'progress_interval': '5', 'format': 'text'},
+}
+
+# 代码块上方标注文件路径的默认格式：Markdown 标题（## src/main.py）或单独一行的粗体路径
+DEFAULT_HEADING_PATTERNS = (
+    r'^#{1,6}\s+`?([^`]*?/[^`]*?\.[A-Za-z0-9]+)`?\s*$',
+    r'^\*\*`?([^`*]*?/[^`*]*?\.[A-Za-z0-9]+)`?\*\*:?\s*$',
+)
+
+ARCHIVE_FORMATS = ('zip', 'tar', 'tar.gz')
+
+# 输入文件的处理顺序：按文件名，或按修改时间（较早的在前，较新的文件最后写入）
+INPUT_ORDERS = ('name', 'mtime')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    解析并校验后的只读配置快照
+
+    所有组件在处理过程中只读取这里已经转换好的字段，不再调用 configparser；
+    配置变化时整体替换为新的快照，而不是修改已有对象。
+    """
+
+    file_types: FrozenSet[str]
+    max_file_size: int
+    encoding: str
+    spill_threshold: int
+    spill_dir: str
+    input_order: str
+    structure_file: str
+    block_index_file: str
+    output_index_file: str
+    archive_format: str
+    diff_workers: int
+    special_chars: Tuple[str, ...]
+    discovery_workers: int
+    start_marker: str
+    end_marker: str
+    min_fence_length: int
+    heading_patterns: Tuple[Pattern, ...]
+    heading_window: int
+    min_occurrences: int
+    indentation_level: int
+    pipeline: bool
+    pipeline_queue_size: int
+    max_concurrency: int
+    file_timeout: float
+    daemon_host: str
+    daemon_port: int
+    daemon_workers: int
+    daemon_token: str
+    daemon_output_root: str
+    log_level: str
+    module_log_levels: Tuple[Tuple[str, str], ...]
+    progress_interval: float
+    log_format: str
+
+    @classmethod
+    def from_config(cls, config: configparser.ConfigParser) -> 'Settings':
+        """
+        从 ConfigParser 解析配置快照，缺少的选项使用默认值
+
+        :param config: configparser.ConfigParser, 配置对象
+        :return: Settings, 配置快照
+        :raises ValueError: 配置值无效时抛出，错误信息包含所有无效项
+        """
+        errors = []
+
+        def get(section: str, option: str) -> str:
+            return config.get(section, option, fallback=DEFAULT_SETTINGS[section][option]).strip()
+
+        def get_int(section: str, option: str, minimum: int) -> int:
+            raw = get(section, option)
+            try:
+                value = int(raw)
+            except ValueError:
+                errors.append(f"[{section}] {option} 必须是整数: {raw}")
+                return int(DEFAULT_SETTINGS[section][option])
+            if value < minimum:
+                errors.append(f"[{section}] {option} 不能小于 {minimum}: {value}")
+            return value
+
+        def get_float(section: str, option: str) -> float:
+            raw = get(section, option)
+            try:
+                value = float(raw)
+            except ValueError:
+                errors.append(f"[{section}] {option} 必须是数字: {raw}")
+                return float(DEFAULT_SETTINGS[section][option])
+            if value < 0:
+                errors.append(f"[{section}] {option} 不能小于 0: {value}")
+            return value
+
+        def get_bool(section: str, option: str) -> bool:
+            try:
+                return config.getboolean(section, option, fallback=DEFAULT_SETTINGS[section][option] == 'true')
+            except ValueError:
+                errors.append(f"[{section}] {option} 必须是 true 或 false: {config.get(section, option)}")
+                return False
+
+        archive_format = get('Output', 'archive_format')
+        if archive_format and archive_format not in ARCHIVE_FORMATS:
+            errors.append(f"[Output] archive_format 必须为空或 {', '.join(ARCHIVE_FORMATS)} 之一: {archive_format}")
+
+        input_order = get('Extraction', 'input_order')
+        if input_order not in INPUT_ORDERS:
+            errors.append(f"[Extraction] input_order 必须是 {', '.join(INPUT_ORDERS)} 之一: {input_order}")
+
+        log_level = get('Logging', 'level').lower()
+        if log_level not in LOG_LEVELS:
+            errors.append(f"[Logging] level 必须是 {', '.join(LOG_LEVELS)} 之一: {log_level}")
+            log_level = DEFAULT_SETTINGS['Logging']['level']
+        log_format = get('Logging', 'format').lower()
+        if log_format not in LOG_FORMATS:
+            errors.append(f"[Logging] format 必须是 {', '.join(LOG_FORMATS)} 之一: {log_format}")
+
+        start_marker = get('code_block_detection', 'start_marker')
+        settings = cls(
+            file_types=parse_file_types(get('FileTypes', 'types')),
+            max_file_size=get_int('Extraction', 'max_file_size', 1),
+            encoding=get('Extraction', 'encoding') or 'utf-8',
+            spill_threshold=get_int('Extraction', 'spill_threshold', 0),
+            spill_dir=get('Extraction', 'spill_dir'),
+            input_order=input_order,
+            structure_file=get('Output', 'structure_file'),
+            block_index_file=get('Output', 'block_index_file'),
+            output_index_file=get('Output', 'output_index_file'),
+            archive_format=archive_format,
+            diff_workers=get_int('Output', 'diff_workers', 1),
+            special_chars=tuple(char.strip() for char in get('StructureDiscovery', 'special_chars').split(',') if char.strip()),
+            discovery_workers=get_int('StructureDiscovery', 'workers', 1),
+            start_marker=start_marker,
+            end_marker=get('code_block_detection', 'end_marker'),
+            min_fence_length=get_min_fence_length(start_marker),
+            heading_patterns=_compile_heading_patterns(
+                config.get('code_block_detection', 'heading_patterns', fallback=''), errors
+            ),
+            heading_window=get_int('code_block_detection', 'heading_window', 0),
+            min_occurrences=get_int('code_block_detection', 'min_occurrences', 0),
+            indentation_level=get_int('code_block_detection', 'indentation_level', 0),
+            pipeline=get_bool('Extraction', 'pipeline'),
+            pipeline_queue_size=get_int('Extraction', 'pipeline_queue_size', 1),
+            max_concurrency=get_int('Extraction', 'max_concurrency', 1),
+            file_timeout=get_float('Extraction', 'file_timeout'),
+            daemon_host=get('Daemon', 'host'),
+            daemon_port=get_int('Daemon', 'port', 0),
+            daemon_workers=get_int('Daemon', 'workers', 1),
+            daemon_token=get('Daemon', 'token'),
+            daemon_output_root=get('Daemon', 'output_root') or DEFAULT_SETTINGS['Daemon']['output_root'],
+            log_level=log_level,
+            module_log_levels=_parse_module_log_levels(get('Logging', 'module_levels'), errors),
+            progress_interval=get_float('Logging', 'progress_interval'),
+            log_format=log_format,
+        )
+        if errors:
+            raise ValueError("配置无效: " + "；".join(errors))
+        return settings
+
+    @classmethod
+    def coerce(cls, config: Union['Settings', configparser.ConfigParser, None]) -> 'Settings':
+        """
+        把 ConfigParser 或已有快照统一转换为快照，None 时读取当前目录的 settings.ini
+
+        :param config: Union[Settings, configparser.ConfigParser, None], 配置
+        :return: Settings, 配置快照
+        """
+        if isinstance(config, cls):
+            return config
+        if config is None:
+            return load_settings()
+        return cls.from_config(config)
+
+    def file_type_list(self) -> List[str]:
+        """
+        以带点扩展名列表的形式返回文件类型，供 collect_input_files 等接口使用
+
+        :return: List[str], 例如 ['.css', '.md']
+        """
+        return sorted(f'.{ext}' if ext else '' for ext in self.file_types)
+
+    def matches_file_type(self, file_name: str) -> bool:
+        """
+        检查文件名的扩展名是否属于配置的文件类型
+
+        :param file_name: str, 文件名
+        :return: bool, 是否匹配
+        """
+        return os.path.splitext(file_name)[1].lower().lstrip('.') in self.file_types
+
+
+def parse_file_types(raw: str) -> FrozenSet[str]:
+    """
+    解析逗号分隔的文件类型，统一为不带点的小写扩展名
+
+    :param raw: str, 例如 ".md, .JS,html"
+    :return: FrozenSet[str], 例如 {'md', 'js', 'html'}
+    """
+    return frozenset(ft.strip().lower().lstrip('.') for ft in raw.split(',') if ft.strip())
+
+
+def get_min_fence_length(start_marker: str) -> int:
+    """
+    由配置的开始标志确定围栏的最小长度
+
+    开始标志由同一种围栏字符组成时（例如 ```` 或 ~~~~），其长度就是最小围栏长度；
+    结束围栏总是由对应的开始围栏决定，不再单独配置。
+
+    :param start_marker: str, 配置的代码块开始标志
+    :return: int, 最小围栏长度，不小于 3
+    """
+    marker = start_marker.strip()
+    if marker and len(set(marker)) == 1 and marker[0] in '`~':
+        return max(3, len(marker))
+    return 3
+
+
+def _compile_heading_patterns(raw: str, errors: List[str]) -> Tuple[Pattern, ...]:
+    """
+    预编译标注文件路径的行格式：每行一个正则表达式，第一个分组为文件路径
+
+    :param raw: str, [code_block_detection] heading_patterns 的原始值
+    :param errors: List[str], 收集错误信息的列表
+    :return: Tuple[Pattern, ...], 编译好的正则表达式，未配置时使用 DEFAULT_HEADING_PATTERNS
+    """
+    patterns = [line.strip() for line in raw.splitlines() if line.strip()] or DEFAULT_HEADING_PATTERNS
+    compiled = []
+    for pattern in patterns:
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            errors.append(f"[code_block_detection] heading_patterns 中的正则表达式无效 {pattern}: {str(e)}")
+            continue
+        if regex.groups < 1:
+            errors.append(f"[code_block_detection] heading_patterns 中的正则表达式缺少路径分组: {pattern}")
+            continue
+        compiled.append(regex)
+    return tuple(compiled)
+
+
+def _parse_module_log_levels(raw: str, errors: List[str]) -> Tuple[Tuple[str, str], ...]:
+    """
+    解析各模块的日志级别
+
+    :param raw: str, [Logging] module_levels 的原始值，例如 "code_block_detector=warning, gui=debug"
+    :param errors: List[str], 收集错误信息的列表
+    :return: Tuple[Tuple[str, str], ...], (模块名, 级别) 元组
+    """
+    levels = []
+    for item in raw.split(','):
+        if not item.strip():
+            continue
+        module, _, level = item.partition('=')
+        module, level = module.strip().removesuffix('.py'), level.strip().lower()
+        if not module or level not in LOG_LEVELS:
+            errors.append(f"[Logging] module_levels 中的项应为 模块名={'|'.join(LOG_LEVELS)}: {item.strip()}")
+            continue
+        levels.append((module, level))
+    return tuple(levels)
+
+
+def apply_log_settings(settings: Settings) -> None:
+    """
+    把配置快照中的日志级别和日志格式应用到全局日志对象
+
+    :param settings: Settings, 配置快照
+    :return: None
+    """
+    logger = get_logger()
+    logger.set_levels(settings.log_level, dict(settings.module_log_levels), settings.progress_interval)
+    logger.set_format(settings.log_format)
+
+
+def load_config(settings_path: str = SETTINGS_FILE) -> configparser.ConfigParser:
+    """
+    读取配置文件，缺少的选项使用默认值；从不写回配置文件
+
+    :param settings_path: str, 配置文件路径，不存在时只使用默认值
+    :return: configparser.ConfigParser, 配置对象
+    """
+    config = configparser.ConfigParser()
+    config.read_dict(DEFAULT_SETTINGS)
+    if os.path.exists(settings_path):
+        config.read(settings_path, encoding='utf-8')
+    return config
+
+
+def load_settings(settings_path: str = SETTINGS_FILE) -> Settings:
+    """
+    读取配置文件并解析为只读快照
+
+    :param settings_path: str, 配置文件路径
+    :return: Settings, 配置快照
+    """
+    return Settings.from_config(load_config(settings_path))
+
+
+class SettingsManager:
+    """
+    配置文件热加载
+
+    get 只比较配置文件的修改时间，变化时重新解析并整体替换快照；解析失败时保留旧快照。
+    调用方在文件之间调用 get，比较返回的快照是否与正在使用的是同一个对象来决定是否切换。
+    """
+
+    def __init__(self, settings_path: str = SETTINGS_FILE):
+        """
+        初始化配置管理器并加载初始快照
+
+        :param settings_path: str, 配置文件路径
+        """
+        self.settings_path = settings_path
+        self._lock = threading.Lock()
+        self._mtime = self._get_mtime()
+        self._current = load_settings(settings_path)
+
+    def _get_mtime(self) -> Optional[int]:
+        """
+        获取配置文件的修改时间
+
+        :return: Optional[int], 纳秒级修改时间，文件不存在时返回 None
+        """
+        try:
+            return os.stat(self.settings_path).st_mtime_ns
+        except OSError:
+            return None
+
+    @property
+    def current(self) -> Settings:
+        """
+        当前快照（不检查文件变化）
+        """
+        return self._current
+
+    def get(self) -> Settings:
+        """
+        检查配置文件是否变化并返回最新的快照
+
+        :return: Settings, 配置快照
+        """
+        mtime = self._get_mtime()
+        if mtime == self._mtime:
+            return self._current
+        with self._lock:
+            if mtime != self._mtime:
+                self._mtime = mtime
+                try:
+                    self._current = load_settings(self.settings_path)
+                    apply_log_settings(self._current)
+                    log_info(f"配置文件已变化，重新加载: {self.settings_path}", important=True)
+                except (ValueError, configparser.Error) as e:
+                    log_error(f"重新加载配置失败，继续使用原有配置: {str(e)}", important=True)
+        return self._current
+
+    def watch(self, component: Any) -> None:
+        """
+        如果配置发生变化，把新的快照交给组件
+
+        :param component: Any, 具有 settings 属性和 apply_settings 方法的组件
+        :return: None
+        """
+        settings = self.get()
+        if settings is not component.settings:
+            component.apply_settings(settings)
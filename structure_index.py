@@ -0,0 +1,85 @@
+from typing import Dict, Iterable, List, Tuple
+from logging_utils import log_info, log_warning, log_error, log_debug
+
+
+class _SuffixNode:
+    """
+    后缀树节点：children 以路径片段（大小写折叠后）为键，matches 为以该后缀结尾的所有声明文件
+    """
+
+    __slots__ = ('children', 'matches')
+
+    def __init__(self):
+        self.children: Dict[str, '_SuffixNode'] = {}
+        self.matches: List[Tuple[str, str]] = []
+
+
+class StructureSuffixIndex:
+    """
+    声明文件的路径后缀索引
+
+    把文件结构中声明的每个文件路径按片段倒序插入前缀树，使代码块标注的部分路径
+    （例如 app/__init__.py 对应 backend/app/__init__.py）只需沿树走过路径长度个节点即可找到
+    所有以它结尾的声明文件。路径比较不区分大小写，与输出路径解析保持一致。
+    """
+
+    def __init__(self):
+        self._root = _SuffixNode()
+        self.file_count = 0
+
+    @staticmethod
+    def split_path(path: str) -> List[str]:
+        """
+        把路径拆分为片段，忽略空片段和 .
+
+        :param path: str, 以 / 或 \\ 分隔的路径
+        :return: List[str], 路径片段
+        """
+        return [part for part in path.replace('\\', '/').split('/') if part and part != '.']
+
+    def add(self, root_folder: str, relative_path: str) -> None:
+        """
+        添加一个声明文件
+
+        :param root_folder: str, 文件所属项目的根文件夹名称
+        :param relative_path: str, 文件相对于根文件夹的路径
+        :return: None
+        """
+        parts = self.split_path(relative_path)
+        if not parts:
+            return
+        match = (root_folder, '/'.join(parts))
+        node = self._root
+        # 根文件夹名称作为最深的片段，使带项目名前缀的路径同样可以匹配
+        for part in reversed([root_folder] + parts):
+            node = node.children.setdefault(part.casefold(), _SuffixNode())
+            node.matches.append(match)
+        self.file_count += 1
+
+    def add_tree(self, root_folder: str, relative_paths: Iterable[str]) -> None:
+        """
+        添加一个项目中声明的所有文件
+
+        :param root_folder: str, 项目的根文件夹名称
+        :param relative_paths: Iterable[str], 相对于根文件夹的文件路径
+        :return: None
+        """
+        for relative_path in relative_paths:
+            self.add(root_folder, relative_path)
+
+    def find(self, path: str) -> List[Tuple[str, str]]:
+        """
+        查找以给定路径结尾的所有声明文件
+
+        :param path: str, 代码块标注的路径（可以是部分路径）
+        :return: List[Tuple[str, str]], (根文件夹, 相对于根文件夹的路径) 列表，没有匹配时为空
+        """
+        parts = self.split_path(path)
+        if not parts:
+            return []
+        node = self._root
+        for part in reversed(parts):
+            node = node.children.get(part.casefold())
+            if node is None:
+                return []
+        return node.matches
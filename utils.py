@@ -1,20 +1,55 @@
 import os
+import re
+from types import MappingProxyType
 from logging_utils import log_info, log_warning, log_error, log_debug
 
-def create_unique_output_dir(base_dir):
-    if not os.path.exists(base_dir):
-        os.makedirs(base_dir)
+def allocate_output_dir(parent_dir, prefix='code', max_attempts=1000):
+    """
+    在父目录下分配一个新的输出目录：优先使用 prefix，已存在时使用 prefix_N
+
+    只列出一次父目录找到现有的最大序号，然后用 os.mkdir 原子地占用下一个序号；
+    并发运行时如果序号被抢先占用，则继续尝试下一个。
+
+    :param parent_dir: str, 父目录
+    :param prefix: str, 目录名前缀
+    :param max_attempts: int, 发生冲突时的最大重试次数
+    :return: str, 新创建的目录路径
+    """
+    os.makedirs(parent_dir, exist_ok=True)
+
+    base_dir = os.path.join(parent_dir, prefix)
+    try:
+        os.mkdir(base_dir)
         log_info(f"创建新目录: {base_dir}")
         return base_dir
+    except FileExistsError:
+        pass
+
+    pattern = re.compile(rf'^{re.escape(prefix)}_(\d+)$')
+    highest = 0
+    with os.scandir(parent_dir) as entries:
+        for entry in entries:
+            match = pattern.match(entry.name)
+            if match:
+                highest = max(highest, int(match.group(1)))
 
-    index = 1
-    while True:
-        new_dir = f"{base_dir}_{index}"
-        if not os.path.exists(new_dir):
-            os.makedirs(new_dir)
+    index = highest + 1
+    for _ in range(max_attempts):
+        new_dir = os.path.join(parent_dir, f"{prefix}_{index}")
+        try:
+            os.mkdir(new_dir)
             log_info(f"创建新目录: {new_dir}")
             return new_dir
-        index += 1
+        except FileExistsError:
+            index += 1
+
+    log_error(f"无法在 {parent_dir} 中分配输出目录: 连续 {max_attempts} 次冲突")
+    raise FileExistsError(f"无法在 {parent_dir} 中分配以 {prefix} 开头的输出目录")
+
+def create_unique_output_dir(base_dir):
+    base_dir = os.path.normpath(base_dir)
+    # 只有目录名的相对路径（如 code）的上级目录为空字符串，此时在当前目录中分配
+    return allocate_output_dir(os.path.dirname(os.path.abspath(base_dir)) or '.', os.path.basename(base_dir))
 
 def normalize_path(path):
     normalized_path = os.path.normpath(path)
@@ -32,20 +67,99 @@ def is_valid_path(path):
         log_error(f"无效的路径: {path}")
         return False
 
+def _comment_styles(style, *extensions):
+    """
+    为一组扩展名生成相同的注释格式
+    """
+    return {extension: style for extension in extensions}
+
+
+# 扩展名 -> (注释开始, 注释结束)，行注释的注释结束为空；None 表示该格式没有注释语法。
+# 在导入时构建一次，之后只读
+COMMENT_STYLES = MappingProxyType({
+    **_comment_styles(('#', ''), '.py', '.sh', '.bash', '.zsh', '.rb', '.pl', '.r', '.ps1',
+                      '.yaml', '.yml', '.toml', '.cfg', '.conf', '.ini', '.txt', '.dockerfile', '.mk'),
+    **_comment_styles(('//', ''), '.js', '.jsx', '.mjs', '.cjs', '.ts', '.tsx', '.java', '.c', '.h',
+                      '.cpp', '.cc', '.hpp', '.cs', '.go', '.rs', '.swift', '.kt', '.kts', '.scala',
+                      '.php', '.dart', '.groovy', '.scss', '.less'),
+    **_comment_styles(('/*', ' */'), '.css'),
+    **_comment_styles(('<!--', ' -->'), '.html', '.htm', '.xml', '.svg', '.vue', '.md'),
+    **_comment_styles(('--', ''), '.sql', '.lua', '.hs'),
+    **_comment_styles(('REM', ''), '.bat', '.cmd'),
+    **_comment_styles(None, '.json', '.ipynb', '.csv', '.lock'),
+})
+DEFAULT_COMMENT_STYLE = ('#', '')
+# 必须保持在文件开头的行，文件头插入在它们之后：shebang、XML 声明、PHP 开始标记、HTML 文档类型、
+# 批处理的 @echo off，以及 Python 编码声明（必须在前两行内）
+_LEADING_LINE_PATTERN = re.compile(r'^(#!|<\?xml|<\?php|<!doctype|@echo\b|[ \t\f]*#.*?coding[:=])', re.IGNORECASE)
+_MAX_LEADING_LINES = 2
+# 注释只在代码标记之内有效的格式：标记之外的注释会作为页面内容输出，这时不加文件头
+_CODE_OPENING_TAGS = MappingProxyType({'.php': ('<?php', '?>')})
+
+
+def get_comment_style(file_extension):
+    """
+    获取文件类型的注释格式
+
+    :param file_extension: str, 文件扩展名（包括点）
+    :return: Optional[Tuple[str, str]], (注释开始, 注释结束)，没有注释语法时返回 None
+    """
+    return COMMENT_STYLES.get(file_extension.lower(), DEFAULT_COMMENT_STYLE)
+
+
 def get_comment_syntax(file_extension):
-    comment_syntax = {
-        '.py': '#',
-        '.js': '//',
-        '.java': '//',
-        '.c': '//',
-        '.cpp': '//',
-        '.html': '<!--',
-        '.css': '/*',
-        '.md': '[comment]: #',
-        '.sh': '#',
-        '.bat': 'REM',
-        '.ps1': '#'
-    }
-    syntax = comment_syntax.get(file_extension.lower(), '#')
-    log_debug(f"文件扩展名 {file_extension} 的注释语法: {syntax}")
-    return syntax
\ No newline at end of file
+    """
+    获取文件类型的注释开始标记
+
+    :param file_extension: str, 文件扩展名（包括点）
+    :return: str, 注释开始标记，没有注释语法时返回空字符串
+    """
+    style = get_comment_style(file_extension)
+    return style[0] if style else ''
+
+
+def add_file_header(file_path, content, header_lines):
+    """
+    按文件类型的注释格式在内容前加上文件头；没有注释语法的格式（如 .json）不加文件头
+
+    :param file_path: str, 目标文件路径，用于确定注释格式
+    :param content: str, 文件内容
+    :param header_lines: List[str], 文件头的各行文字（不含注释标记）
+    :return: str, 加上文件头后的内容
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    style = get_comment_style(extension)
+    if style is None or not header_lines:
+        return content
+    if extension in _CODE_OPENING_TAGS:
+        opening_tag, closing_tag = _CODE_OPENING_TAGS[extension]
+        first_line = content.partition('\n')[0]
+        if not first_line.lower().startswith(opening_tag) or closing_tag in first_line:
+            return content
+    opener, closer = style
+    header = ''.join(f"{opener} {line}{closer}\n" for line in header_lines)
+
+    leading = []
+    rest = content
+    while len(leading) < _MAX_LEADING_LINES and _LEADING_LINE_PATTERN.match(rest):
+        line, newline, rest = rest.partition('\n')
+        leading.append(line + '\n')
+        if not newline:
+            break
+    return ''.join(leading) + header + rest
+
+
+if __name__ == "__main__":
+    # 自检：只写目录名的相对路径在当前目录中分配输出目录
+    import tempfile
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.chdir(work_dir)
+        try:
+            os.mkdir('code')
+            allocated = create_unique_output_dir('code')
+            assert os.path.realpath(allocated) == os.path.realpath(os.path.join(work_dir, 'code_1')), allocated
+            print(f"create_unique_output_dir('code') -> {allocated}")
+        finally:
+            os.chdir(original_dir)